@@ -0,0 +1,27 @@
+# Copyright 2018 PayTrace, Inc.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Performance benchmarks for intercom_test
+
+The modules of this package run from the root of a working copy (e.g.
+``python -m benchmarks.run``) and always measure the code in this working
+copy's ``lib`` directory, regardless of any installed version.
+"""
+
+import os.path
+import sys
+
+LIB_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lib')
+if LIB_DIR not in sys.path:
+    sys.path.insert(0, LIB_DIR)
@@ -0,0 +1,95 @@
+# Copyright 2018 PayTrace, Inc.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compare two benchmark result files written by :mod:`.run`
+
+For each benchmark and scale present in both files, the median wall times,
+throughputs and peak memory are shown along with the ratio of the second
+(*candidate*) to the first (*baseline*)::
+
+    python -m benchmarks.compare before.json after.json
+
+With ``--threshold``, the exit status is 1 if any median wall time grew by
+more than the given fraction (e.g. ``0.1`` for 10%).
+"""
+
+import argparse
+import json
+import sys
+
+def load(file_path):
+    with open(file_path) as instream:
+        results = json.load(instream)
+    return dict(
+        ((result['benchmark'], result['scale']), result)
+        for result in results['results']
+    )
+
+def compare(baseline, candidate):
+    """Generate ``(benchmark, scale, baseline_result, candidate_result)`` for common keys"""
+    for key in sorted(set(baseline) & set(candidate)):
+        yield key + (baseline[key], candidate[key])
+
+def _ratio(new, old):
+    if not old:
+        return None
+    return new / old
+
+def _format_ratio(ratio):
+    return '-' if ratio is None else '{:.2f}x'.format(ratio)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare intercom_test benchmark results")
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument(
+        '--threshold', type=float,
+        help="fail if any median wall time grew by more than this fraction",
+    )
+    args = parser.parse_args(argv)
+    baseline, candidate = load(args.baseline), load(args.candidate)
+    
+    row_format = "{:<38} {:<7} {:>11} {:>11} {:>7} {:>13} {:>7}"
+    print(row_format.format(
+        "benchmark", "scale", "base (s)", "cand (s)", "time", "cand items/s", "memory",
+    ))
+    regressions = []
+    for name, scale, old, new in compare(baseline, candidate):
+        time_ratio = _ratio(new['wall_time']['median'], old['wall_time']['median'])
+        print(row_format.format(
+            name,
+            scale,
+            '{:.4f}'.format(old['wall_time']['median']),
+            '{:.4f}'.format(new['wall_time']['median']),
+            _format_ratio(time_ratio),
+            '{:.1f}'.format(new['throughput'] or 0),
+            _format_ratio(_ratio(new['peak_memory'], old['peak_memory'])),
+        ))
+        if args.threshold is not None and time_ratio is not None and time_ratio > 1 + args.threshold:
+            regressions.append((name, scale))
+    
+    for key in sorted(set(baseline) ^ set(candidate)):
+        print("{} @ {} is only in {}".format(
+            key[0], key[1],
+            args.baseline if key in baseline else args.candidate,
+        ))
+    
+    if regressions:
+        print("Regressions beyond threshold: " + ", ".join(
+            "{} @ {}".format(*key) for key in regressions
+        ), file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+# Copyright 2018 PayTrace, Inc.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Synthetic interface and augmentation corpus generator
+
+A generated corpus is laid out like a project using intercom_test::
+
+    <root>/interfaces/<service>.yml             main test case file
+    <root>/interfaces/<service>/ext<NNN>.yml    extension test case files
+    <root>/augmentation/<service>.yml           compact augmentation file
+    <root>/augmentation/<service>.update.yml    update file (if any updates)
+
+The test cases are HTTP cases keyed, as for
+:class:`intercom_test.framework.HTTPCaseAugmenter`, by URL, method and request
+body.  Generation is deterministic for a given set of :class:`Params`.
+
+Run this module to generate a corpus for manual experiments::
+
+    python -m benchmarks.corpus --files 10 --cases-per-file 500 /tmp/corpus
+"""
+
+import argparse
+from collections import namedtuple
+import os.path
+import random
+import shutil
+import yaml
+from intercom_test.framework import HTTPCaseAugmenter
+
+SERVICE_NAME = 'service'
+METHODS = ('GET', 'POST', 'PUT', 'DELETE')
+WORDS = (
+    'alpha bravo charlie delta echo foxtrot golf hotel india juliet kilo '
+    'lima mike november oscar papa quebec romeo sierra tango uniform '
+    'victor whiskey xray yankee zulu'
+).split()
+
+Params = namedtuple('Params', (
+    'files',                # number of test case files, including the main file
+    'cases_per_file',
+    'body_size',            # number of fields in each request/response body
+    'flow_style',           # write test case files in flow style
+    'aliased_fraction',     # fraction of cases sharing an aliased response body
+    'augmented_fraction',   # fraction of cases with compact augmentation data
+    'updated_fraction',     # fraction of augmented cases in the update file
+    'new_update_fraction',  # fraction of unaugmented cases in the update file
+    'seed',
+), defaults=(4, 100, 5, False, 0.0, 0.5, 0.01, 0.01, 0))
+
+Corpus = namedtuple('Corpus', 'root spec_dir group_name augmentation_dir case_count params')
+
+class _Augmenter(HTTPCaseAugmenter):
+    pass
+
+def generate(root, params=Params()):
+    """Generate a corpus in directory *root*, replacing anything there
+    
+    :param str root: Directory to hold the corpus
+    :param Params params: Shape of the corpus
+    :rtype: Corpus
+    """
+    rng = random.Random(params.seed)
+    shutil.rmtree(root, ignore_errors=True)
+    spec_dir = os.path.join(root, 'interfaces')
+    aug_dir = os.path.join(root, 'augmentation')
+    os.makedirs(os.path.join(spec_dir, SERVICE_NAME))
+    os.makedirs(aug_dir)
+    
+    shared_bodies = [_body(rng, params.body_size) for _ in range(8)]
+    compact = {}
+    updates = []
+    case_number = 0
+    for file_number in range(params.files):
+        cases = []
+        for _ in range(params.cases_per_file):
+            case = _case(rng, case_number, params, shared_bodies)
+            case_number += 1
+            cases.append(case)
+            if rng.random() < params.augmented_fraction:
+                augmentation = _augmentation(rng, case_number)
+                compact[_Augmenter.key_of_case(case)] = augmentation
+                if rng.random() < params.updated_fraction:
+                    updates.append(_update_entry(case, _augmentation(rng, '{}_v2'.format(case_number))))
+            elif rng.random() < params.new_update_fraction:
+                updates.append(_update_entry(case, _augmentation(rng, case_number)))
+        
+        if file_number == 0:
+            file_path = os.path.join(spec_dir, SERVICE_NAME + '.yml')
+        else:
+            file_path = os.path.join(spec_dir, SERVICE_NAME, 'ext{:03}.yml'.format(file_number))
+        with open(file_path, 'w') as outstream:
+            # Shared response bodies are written as anchors and aliases
+            yaml.safe_dump(cases, outstream, default_flow_style=params.flow_style)
+    
+    with open(os.path.join(aug_dir, SERVICE_NAME + '.yml'), 'w') as outstream:
+        yaml.safe_dump(compact, outstream, default_flow_style=False)
+    if updates:
+        with open(os.path.join(aug_dir, SERVICE_NAME + '.update.yml'), 'w') as outstream:
+            yaml.safe_dump(updates, outstream, default_flow_style=False)
+    
+    return Corpus(root, spec_dir, SERVICE_NAME, aug_dir, case_number, params)
+
+def _case(rng, case_number, params, shared_bodies):
+    method = METHODS[case_number % len(METHODS)]
+    case = {
+        'url': '/api/v1/{}/{}'.format(rng.choice(WORDS), case_number),
+        'method': method,
+        'response status': rng.choice((200, 201, 204, 400, 404)),
+    }
+    if method != 'GET':
+        case['request body'] = _body(rng, params.body_size)
+    if rng.random() < params.aliased_fraction:
+        case['response body'] = rng.choice(shared_bodies)
+    else:
+        case['response body'] = _body(rng, params.body_size)
+    return case
+
+def _body(rng, size):
+    body = {}
+    for i in range(size):
+        kind = i % 4
+        if kind == 0:
+            value = rng.randrange(1000000)
+        elif kind == 1:
+            value = ' '.join(rng.choice(WORDS) for _ in range(rng.randrange(1, 6)))
+        elif kind == 2:
+            value = [rng.choice(WORDS) for _ in range(rng.randrange(0, 4))]
+        else:
+            value = {'enabled': rng.random() < 0.5, 'ratio': round(rng.random(), 4)}
+        body['{}_{}'.format(WORDS[i % len(WORDS)], i)] = value
+    return body
+
+def _augmentation(rng, label):
+    return {
+        'db fixture': 'fixture_{}'.format(label),
+        'setup steps': [rng.choice(WORDS) for _ in range(3)],
+    }
+
+def _update_entry(case, augmentation):
+    entry = dict(
+        (k, v) for k, v in case.items()
+        if k in _Augmenter.CASE_PRIMARY_KEYS
+    )
+    entry.update(augmentation)
+    return entry
+
+def main(argv=None):
+    defaults = Params()
+    parser = argparse.ArgumentParser(description="Generate a synthetic intercom_test corpus")
+    parser.add_argument('root', help="directory in which to generate the corpus")
+    parser.add_argument('--files', type=int, default=defaults.files)
+    parser.add_argument('--cases-per-file', type=int, default=defaults.cases_per_file)
+    parser.add_argument('--body-size', type=int, default=defaults.body_size)
+    parser.add_argument('--flow-style', action='store_true')
+    parser.add_argument('--aliased-fraction', type=float, default=defaults.aliased_fraction)
+    parser.add_argument('--augmented-fraction', type=float, default=defaults.augmented_fraction)
+    parser.add_argument('--updated-fraction', type=float, default=defaults.updated_fraction)
+    parser.add_argument('--new-update-fraction', type=float, default=defaults.new_update_fraction)
+    parser.add_argument('--seed', type=int, default=defaults.seed)
+    args = vars(parser.parse_args(argv))
+    root = args.pop('root')
+    corpus = generate(root, Params(**args))
+    print("Generated {} cases in {}".format(corpus.case_count, corpus.root))
+
+if __name__ == '__main__':
+    main()
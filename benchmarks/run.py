@@ -0,0 +1,296 @@
+# Copyright 2018 PayTrace, Inc.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark harness for the main intercom_test entry points
+
+Each benchmark is run against synthetic corpora (see :mod:`.corpus`) at one
+or more scales.  For each, the wall time of several repetitions, the
+throughput (items per second, based on the median time) and the peak memory
+traced by :mod:`tracemalloc` during one additional repetition are recorded.
+Results are written as JSON, which :mod:`.compare` can diff::
+
+    python -m benchmarks.run --scale small,medium --output before.json
+    ... make changes ...
+    python -m benchmarks.run --scale small,medium --output after.json
+    python -m benchmarks.compare before.json after.json
+"""
+
+import abc
+import argparse
+import datetime
+import gc
+import glob
+import json
+import os
+import os.path
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import yaml
+from intercom_test import cases as _cases, framework, yaml_tools
+from intercom_test.augmentation.compact_file import INDEX_FILE_EXT
+from .corpus import Params, generate
+
+RESULTS_FORMAT = 1
+
+SCALES = {
+    'small': Params(files=4, cases_per_file=100),
+    'medium': Params(files=10, cases_per_file=1000),
+    'large': Params(files=40, cases_per_file=2500),
+}
+
+class Augmenter(framework.HTTPCaseAugmenter):
+    pass
+
+class Benchmark(abc.ABC):
+    """Base class of benchmarks
+    
+    :meth:`setup` is called (untimed) before each repetition of the timed
+    :meth:`run`, which returns the number of items it processed.
+    """
+    name = None
+    
+    def __init__(self, corpus):
+        super().__init__()
+        self.corpus = corpus
+    
+    def setup(self, ):
+        pass
+    
+    @abc.abstractmethod
+    def run(self, ):
+        """Do the timed work and return the number of items processed"""
+
+class HashFromFieldsCold(Benchmark):
+    """:func:`.cases.hash_from_fields` for every case, with an empty memo"""
+    name = 'hash_from_fields.cold'
+    
+    def __init__(self, corpus):
+        super().__init__(corpus)
+        self.key_fields = [
+            dict((k, v) for k, v in case.items() if k in Augmenter.CASE_PRIMARY_KEYS)
+            for case in _all_cases(corpus)
+        ]
+    
+    def setup(self, ):
+        _cases.case_key_memo.clear()
+    
+    def run(self, ):
+        for fields in self.key_fields:
+            _cases.hash_from_fields(fields)
+        return len(self.key_fields)
+
+class HashFromFieldsWarm(HashFromFieldsCold):
+    """:func:`.cases.hash_from_fields` for every case, with every key memoized"""
+    name = 'hash_from_fields.warm'
+    
+    def setup(self, ):
+        _cases.case_key_memo.clear()
+        for fields in self.key_fields:
+            _cases.hash_from_fields(fields)
+
+class AugmenterInitCold(Benchmark):
+    """Constructing a :class:`.CaseAugmenter` without compact file indexes"""
+    name = 'CaseAugmenter.__init__.cold'
+    
+    def setup(self, ):
+        for index_path in glob.glob(os.path.join(self.corpus.augmentation_dir, '*' + INDEX_FILE_EXT)):
+            os.remove(index_path)
+    
+    def run(self, ):
+        augmenter = Augmenter(self.corpus.augmentation_dir)
+        return len(augmenter._case_augmenters)
+
+class AugmenterInitWarm(AugmenterInitCold):
+    """Constructing a :class:`.CaseAugmenter` with up-to-date compact file indexes"""
+    name = 'CaseAugmenter.__init__.warm'
+    
+    def setup(self, ):
+        Augmenter(self.corpus.augmentation_dir)
+
+class Cases(Benchmark):
+    """Iterating :meth:`.InterfaceCaseProvider.cases` with augmentation"""
+    name = 'InterfaceCaseProvider.cases'
+    
+    def setup(self, ):
+        self.provider = framework.InterfaceCaseProvider(
+            self.corpus.spec_dir,
+            self.corpus.group_name,
+            case_augmenter=Augmenter(self.corpus.augmentation_dir),
+        )
+    
+    def run(self, ):
+        return sum(1 for _ in self.provider.cases())
+
+class UpdateCompactFiles(Benchmark):
+    """:meth:`.CaseAugmenter.update_compact_files` on a pristine copy of the augmentation data"""
+    name = 'CaseAugmenter.update_compact_files'
+    
+    def __init__(self, corpus):
+        super().__init__(corpus)
+        self.pristine_dir = corpus.augmentation_dir + '.pristine'
+        shutil.rmtree(self.pristine_dir, ignore_errors=True)
+        shutil.copytree(corpus.augmentation_dir, self.pristine_dir)
+    
+    def setup(self, ):
+        shutil.rmtree(self.corpus.augmentation_dir)
+        shutil.copytree(self.pristine_dir, self.corpus.augmentation_dir)
+        self.augmenter = Augmenter(self.corpus.augmentation_dir)
+    
+    def run(self, ):
+        self.augmenter.update_compact_files()
+        return sum(len(updates) for updates in self.augmenter._updates.values())
+
+BENCHMARKS = (
+    HashFromFieldsCold,
+    HashFromFieldsWarm,
+    AugmenterInitCold,
+    AugmenterInitWarm,
+    Cases,
+    UpdateCompactFiles,
+)
+
+def _all_cases(corpus):
+    file_paths = [os.path.join(corpus.spec_dir, corpus.group_name + yaml_tools.YAML_EXT)]
+    file_paths.extend(framework.extension_files(corpus.spec_dir, corpus.group_name))
+    for file_path in file_paths:
+        with open(file_path) as instream:
+            yield from yaml.safe_load(instream)
+
+def measure(benchmark, *, repeat=5):
+    """Measure a :class:`Benchmark`, returning a :class:`dict` of results"""
+    times = []
+    items = None
+    for _ in range(repeat):
+        benchmark.setup()
+        gc.collect()
+        start = time.perf_counter()
+        items = benchmark.run()
+        times.append(time.perf_counter() - start)
+    
+    # Memory is traced separately because tracing slows execution
+    benchmark.setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        benchmark.run()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    
+    median = statistics.median(times)
+    return {
+        'items': items,
+        'wall_time': {
+            'min': min(times),
+            'median': median,
+            'max': max(times),
+            'runs': times,
+        },
+        'throughput': items / median if median else None,
+        'peak_memory': peak_memory,
+    }
+
+def environment():
+    """Describe the environment of a benchmark run"""
+    return {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': sys.version.split()[0],
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'pyyaml': yaml.__version__,
+        'libyaml': yaml_tools.libyaml_in_use(),
+    }
+
+def run(scales, benchmark_names=None, *, repeat=5, work_dir=None, corpus_options={}, log=None):
+    """Run benchmarks at the given scales, returning the results document"""
+    results = []
+    with tempfile.TemporaryDirectory(dir=work_dir) as temp_dir:
+        for scale in scales:
+            params = SCALES[scale]._replace(**corpus_options)
+            corpus = generate(os.path.join(temp_dir, scale), params)
+            for benchmark_class in BENCHMARKS:
+                if benchmark_names and benchmark_class.name not in benchmark_names:
+                    continue
+                if log is not None:
+                    log("{} @ {} ({} cases)".format(benchmark_class.name, scale, corpus.case_count))
+                result = measure(benchmark_class(corpus), repeat=repeat)
+                result.update(
+                    benchmark=benchmark_class.name,
+                    scale=scale,
+                    params=params._asdict(),
+                )
+                results.append(result)
+    return {
+        'format': RESULTS_FORMAT,
+        'environment': environment(),
+        'results': results,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run intercom_test benchmarks")
+    parser.add_argument(
+        '--scale', default='small',
+        help="comma-separated scales to run ({}; default: small)".format(', '.join(SCALES)),
+    )
+    parser.add_argument(
+        '--benchmark', action='append', dest='benchmarks', metavar='NAME',
+        choices=[b.name for b in BENCHMARKS],
+        help="benchmark to run (repeatable; default: all)",
+    )
+    parser.add_argument('--repeat', type=int, default=5, help="timed repetitions (default: 5)")
+    parser.add_argument('--output', '-o', help="file to receive JSON results (default: stdout)")
+    parser.add_argument('--work-dir', help="directory in which to generate corpora")
+    parser.add_argument('--body-size', type=int, help="fields per request/response body")
+    parser.add_argument('--flow-style', action='store_true', help="write test case files in flow style")
+    parser.add_argument('--aliased-fraction', type=float, help="fraction of cases with aliased response bodies")
+    parser.add_argument('--pure-yaml', action='store_true', help="use the pure-Python YAML implementation")
+    args = parser.parse_args(argv)
+    
+    scales = args.scale.split(',')
+    unknown_scales = [s for s in scales if s not in SCALES]
+    if unknown_scales:
+        parser.error("unknown scale(s): {}".format(', '.join(unknown_scales)))
+    corpus_options = dict(
+        (name, getattr(args, name))
+        for name in ('body_size', 'aliased_fraction')
+        if getattr(args, name) is not None
+    )
+    if args.flow_style:
+        corpus_options['flow_style'] = True
+    if args.pure_yaml:
+        yaml_tools.use_libyaml(False)
+    
+    results = run(
+        scales,
+        args.benchmarks,
+        repeat=args.repeat,
+        work_dir=args.work_dir,
+        corpus_options=corpus_options,
+        log=lambda msg: print(msg, file=sys.stderr),
+    )
+    if args.output:
+        with open(args.output, 'w') as outstream:
+            json.dump(results, outstream, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+if __name__ == '__main__':
+    main()
@@ -13,23 +13,34 @@
 # limitations under the License.
 
 import enum
-from io import StringIO
+from io import BytesIO, StringIO, TextIOWrapper
 import itertools
 import json
 import os.path
 import yaml
 from ..cases import hash_from_fields as _hash_from_fields
 from ..exceptions import DataParseError
-from ..utils import def_enum
+from ..stats import open_data_file as _open_data_file
+from ..tracing import tracer as _tracer
+from ..utils import FileIndex, atomic_write, def_enum
 from ..yaml_tools import (
     content_events as _yaml_content_events,
+    emit as _yaml_emit,
+    load as _yaml_load,
+    parse as _yaml_parse,
     value_from_event_stream as _yaml_value_from_events,
 )
 
+INDEX_FILE_EXT = '.idx'
+INDEX_FORMAT = 1
+
+# Explicit document end, as an emitter may write it after a document
+DOCUMENT_END_MARKER = '...\n'
+
 class CaseIndexer:
     """Collector of case keys and their "jump indexes" in a compact file
     
-    Objects of this class consume YAML events (as from :func:`yaml.parse`)
+    Objects of this class consume YAML events (as from :func:`.yaml_tools.parse`)
     and collect the test case keys and their corresponding starting offsets
     within the file, assuming the file represents the top level mapping in
     block format.
@@ -108,7 +119,7 @@ class DataValueReader:
         if safe_loading is not None and safe_loading is not self.safe_loading:
             self.safe_loading = safe_loading
         stream.seek(start_byte)
-        self._events = yaml.parse(stream)
+        self._events = _yaml_parse(stream)
         next(self._events) # should be yaml.StreamStartEvent
         next(self._events) # should be yaml.DocumentStartEvent
         assert isinstance(next(self._events), yaml.MappingStartEvent)
@@ -118,23 +129,7 @@ class DataValueReader:
         assert isinstance(next(self._events), yaml.MappingStartEvent)
     
     def augment(self, d):
-        while True:
-            # "Peek" at next event to see if it is the end of the mapping
-            next_event = next(self._events)
-            if isinstance(next_event, yaml.MappingEndEvent):
-                break
-            
-            # If *next_event* doesn't end the mapping, we have to chain it
-            # in front of *self._events* to read the key
-            key = _yaml_value_from_events(
-                itertools.chain((next_event,), self._events),
-                safe_loading=self.safe_loading
-            )
-            value = self._get_value()
-            d.setdefault(key, value)
-    
-    def _get_value(self, ):
-        return _yaml_value_from_events(self._events, safe_loading=self.safe_loading)
+        _augment_from_mapping_events(d, self._events, safe_loading=self.safe_loading)
     
     def augmentation_data_events(self, ):
         depth = 0
@@ -147,21 +142,222 @@ class DataValueReader:
             if depth >= 0:
                 yield event
 
-def case_keys(data_file):
-    reader = CaseIndexer()
+class EntriesReader:
+    """Reads the augmentation data for a set of cases in one pass over a compact file
     
-    with open(data_file) as stream:
-        for event in yaml.parse(stream):
-            reader.read(event)
+    Where :class:`DataValueReader` jumps to a single case, this reader parses
+    the stream sequentially from the beginning, decoding only the entries for
+    the requested case keys and skipping the events of all others.  Reading
+    stops as soon as every requested entry has been found.
+    """
+    
+    safe_loading = True
+    
+    def __init__(self, stream, case_keys, *, safe_loading=None):
+        super().__init__()
+        if safe_loading is not None and safe_loading is not self.safe_loading:
+            self.safe_loading = safe_loading
+        self._events = _yaml_parse(stream)
+        self._case_keys = frozenset(case_keys)
+    
+    def entries(self, ):
+        """Generate ``(case_key, augmentation_dict)`` pairs in file order"""
+        remaining = set(self._case_keys)
+        events = self._events
+        for event in events:
+            if not remaining:
+                break
+            if not isinstance(event, yaml.MappingStartEvent):
+                continue
+            
+            # Within the top-level mapping of a document
+            for key_event in events:
+                if isinstance(key_event, yaml.MappingEndEvent):
+                    break
+                if not isinstance(key_event, yaml.ScalarEvent):
+                    raise DataParseError(
+                        "{} where ScalarEvent expected in line {} while reading case key".format(
+                            type(key_event).__name__,
+                            key_event.start_mark.line,
+                        )
+                    )
+                if key_event.value not in remaining:
+                    _skip_node_events(events)
+                    continue
+                
+                remaining.discard(key_event.value)
+                assert isinstance(next(events), yaml.MappingStartEvent)
+                augmentation = {}
+                _augment_from_mapping_events(augmentation, events, safe_loading=self.safe_loading)
+                yield key_event.value, augmentation
+                if not remaining:
+                    return
+
+def _augment_from_mapping_events(d, events, *, safe_loading=True):
+    """Set defaults in *d* from *events* through the end of the current mapping"""
+    while True:
+        # "Peek" at next event to see if it is the end of the mapping
+        next_event = next(events)
+        if isinstance(next_event, yaml.MappingEndEvent):
+            break
+        
+        # If *next_event* doesn't end the mapping, we have to chain it
+        # in front of *events* to read the key
+        key = _yaml_value_from_events(
+            itertools.chain((next_event,), events),
+            safe_loading=safe_loading
+        )
+        value = _yaml_value_from_events(events, safe_loading=safe_loading)
+        d.setdefault(key, value)
+
+def _skip_node_events(events, collect=None):
+    depth = 0
+    for event in events:
+        if isinstance(event, yaml.CollectionStartEvent):
+            depth += 1
+        elif isinstance(event, yaml.CollectionEndEvent):
+            depth -= 1
+        if collect is not None:
+            collect(event)
+        if depth == 0:
+            return
+
+def read_entries(data_file, case_spans, *, safe_loading=True, blocksize=65536):
+    """Get a :class:`dict` of the augmentation data for selected cases in *data_file*
+    
+    :param data_file: Path to a compact augmentation data file
+    :param dict case_spans:
+        Maps each requested case key to the ``(start, end)`` character
+        offsets of its entry in *data_file*, as from the offsets reported by
+        :func:`case_keys` (*end* is ``None`` for the last entry)
+    :returns: A :class:`dict` of augmentation data keyed by case key
+    
+    *data_file* is read sequentially once, keeping only the text of the
+    requested entries, which is then parsed as a single compact mapping.
+    Memory use is thus bounded by the size of the requested entries, not the
+    size of *data_file*.  If the gathered text does not yield every requested
+    entry (e.g. because the offsets are stale), *data_file* is instead read
+    with an :class:`EntriesReader`.
+    """
+    spans = sorted((span, case_key) for case_key, span in case_spans.items())
+    entries_text = StringIO()
+    with _open_data_file(data_file, 'compact') as stream:
+        position = 0
+        for (start, end), case_key in spans:
+            while position < start:
+                skipped = len(stream.read(min(blocksize, start - position)))
+                if not skipped:
+                    break
+                position += skipped
+            if end is None:
+                entry_text = stream.read()
+            else:
+                entry_text = stream.read(end - position)
+            position += len(entry_text)
+            entries_text.write(entry_text)
+            if not entry_text.endswith("\n"):
+                entries_text.write("\n")
+    
+    entries_text.seek(0)
+    try:
+        result = dict(EntriesReader(entries_text, case_spans, safe_loading=safe_loading).entries())
+    except (yaml.YAMLError, DataParseError, AssertionError):
+        result = {}
+    if len(result) < len(case_spans):
+        with _open_data_file(data_file, 'compact') as stream:
+            result.update(EntriesReader(
+                stream,
+                (k for k in case_spans if k not in result),
+                safe_loading=safe_loading,
+            ).entries())
+    return result
+
+def entry_events(data_file):
+    """Generate ``(case_key, events)`` for each entry of a compact file
     
+    *events* is a :class:`list` of the events of the key/value pairs of the
+    entry's augmentation mapping, excluding the mapping start and end events.
+    """
+    with _open_data_file(data_file, 'compact') as stream:
+        events = _yaml_parse(stream)
+        for event in events:
+            if not isinstance(event, yaml.MappingStartEvent):
+                continue
+            
+            # Within the top-level mapping of a document
+            for key_event in events:
+                if isinstance(key_event, yaml.MappingEndEvent):
+                    break
+                value_start = next(events)
+                if not (
+                    isinstance(key_event, yaml.ScalarEvent)
+                    and isinstance(value_start, yaml.MappingStartEvent)
+                ):
+                    raise DataParseError(
+                        "Entry in line {} of {} is not a case key with a mapping value".format(
+                            key_event.start_mark.line,
+                            data_file,
+                        )
+                    )
+                value_events = []
+                _skip_node_events(itertools.chain((value_start,), events), value_events.append)
+                yield key_event.value, value_events[1:-1]
+
+def case_keys(data_file):
+    with _tracer.span('case_keys', 'index', file=data_file):
+        with _open_data_file(data_file, 'compact') as stream:
+            return _case_keys_in_stream(stream)
+
+def _case_keys_in_stream(stream):
+    reader = CaseIndexer()
+    for event in _yaml_parse(stream):
+        reader.read(event)
     return reader.case_keys
 
+def index_file_path(data_file):
+    """Path of the sidecar index file for compact file *data_file*"""
+    return data_file + INDEX_FILE_EXT
+
+def indexed_case_keys(data_file):
+    """Get the same result as :func:`case_keys`, using a sidecar index file
+    
+    The sidecar index (at :func:`index_file_path`) records the case keys and
+    offsets of *data_file* and is validated and maintained as described for
+    :meth:`.utils.FileIndex.entries`; when it is not valid, *data_file* is
+    indexed with a :class:`CaseIndexer`.
+    """
+    with _tracer.span('indexed_case_keys', 'index', file=data_file):
+        return _indexed_case_keys(data_file)
+
+def _indexed_case_keys(data_file):
+    return _keys_from_entries(_file_index(data_file).entries(_case_keys_in_content))
+
+def write_case_index(data_file):
+    """(Re)write the sidecar index file for compact file *data_file*"""
+    _file_index(data_file).rebuild(_case_keys_in_content)
+
+def _write_index_for_keys(data_file, keys):
+    _file_index(data_file).record(keys)
+
+def _file_index(data_file):
+    return FileIndex(
+        data_file,
+        index_file_path(data_file),
+        format=INDEX_FORMAT,
+        kind='compact',
+    )
+
+def _case_keys_in_content(content):
+    return _case_keys_in_stream(TextIOWrapper(BytesIO(content)))
+
+def _keys_from_entries(entries):
+    return [tuple(entry) for entry in entries]
+
 def augment_dict_from(d, file_ref, case_key, *, safe_loading=True):
     file, start_byte = file_ref
-    load_yaml = yaml.safe_load if safe_loading else yaml.load
-    with open(file) as stream:
+    with _open_data_file(file, 'compact') as stream:
         if start_byte is None:
-            for k, v in load_yaml(stream)[case_key].items():
+            for k, v in _yaml_load(stream, safe_loading=safe_loading)[case_key].items():
                 d.setdefault(k, v)
         else:
             DataValueReader(stream, start_byte, case_key, safe_loading=safe_loading).augment(d)
@@ -182,7 +378,7 @@ class TestCaseAugmenter:
         self.case_key = case_key
     
     def __call__(self, d):
-        with open(self.file_path) as stream:
+        with _open_data_file(self.file_path, 'compact') as stream:
             if self.offset is None:
                 for k, v in self._load_yaml(stream)[self.case_key].items():
                     d.setdefault(k, v)
@@ -190,7 +386,7 @@ class TestCaseAugmenter:
                 DataValueReader(stream, self.offset, self.case_key, safe_loading=self.safe_loading).augment(d)
     
     def case_data_events(self, ):
-        with open(self.file_path) as stream:
+        with _open_data_file(self.file_path, 'compact') as stream:
             if self.offset is None:
                 augmentation_data = self._load_yaml(stream)[self.case_key]
                 events = list(_yaml_content_events(augmentation_data))[1:-1]
@@ -204,8 +400,7 @@ class TestCaseAugmenter:
                 ).augmentation_data_events()
     
     def _load_yaml(self, stream):
-        load_yaml = yaml.safe_load if self.safe_loading else yaml.load
-        return load_yaml(stream)
+        return _yaml_load(stream, safe_loading=self.safe_loading)
 
 class Updater:
     """YAML event-stream editor for compact augumentation data files
@@ -316,3 +511,220 @@ class Updater:
             for k, v in test_case.items()
             if k not in self.excluded_keys
         )
+
+def splice_updates(data_file, updates, excluded_keys=(), *, use_index=True, blocksize=65536):
+    """Apply *updates* to compact file *data_file*, copying untouched entries verbatim
+    
+    :param data_file: Path to an existing compact augmentation data file
+    :param updates:
+        Updates in the form accepted by :class:`Updater`
+    :param excluded_keys:
+        Keys omitted from :class:`dict` values in *updates*
+    :keyword use_index:
+        If true (the default), locate entries through the sidecar index of
+        *data_file* and rewrite the index from the offsets computed while
+        splicing; otherwise *data_file* is parsed to locate its entries
+    :returns:
+        ``True`` if *data_file* was updated, or ``False`` -- without writing
+        anything -- if the layout of *data_file* does not allow splicing
+    
+    Using the offsets of the entries in *data_file*, only the replacement
+    entries and the new entries are emitted as YAML; all other text of
+    *data_file* -- including comments, blank lines and document markers
+    between entries -- is copied character for character, so only the
+    replaced entries and the last entry are parsed.  Splicing requires that
+    the entries of *data_file* be in block-style top level mappings.  A
+    file with CRLF line endings keeps them.
+    """
+    keys = indexed_case_keys(data_file) if use_index else case_keys(data_file)
+    if not keys or any(offset is None for _, offset in keys):
+        return False
+    keys = sorted(keys, key=lambda entry: entry[1])
+    offsets = dict(keys)
+    if len(offsets) != len(keys):
+        return False
+    
+    replacements = {}
+    additions = []
+    for case_key, value in updates.items():
+        entry_text = _entry_text(case_key, _update_value_events(value, excluded_keys))
+        if entry_text.endswith('\n\n'):
+            # Ends with a keep-chomped block scalar, which would take in any
+            # blank lines following the entry in the file
+            return False
+        if case_key in offsets:
+            replacements[case_key] = entry_text
+        else:
+            additions.append((case_key, entry_text))
+    
+    # A replaced entry (and the last entry, after which additions go)
+    # extends to the end of the line on which its value node ends, which is
+    # found by parsing just that entry; whatever follows it up to the next
+    # key is kept
+    last_key, last_offset = keys[-1]
+    next_offsets = dict(zip(
+        (offset for _, offset in keys),
+        [offset for _, offset in keys[1:]] + [None],
+    ))
+    entry_ends = {}
+    with _open_data_file(data_file, 'compact') as stream:
+        reader = _TextCopier(stream, None, blocksize)
+        for case_key, offset in keys:
+            if not (case_key in replacements or offset == last_offset):
+                continue
+            reader.skip_to(offset)
+            next_offset = next_offsets[offset]
+            entry_text = stream.read() if next_offset is None else stream.read(next_offset - offset)
+            reader.position += len(entry_text)
+            entry_length = _entry_length(entry_text, case_key)
+            if entry_length is None:
+                return False
+            entry_ends[offset] = offset + entry_length
+            if offset == last_offset:
+                last_entry_text = entry_text[:entry_length]
+    
+    new_keys = []
+    with _open_data_file(data_file, 'compact') as instream, atomic_write(data_file, newline=_newline_of(data_file)) as outstream:
+        copier = _TextCopier(instream, outstream, blocksize)
+        delta = 0
+        for case_key, offset in keys:
+            new_keys.append((case_key, offset + delta))
+            entry_text = replacements.get(case_key)
+            if entry_text is None:
+                continue
+            copier.copy_to(offset)
+            copier.skip_to(entry_ends[offset])
+            outstream.write(entry_text)
+            delta += len(entry_text) - (entry_ends[offset] - offset)
+        copier.copy_to(entry_ends[last_offset])
+        
+        position = entry_ends[last_offset] + delta
+        if additions and not (
+            last_key in replacements
+            or last_entry_text.endswith('\n')
+        ):
+            outstream.write('\n')
+            position += 1
+        for case_key, entry_text in additions:
+            outstream.write(entry_text)
+            new_keys.append((case_key, position))
+            position += len(entry_text)
+        copier.copy_rest()
+    
+    if use_index:
+        _write_index_for_keys(data_file, new_keys)
+    return True
+
+def _newline_of(data_file):
+    """Line ending to write for *data_file*: ``'\\r\\n'`` if its first line has one"""
+    with _open_data_file(data_file, 'compact', binary=True) as stream:
+        first_line = stream.readline()
+    return '\r\n' if first_line.endswith(b'\r\n') else None
+
+def _entry_length(text, case_key):
+    """Length of the entry for *case_key* at the start of *text*
+    
+    Returns ``None`` if *text* does not start with the expected entry.
+    """
+    events = _yaml_parse(StringIO(text))
+    try:
+        next(events) # should be yaml.StreamStartEvent
+        next(events) # should be yaml.DocumentStartEvent
+        if not isinstance(next(events), yaml.MappingStartEvent):
+            return None
+        key_event = next(events)
+        if not (isinstance(key_event, yaml.ScalarEvent) and key_event.value == case_key):
+            return None
+        value_events = []
+        _skip_node_events(events, value_events.append)
+    except (yaml.YAMLError, StopIteration):
+        return None
+    if not value_events:
+        return None
+    
+    # The end event of a block collection is marked after any comments and
+    # blank lines that follow it, so the value ends with its last scalar,
+    # alias or flow collection; include the rest of the line on which it ends
+    end = _content_end(value_events)
+    if end > 0 and text[end - 1] != '\n':
+        line_end = text.find('\n', end)
+        end = len(text) if line_end < 0 else line_end + 1
+    return end
+
+def _content_end(node_events):
+    """Index just past the last text belonging to the node of *node_events*"""
+    flow_styles = []
+    end = None
+    for event in node_events:
+        if isinstance(event, yaml.CollectionStartEvent):
+            flow_styles.append(event.flow_style)
+        elif isinstance(event, yaml.CollectionEndEvent):
+            if flow_styles.pop():
+                end = event.end_mark.index
+        else:
+            end = event.end_mark.index
+    return end
+
+def _update_value_events(value, excluded_keys):
+    if isinstance(value, dict):
+        return _yaml_content_events(dict(
+            (k, v)
+            for k, v in value.items()
+            if k not in excluded_keys
+        ))
+    return value
+
+def _entry_text(case_key, value_events):
+    """YAML text of a compact file entry, to be placed among other entries
+    
+    An emitter may end the document with an explicit end marker (libyaml
+    does after a keep-chomped block scalar); that is removed, as it would
+    end the compact file's document in the middle of its entries.
+    """
+    text = _yaml_emit(itertools.chain(
+        (
+            yaml.StreamStartEvent(),
+            yaml.DocumentStartEvent(),
+            yaml.MappingStartEvent(None, None, True, flow_style=False),
+            yaml.ScalarEvent(None, None, (True, False), case_key),
+        ),
+        value_events,
+        (
+            yaml.MappingEndEvent(),
+            yaml.DocumentEndEvent(),
+            yaml.StreamEndEvent(),
+        ),
+    ))
+    if text.endswith(DOCUMENT_END_MARKER):
+        text = text[:-len(DOCUMENT_END_MARKER)]
+    return text
+
+class _TextCopier:
+    def __init__(self, instream, outstream, blocksize):
+        super().__init__()
+        self._instream = instream
+        self._outstream = outstream
+        self._blocksize = blocksize
+        self.position = 0
+    
+    def copy_to(self, position):
+        while self.position < position:
+            chunk = self._instream.read(min(self._blocksize, position - self.position))
+            if not chunk:
+                break
+            self._outstream.write(chunk)
+            self.position += len(chunk)
+    
+    def skip_to(self, position):
+        while self.position < position:
+            skipped = len(self._instream.read(min(self._blocksize, position - self.position)))
+            if not skipped:
+                break
+            self.position += skipped
+    
+    def copy_rest(self, ):
+        while True:
+            chunk = self._instream.read(self._blocksize)
+            if not chunk:
+                break
+            self._outstream.write(chunk)
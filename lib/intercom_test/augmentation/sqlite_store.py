@@ -0,0 +1,324 @@
+# Copyright 2018 PayTrace, Inc.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""SQLite storage for compact augmentation data
+
+A :class:`Store` holds the same information as a set of compact augmentation
+files in a single SQLite database: each entry associates a case key with the
+YAML text of its augmentation mapping and with the name of the compact file
+(its *source*) in which the entry would otherwise live.  Keeping the source
+lets update files (``foo.update.yml``) deposit into the entries for
+``foo.yml`` just as they would with YAML compact files, and allows exporting
+back to YAML compact files without loss.
+"""
+
+from io import StringIO
+import os
+import os.path
+import sqlite3
+import threading
+import yaml
+from ..exceptions import MultipleAugmentationEntriesError
+from ..stats import stats as _stats
+from ..utils import atomic_write
+from ..yaml_tools import (
+    emit as _yaml_emit,
+    load as _yaml_load,
+    parse as _yaml_parse,
+)
+from .compact_file import (
+    entry_events as _compact_entry_events,
+    write_case_index as _write_compact_file_index,
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS augmentation (
+    case_key TEXT NOT NULL,
+    source TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (case_key, source)
+)
+"""
+
+class Store:
+    """Compact augmentation data in an SQLite database file
+    
+    Each thread (in each process) using an object of this class opens its
+    own connection to the database on first use and keeps it for later
+    operations, so objects of this class can be pickled and used from
+    multiple threads or processes.
+    """
+    def __init__(self, db_path):
+        super().__init__()
+        self.db_path = db_path
+        self._local = threading.local()
+    
+    def __getstate__(self, ):
+        state = dict(self.__dict__)
+        del state['_local']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+    
+    def entries(self, ):
+        """Get a :class:`list` of ``(case_key, source)`` for all entries"""
+        db = self._connection()
+        return db.execute(
+            "SELECT case_key, source FROM augmentation ORDER BY source, case_key"
+        ).fetchall()
+    
+    def sources(self, ):
+        """Get a :class:`list` of the distinct sources of entries"""
+        db = self._connection()
+        return [row[0] for row in db.execute(
+            "SELECT DISTINCT source FROM augmentation ORDER BY source"
+        )]
+    
+    def data(self, case_key, source):
+        """Get the YAML text of the augmentation mapping for an entry
+        
+        :raises KeyError: if there is no such entry
+        """
+        db = self._connection()
+        row = db.execute(
+            "SELECT data FROM augmentation WHERE case_key = ? AND source = ?",
+            (case_key, source),
+        ).fetchone()
+        if row is None:
+            raise KeyError((case_key, source))
+        return row[0]
+    
+    def source_entries(self, source):
+        """Get a :class:`list` of ``(case_key, data)`` for one source"""
+        db = self._connection()
+        return db.execute(
+            "SELECT case_key, data FROM augmentation WHERE source = ? ORDER BY case_key",
+            (source,),
+        ).fetchall()
+    
+    def put_entries(self, source, entries, *, replace_source=False):
+        """Insert or replace entries in a single transaction
+        
+        :param str source: The source of all *entries*
+        :param entries: An iterable of ``(case_key, data)`` pairs
+        :keyword replace_source:
+            If true, all existing entries of *source* are removed first;
+            otherwise, existing entries of *source* for the case keys in
+            *entries* are replaced
+        :raises MultipleAugmentationEntriesError:
+            if *entries* contains any case key more than once or the change
+            would give any case key entries in multiple sources; the store is
+            left unchanged
+        """
+        entries = list(entries)
+        case_keys = set()
+        for case_key, _ in entries:
+            if case_key in case_keys:
+                raise MultipleAugmentationEntriesError(
+                    "Test case key \"{}\" has multiple augmentation entries in {} (importing to {})".format(
+                        case_key,
+                        source,
+                        self.db_path,
+                    )
+                )
+            case_keys.add(case_key)
+        
+        db = self._connection()
+        with db:
+            if replace_source:
+                db.execute("DELETE FROM augmentation WHERE source = ?", (source,))
+                insert = "INSERT INTO augmentation (case_key, source, data) VALUES (?, ?, ?)"
+            else:
+                insert = "INSERT OR REPLACE INTO augmentation (case_key, source, data) VALUES (?, ?, ?)"
+            try:
+                db.executemany(
+                    insert,
+                    ((case_key, source, data) for case_key, data in entries),
+                )
+            except sqlite3.IntegrityError as e:
+                raise MultipleAugmentationEntriesError(
+                    "Duplicate augmentation entry in {} (in {}): {}".format(
+                        source,
+                        self.db_path,
+                        e,
+                    )
+                ) from e
+            
+            # Only the case keys just written can have gained a conflict
+            db.execute("DROP TABLE IF EXISTS temp.put_keys")
+            db.execute("CREATE TEMP TABLE put_keys (case_key TEXT PRIMARY KEY)")
+            db.executemany(
+                "INSERT INTO put_keys (case_key) VALUES (?)",
+                ((case_key,) for case_key in case_keys),
+            )
+            conflict = db.execute(
+                "SELECT case_key, group_concat(source, ', ') FROM augmentation"
+                " WHERE case_key IN (SELECT case_key FROM put_keys)"
+                " GROUP BY case_key HAVING COUNT(*) > 1 LIMIT 1"
+            ).fetchone()
+            db.execute("DROP TABLE put_keys")
+            if conflict is not None:
+                raise MultipleAugmentationEntriesError(
+                    "Test case key \"{}\" has augmentation entries in {} (in {})".format(
+                        conflict[0],
+                        conflict[1],
+                        self.db_path,
+                    )
+                )
+    
+    def close(self, ):
+        """Close the connection of the calling thread, if it has one"""
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            del self._local.db
+            db.close()
+    
+    def _connection(self, ):
+        db = getattr(self._local, 'db', None)
+        if db is not None and self._local.pid == os.getpid():
+            return db
+        
+        # A connection inherited through fork is not used
+        if _stats.enabled:
+            _stats.files_opened['compact db'] += 1
+        db = sqlite3.connect(self.db_path)
+        db.execute(SCHEMA)
+        self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+def data_from_mapping_events(content_events):
+    """Build the stored YAML text from the events of an augmentation mapping
+    
+    *content_events* are the events of the key/value pairs only, not
+    including the enclosing mapping start and end events.
+    """
+    def document_events():
+        yield yaml.StreamStartEvent()
+        yield yaml.DocumentStartEvent()
+        yield yaml.MappingStartEvent(None, None, True, flow_style=False)
+        yield from content_events
+        yield yaml.MappingEndEvent()
+        yield yaml.DocumentEndEvent()
+        yield yaml.StreamEndEvent()
+    
+    return _yaml_emit(document_events())
+
+def mapping_events_from_data(data):
+    """Generate the events of the key/value pairs in stored YAML text"""
+    events = list(_yaml_parse(StringIO(data)))
+    # Strip stream, document and mapping start/end events
+    yield from events[3:-3]
+
+class TestCaseAugmenter:
+    """Callable to augment a test case from an SQLite store entry"""
+    
+    # Set this to False to allow arbitrary object instantiation and code
+    # execution from loaded YAML
+    safe_loading = True
+    
+    offset = None
+    
+    def __init__(self, store, file_path, case_key, *, safe_loading=None):
+        """
+        :param store: The :class:`Store` holding the entry
+        :param file_path:
+            Path of the compact file corresponding to the entry's source,
+            used when correlating with update files and in error messages
+        :param case_key: Case key of the entry
+        """
+        super().__init__()
+        if safe_loading is not None and safe_loading is not self.safe_loading:
+            self.safe_loading = safe_loading
+        self.store = store
+        self.file_path = file_path
+        self.case_key = case_key
+    
+    @property
+    def source(self):
+        return os.path.basename(self.file_path)
+    
+    def __call__(self, d):
+        data = _yaml_load(
+            StringIO(self.store.data(self.case_key, self.source)),
+            safe_loading=self.safe_loading,
+        )
+        for k, v in (data or {}).items():
+            d.setdefault(k, v)
+    
+    def case_data_events(self, ):
+        yield from mapping_events_from_data(self.store.data(self.case_key, self.source))
+
+def import_compact_files(db_path, compact_file_paths, *, replace=True):
+    """Import YAML compact augmentation files into an SQLite store
+    
+    :param db_path: Path of the SQLite database (created if necessary)
+    :param compact_file_paths: Paths of the compact files to import
+    :keyword replace:
+        If true (the default), existing entries from a compact file's source
+        (its base name) are removed before importing that file
+    :returns: The number of entries imported
+    """
+    store = Store(db_path)
+    count = 0
+    try:
+        for file_path in compact_file_paths:
+            entries = [
+                (case_key, data_from_mapping_events(events))
+                for case_key, events in _compact_entry_events(file_path)
+            ]
+            store.put_entries(os.path.basename(file_path), entries, replace_source=replace)
+            count += len(entries)
+    finally:
+        store.close()
+    return count
+
+def export_compact_files(db_path, out_dir, *, write_indexes=True):
+    """Export the entries of an SQLite store as YAML compact augmentation files
+    
+    :param db_path: Path of the SQLite database
+    :param out_dir:
+        Directory in which to write one compact file per source; existing
+        files are replaced
+    :keyword write_indexes:
+        If true (the default), write the sidecar index of each compact file
+    :returns: A :class:`list` of the paths of the files written
+    """
+    store = Store(db_path)
+    written = []
+    try:
+        for source in store.sources():
+            file_path = os.path.join(out_dir, source)
+            with atomic_write(file_path) as outstream:
+                _yaml_emit(_compact_file_events(store.source_entries(source)), outstream)
+            if write_indexes:
+                _write_compact_file_index(file_path)
+            written.append(file_path)
+    finally:
+        store.close()
+    return written
+
+def _compact_file_events(entries):
+    yield yaml.StreamStartEvent()
+    yield yaml.DocumentStartEvent()
+    yield yaml.MappingStartEvent(None, None, True, flow_style=False)
+    for case_key, data in entries:
+        yield yaml.ScalarEvent(None, None, (True, False), case_key)
+        yield yaml.MappingStartEvent(None, None, True, flow_style=False)
+        yield from mapping_events_from_data(data)
+        yield yaml.MappingEndEvent()
+    yield yaml.MappingEndEvent()
+    yield yaml.DocumentEndEvent()
+    yield yaml.StreamEndEvent()
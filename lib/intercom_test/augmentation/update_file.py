@@ -25,12 +25,16 @@ import os.path
 import re
 import yaml
 from ..cases import hash_from_fields as _hash_from_fields
-from ..exceptions import DataParseError
+from ..exceptions import DataParseError, MultipleAugmentationEntriesError
 from ..json_asn1.convert import asn1_der
+from ..stats import open_data_file as _open_data_file
+from ..tracing import tracer as _tracer
 from ..utils import def_enum
 from ..yaml_tools import (
     YAML_EXT,
     content_events as _yaml_content_events,
+    load as _yaml_load,
+    parse as _yaml_parse,
     value_from_event_stream as _value_from_events,
 )
 
@@ -132,7 +136,7 @@ class Indexer:
             self._case_data_value = [event]
         else:
             self._expect(yaml.ScalarEvent)
-            self._case_data_value = _value_from_events((event,), safe_loading=self.safe_loading)
+            self._case_data_value = self._key_field_value((event,))
             self._state = self.State.case_mapping
             self._capture_case_item()
     
@@ -145,7 +149,7 @@ class Indexer:
         
         if self._depth < 0:
             self._state = self.State.case_mapping
-            self._case_data_value = _value_from_events(self._case_data_value, safe_loading=self.safe_loading)
+            self._case_data_value = self._key_field_value(self._case_data_value)
             self._capture_case_item()
     
     def _read_from_tail(self, event):
@@ -154,6 +158,12 @@ class Indexer:
         elif isinstance(event, yaml.DocumentStartEvent):
             self._state = self.State.header
     
+    def _key_field_value(self, events):
+        # Only the values of key fields are needed for the index
+        if self._case_data_key not in self.key_fields:
+            return None
+        return _value_from_events(events, safe_loading=self.safe_loading)
+    
     def _capture_case_item(self, ):
         if self._case_data_key in self.key_fields:
             self._case_id[self._case_data_key] = self._case_data_value
@@ -185,12 +195,17 @@ class Indexer:
         )
 
 def index(paths, key_fields, *, safe_loading=True):
+    paths = list(paths)
+    with _tracer.span('update_file.index', 'index', files=paths):
+        return _index(paths, key_fields, safe_loading=safe_loading)
+
+def _index(paths, key_fields, *, safe_loading=True):
     result = {}
     indexer = Indexer(key_fields, safe_loading=safe_loading)
     for path in paths:
         case_index = itertools.count(0)
-        with open(path) as instream:
-            for event in yaml.parse(instream):
+        with _open_data_file(path, 'update') as instream:
+            for event in _yaml_parse(instream):
                 entry = indexer.read(event)
                 if entry is not None:
                     case_key, offset = entry
@@ -226,7 +241,7 @@ class CaseReader:
             self.safe_loading = safe_loading
         self.key_fields = frozenset(key_fields)
         stream.seek(start_byte)
-        self._events = yaml.parse(stream)
+        self._events = _yaml_parse(stream)
         self._key = None
         self._value = None
         next(self._events) # should be yaml.StreamStartEvent
@@ -301,7 +316,7 @@ class TestCaseAugmenter:
         self.case_index = case_index
     
     def __call__(self, d):
-        with open(self.file_path) as stream:
+        with _open_data_file(self.file_path, 'update') as stream:
             if self.offset is None:
                 for k, v in self._load_yaml(stream)[self.case_index].items():
                     d.setdefault(k, v)
@@ -320,7 +335,7 @@ class TestCaseAugmenter:
         return self.file_path.rsplit('.', 2)[0] + YAML_EXT
     
     def case_data_events(self, ):
-        with open(self.file_path) as stream:
+        with _open_data_file(self.file_path, 'update') as stream:
             if self.offset is None:
                 augmentation_data = self._load_yaml(stream)[self.case_index]
                 for k in self.key_fields:
@@ -336,5 +351,4 @@ class TestCaseAugmenter:
                 ).augmentation_data_events()
     
     def _load_yaml(self, stream):
-        load_yaml = yaml.safe_load if self.safe_loading else yaml.load
-        return load_yaml(stream)
+        return _yaml_load(stream, safe_loading=self.safe_loading)
@@ -0,0 +1,252 @@
+# Copyright 2018 PayTrace, Inc.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Selecting test cases from the YAML events of a test case file
+
+A *case filter* is an object with a :attr:`fields` set of field names and an
+:meth:`accepts` method taking a :class:`dict` of the values of those fields
+found in a test case.  :func:`filtered_cases` reads the YAML events of a test
+case file, constructs only the values of those fields for each case and
+constructs the full case only if the filter accepts it.
+
+:class:`CaseFilter` is the filter built from the *where* argument of
+:meth:`.InterfaceCaseProvider.cases`: a mapping of field names to
+conditions, all of which a case must satisfy.  A condition is:
+
+* a :class:`Prefix`, satisfied by strings starting with it,
+* a :class:`set`, :class:`frozenset`, :class:`list` or :class:`tuple`,
+  satisfied by any of its members,
+* a callable, satisfied when it returns a true value for the field value, or
+* any other value, satisfied by equal values.
+
+Conditions are tested against the values as they appear in the test case
+file, before any augmentation or parsing of JSON bodies; a case lacking a
+field does not satisfy the condition on it.
+"""
+
+import yaml
+from .exceptions import DataParseError
+from .yaml_tools import (
+    load as _yaml_load,
+    parse as _yaml_parse,
+    value_from_event_stream as _value_from_events,
+)
+
+MERGE_KEY = '<<'
+
+class Prefix(str):
+    """Condition satisfied by strings starting with this string"""
+    __slots__ = ()
+    
+    def __repr__(self, ):
+        return "{}({})".format(type(self).__name__, super().__repr__())
+
+class CaseFilter:
+    """Filter accepting test cases whose fields satisfy all given conditions
+    
+    :param where:
+        A mapping (or iterable of pairs) of field names to conditions (see
+        :mod:`.case_filter`)
+    """
+    def __init__(self, where):
+        super().__init__()
+        self.conditions = dict(where)
+        self.fields = frozenset(self.conditions)
+    
+    def __repr__(self, ):
+        return "{}({!r})".format(type(self).__name__, self.conditions)
+    
+    def accepts(self, values):
+        """Test whether the field *values* of a case satisfy all conditions"""
+        return all(
+            field in values and satisfies(values[field], condition)
+            for field, condition in self.conditions.items()
+        )
+    
+    @classmethod
+    def parse(cls, condition_texts):
+        """Build a filter from textual conditions
+        
+        Each condition is one of:
+        
+        ``FIELD=VALUE``
+            equality, with *VALUE* interpreted as YAML (so ``status=200``
+            compares with a number and ``method=[GET, HEAD]`` tests
+            membership)
+        
+        ``FIELD^=PREFIX``
+            the field is a string starting with *PREFIX*
+        
+        :raises ValueError: if a condition has no ``=``
+        """
+        where = {}
+        for text in condition_texts:
+            field, sep, value = text.partition('=')
+            if not sep:
+                raise ValueError("Condition {!r} is not of the form FIELD=VALUE or FIELD^=PREFIX".format(text))
+            if field.endswith('^'):
+                where[field[:-1].strip()] = Prefix(value)
+            else:
+                where[field.strip()] = _yaml_load(value) if value else ''
+        return cls(where)
+
+class AllOf:
+    """Filter accepting test cases accepted by all of several filters"""
+    def __init__(self, case_filters):
+        super().__init__()
+        self.case_filters = tuple(case_filters)
+        self.fields = frozenset().union(*(f.fields for f in self.case_filters))
+    
+    def __repr__(self, ):
+        return "{}({!r})".format(type(self).__name__, self.case_filters)
+    
+    def accepts(self, values):
+        return all(f.accepts(values) for f in self.case_filters)
+
+def satisfies(value, condition):
+    """Test whether *value* satisfies *condition* (see :mod:`.case_filter`)"""
+    if isinstance(condition, Prefix):
+        return isinstance(value, str) and value.startswith(condition)
+    if isinstance(condition, (set, frozenset, list, tuple)):
+        try:
+            return value in condition
+        except TypeError:
+            # Unhashable value tested against a set
+            return False
+    if callable(condition):
+        return bool(condition(value))
+    return value == condition
+
+def filtered_cases(stream, case_filter, *, safe_loading=False):
+    """Generate the test cases in *stream* accepted by *case_filter*
+    
+    :param stream: Test case YAML (anything :func:`.yaml_tools.parse` accepts)
+    :param case_filter: A case filter (see :mod:`.case_filter`)
+    
+    Cases are generated in file order, as the same :class:`dict`\ s loading
+    the file would produce.  Cases using aliases or merge keys are fully
+    constructed in order to test them; other cases are constructed only if
+    accepted.
+    """
+    events = _yaml_parse(stream)
+    for event in events:
+        if isinstance(event, yaml.DocumentStartEvent):
+            yield from _filtered_document_cases(events, case_filter, safe_loading=safe_loading)
+
+def _filtered_document_cases(events, case_filter, *, safe_loading):
+    event = next(events)
+    _expect(event, yaml.SequenceStartEvent, "document")
+    
+    # Events of the cases defining anchors, needed to construct later cases
+    # aliasing them
+    anchor_cases = []
+    
+    for event in events:
+        if isinstance(event, yaml.SequenceEndEvent):
+            return
+        if isinstance(event, yaml.AliasEvent):
+            # The whole case is an alias of an earlier node
+            test_case = _value_with_anchors(anchor_cases, [event], safe_loading)
+            if case_filter.accepts(_field_values(test_case, case_filter.fields)):
+                yield test_case
+            continue
+        _expect(event, yaml.MappingStartEvent, "test case sequence")
+        case = _CaseEvents(event, events, case_filter.fields)
+        
+        if case.has_alias or case.has_merge_key:
+            test_case = _value_with_anchors(anchor_cases, case.events, safe_loading)
+            if case_filter.accepts(_field_values(test_case, case_filter.fields)):
+                yield test_case
+        elif case_filter.accepts(dict(
+            (field, _value_from_events(value_events, safe_loading=safe_loading))
+            for field, value_events in case.field_value_events()
+        )):
+            yield _value_from_events(case.events, safe_loading=safe_loading)
+        
+        if case.has_anchor:
+            anchor_cases.append(case)
+
+def _value_with_anchors(anchor_cases, case_events, safe_loading):
+    """Construct a case from its events, preceded by those of *anchor_cases*"""
+    return _value_from_events(
+        [yaml.SequenceStartEvent(None, None, True)]
+        + [e for other_case in anchor_cases for e in other_case.events]
+        + case_events
+        + [yaml.SequenceEndEvent()],
+        safe_loading=safe_loading,
+    )[-1]
+
+def _field_values(test_case, fields):
+    if not isinstance(test_case, dict):
+        return {}
+    return dict(
+        (field, test_case[field])
+        for field in fields
+        if field in test_case
+    )
+
+class _CaseEvents:
+    """Events of one test case mapping, noting where the values of *fields* are"""
+    def __init__(self, start_event, events, fields):
+        super().__init__()
+        self.events = case_events = [start_event]
+        self.has_alias = self.has_merge_key = False
+        self.has_anchor = start_event.anchor is not None
+        self._value_spans = {}
+        
+        depth = 1
+        at_key = True
+        for event in events:
+            position = len(case_events)
+            case_events.append(event)
+            if isinstance(event, yaml.AliasEvent):
+                self.has_alias = True
+            elif getattr(event, 'anchor', None) is not None:
+                self.has_anchor = True
+            
+            if depth == 1:
+                if isinstance(event, yaml.MappingEndEvent):
+                    break
+                node_start = position
+            if isinstance(event, yaml.CollectionStartEvent):
+                depth += 1
+            elif isinstance(event, yaml.CollectionEndEvent):
+                depth -= 1
+            if depth > 1:
+                continue
+            
+            # A key or value node of the case mapping is complete
+            if at_key:
+                key = event.value if node_start == position and isinstance(event, yaml.ScalarEvent) else None
+                if key == MERGE_KEY and event.implicit[0]:
+                    self.has_merge_key = True
+            elif key in fields:
+                self._value_spans[key] = (node_start, position + 1)
+            at_key = not at_key
+    
+    def field_value_events(self, ):
+        for field, (start, end) in self._value_spans.items():
+            yield field, self.events[start:end]
+
+def _expect(event, event_type, context):
+    if isinstance(event, event_type):
+        return
+    raise DataParseError(
+        "{} where {} expected in line {} while reading {}".format(
+            type(event).__name__,
+            event_type.__name__,
+            event.start_mark.line,
+            context,
+        )
+    )
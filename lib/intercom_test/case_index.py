@@ -0,0 +1,443 @@
+# Copyright 2018 PayTrace, Inc.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Primary-key index of the test cases of an interface
+
+A :class:`CaseIndex` maps the case key (as computed by
+:meth:`.CaseAugmenter.key_of_case`) of chosen primary key fields to the
+:class:`CaseLocation` of each test case in the main and extension test case
+files of an :class:`.InterfaceCaseProvider`.  Building the index parses the
+files to YAML events, constructing only the values of the primary key
+fields; looking up a case then decodes (and augments) only that case.
+
+As with update files (see :class:`.update_file.Indexer`), a case can be read
+starting at its offset in the file only if it is in a block-style top-level
+sequence and is "atomic" (contains no aliases to nodes outside it).  Other
+cases are located by document and position, and loading them requires
+loading their whole document.
+
+The index entries of each test case file can be cached in an index file,
+validated against the size, modification time and content digest of the
+test case file, so an unchanged file is not parsed again to index it.  The
+index files are kept in a separate directory (by default, the
+``.case-index`` subdirectory of the augmentation data directory; see
+:attr:`.InterfaceCaseProvider.case_index_dir`) rather than beside the test
+case files, which are typically shared between projects.  Like the index
+files of compact augmentation files, these are derived data that should
+typically be ignored by the version control system.
+"""
+
+from collections import namedtuple
+import hashlib
+import io
+import itertools
+import json
+import os
+import yaml
+from .augmentation.update_file import Indexer as _UpdateFileIndexer
+from .cases import RefreshReport, hash_from_fields as _hash_from_fields
+from .stats import open_data_file as _open_data_file
+from .utils import FileIndex
+from .yaml_tools import (
+    load_all as _yaml_load_all,
+    parse as _yaml_parse,
+    value_from_event_stream as _value_from_events,
+)
+
+INDEX_FILE_EXT = '.idx'
+INDEX_FORMAT = 1
+
+class CaseLocation(namedtuple('_CaseLocation', 'file_path offset document item')):
+    """Location of a test case within a test case file
+    
+    .. attribute:: file_path
+    
+        Path of the test case file
+    
+    .. attribute:: offset
+    
+        Byte offset of the start of the line on which the case begins, or
+        ``None`` if the case cannot be read independently of its document
+    
+    .. attribute:: document
+    
+        Index of the YAML document containing the case within the file
+    
+    .. attribute:: item
+    
+        Index of the case within the top-level sequence of its document
+    """
+
+BODY_TYPE_FIELDS = (
+    ('request body', 'request type'),
+    ('response body', 'response type'),
+)
+
+class CaseIndex:
+    """Index of the test cases of an :class:`.InterfaceCaseProvider` by case key
+    
+    :param case_provider: The :class:`.InterfaceCaseProvider` of the cases
+    :param key_fields: Names of the fields from which case keys are computed
+    :keyword index_dir:
+        *optional* Directory in which to keep (see :func:`index_file_path`)
+        the index files of the test case files; no index files are used if
+        not given
+    
+    When several cases have the same key, the first (in the order of
+    :meth:`.InterfaceCaseProvider.cases`) is indexed by key and the others
+    are counted in :attr:`duplicates`.  All cases, including duplicates, can
+    be reached by their position in :attr:`entries`.
+    
+    :meth:`refresh` brings the index up to date after test case files
+    change.
+    """
+    def __init__(self, case_provider, key_fields, *, index_dir=None):
+        super().__init__()
+        self._case_provider = case_provider
+        self.key_fields = frozenset(key_fields)
+        self.index_dir = index_dir
+        self._file_stats = {} # case file path -> (size, mtime_ns) when indexed
+        self._file_entries = {} # case file path -> list of (case_key, location)
+        case_files = case_provider.case_files()
+        for case_file, file_stat in _file_stats(case_files).items():
+            self._index_file(case_file, file_stat)
+        self._combine_entries(case_files)
+    
+    def refresh(self, ):
+        """Re-index the test case files that have changed
+        
+        :returns:
+            A :class:`.RefreshReport` of the case keys that appeared,
+            disappeared or (possibly) changed
+        
+        The test case files of the case provider are listed and stat-ed;
+        only files that are new or whose size or modification time differ
+        from when they were last indexed are indexed again.  Cases indexed
+        from such files are reported as changed.
+        """
+        case_files = self._case_provider.case_files()
+        file_stats = _file_stats(case_files)
+        changed_files = frozenset(
+            case_file
+            for case_file, file_stat in file_stats.items()
+            if self._file_stats.get(case_file) != file_stat
+        )
+        removed_files = frozenset(self._file_stats) - frozenset(file_stats)
+        if not (changed_files or removed_files):
+            return RefreshReport()
+        
+        prior_locations = self._locations
+        for case_file in removed_files:
+            del self._file_stats[case_file]
+            del self._file_entries[case_file]
+        for case_file in changed_files:
+            self._index_file(case_file, file_stats[case_file])
+        self._combine_entries(case_files)
+        
+        return RefreshReport(
+            appeared=self._locations.keys() - prior_locations.keys(),
+            disappeared=prior_locations.keys() - self._locations.keys(),
+            changed=(
+                case_key
+                for case_key in prior_locations.keys() & self._locations.keys()
+                if prior_locations[case_key] != self._locations[case_key]
+                or self._locations[case_key].file_path in changed_files
+            ),
+            files=changed_files | removed_files,
+        )
+    
+    def _index_file(self, case_file, file_stat):
+        self._file_entries[case_file] = list(indexed_cases(
+            case_file,
+            self.key_fields,
+            body_type_magic=self._case_provider.use_body_type_magic,
+            index_path=(
+                None if self.index_dir is None
+                else index_file_path(
+                    case_file,
+                    self.index_dir,
+                    self._case_provider.spec_dir,
+                    self.key_fields,
+                )
+            ),
+        ))
+        self._file_stats[case_file] = file_stat
+    
+    def _combine_entries(self, case_files):
+        self.duplicates = 0
+        self.entries = []
+        self._locations = {}
+        for case_file in case_files:
+            self.entries.extend(self._file_entries.get(case_file, ()))
+        for case_key, location in self.entries:
+            if case_key in self._locations:
+                self.duplicates += 1
+            else:
+                self._locations[case_key] = location
+    
+    def __len__(self, ):
+        return len(self._locations)
+    
+    def __iter__(self, ):
+        return iter(self._locations)
+    
+    def __contains__(self, test_case):
+        return self.key(test_case) in self._locations
+    
+    def key(self, test_case):
+        """Compute the case key of *test_case*
+        
+        *test_case* may be a :class:`dict` (or sequence of key/value pairs)
+        containing at least the key fields of the case, or a case key
+        :class:`str`, which is returned as is.
+        """
+        if isinstance(test_case, str):
+            return test_case
+        if hasattr(test_case, 'items'):
+            test_case = test_case.items()
+        return _hash_from_fields(
+            (k, v) for k, v in test_case
+            if k in self.key_fields
+        )
+    
+    def location(self, test_case):
+        """Get the :class:`CaseLocation` of a test case
+        
+        :param test_case: See :meth:`key`
+        :raises KeyError: if no case has the key of *test_case*
+        """
+        return self._locations[self.key(test_case)]
+    
+    def case(self, test_case):
+        """Load the full (augmented) test case having the key of *test_case*
+        
+        :param test_case: See :meth:`key`
+        :raises KeyError: if no case has the key of *test_case*
+        
+        The result is the same :class:`dict` the case provider's
+        :meth:`~.InterfaceCaseProvider.cases` would generate for the case.
+        """
+        return self._case_provider.case_at(self.location(test_case))
+    
+    def get(self, test_case, default=None):
+        """Like :meth:`case`, but returns *default* if there is no such case"""
+        try:
+            location = self.location(test_case)
+        except KeyError:
+            return default
+        return self._case_provider.case_at(location)
+    
+    def case_at_position(self, position):
+        """Load the full (augmented) test case at a position in :attr:`entries`
+        
+        Positions count the cases in the order of
+        :meth:`.InterfaceCaseProvider.cases`, so ``random.sample(range(len(
+        index.entries)), k)`` gives the positions of a random sample of cases.
+        
+        :raises IndexError: if there is no case at *position*
+        """
+        case_key, location = self.entries[position]
+        return self._case_provider.case_at(location)
+
+def _file_stats(file_paths):
+    """Get ``(size, mtime_ns)`` of each existing file in *file_paths*, by path"""
+    file_stats = {}
+    for file_path in file_paths:
+        try:
+            file_stat = os.stat(file_path)
+        except FileNotFoundError:
+            continue
+        file_stats[file_path] = (file_stat.st_size, file_stat.st_mtime_ns)
+    return file_stats
+
+def load_case(location):
+    """Load the (unaugmented) test case :class:`dict` at a :class:`CaseLocation`"""
+    if location.offset is None:
+        with _open_data_file(location.file_path, 'interface') as file:
+            case_sets = _yaml_load_all(file, safe_loading=False)
+            case_set = next(itertools.islice(case_sets, location.document, None))
+            return case_set[location.item]
+    
+    with _open_data_file(location.file_path, 'interface', binary=True) as file:
+        file.seek(location.offset)
+        events = _yaml_parse(io.TextIOWrapper(file, encoding='utf-8'))
+        next(events) # should be yaml.StreamStartEvent
+        next(events) # should be yaml.DocumentStartEvent
+        case_start = next(events)
+        if isinstance(case_start, yaml.SequenceStartEvent):
+            case_start = next(events)
+        return _value_from_events(
+            itertools.chain((case_start,), events),
+            safe_loading=False,
+        )
+
+class _InterfaceFileIndexer(_UpdateFileIndexer):
+    MERGE_KEY = '<<'
+    
+    def __init__(self, key_fields, *, body_type_magic=False):
+        super().__init__(key_fields, safe_loading=False)
+        if body_type_magic:
+            # Body types are needed to decode bodies given as JSON text
+            self.key_fields = self.key_fields | frozenset(
+                type_field
+                for body_field, type_field in BODY_TYPE_FIELDS
+                if body_field in self.key_fields
+            )
+        self._document = -1
+    
+    def read(self, event):
+        if isinstance(event, yaml.DocumentStartEvent):
+            self._document += 1
+            self._item = itertools.count(0)
+        elif isinstance(event, yaml.AliasEvent) and self._state is not self.State.tail:
+            # Key fields may come through the alias (e.g. with a merge key),
+            # so they can only be known from the loaded document
+            self._case_key_known = False
+        return super().read(event)
+    
+    def _read_from_top_sequence(self, event):
+        self._case_key_known = True
+        return super()._read_from_top_sequence(event)
+    
+    def _read_from_case_mapping(self, event):
+        if isinstance(event, yaml.AliasEvent):
+            self._case_data_key = None
+            self._state = self.State.case_data_value
+            return
+        return super()._read_from_case_mapping(event)
+    
+    def _read_from_case_data_value(self, event):
+        if isinstance(event, yaml.AliasEvent):
+            self._case_data_value = None
+            self._state = self.State.case_mapping
+            return self._capture_case_item()
+        return super()._read_from_case_data_value(event)
+    
+    def _capture_case_item(self, ):
+        if self._case_data_key == self.MERGE_KEY:
+            self._case_key_known = False
+        return super()._capture_case_item()
+    
+    def _capture_case(self, ):
+        key_values = self._case_id if self._case_key_known else None
+        offset = self._case_data_start if self._jumpable and self._case_atomic else None
+        del self._case_data_start
+        del self._case_id
+        return key_values, (offset, self._document, next(self._item))
+
+def case_key(test_case, key_fields, *, body_type_magic=False):
+    """Compute the case key of *test_case* from its *key_fields*
+    
+    With *body_type_magic*, bodies of type ``json`` are decoded first (see
+    :attr:`.InterfaceCaseProvider.use_body_type_magic`), so the key is that
+    of the case as generated by :meth:`.InterfaceCaseProvider.cases`.
+    """
+    if body_type_magic:
+        test_case = dict(test_case)
+        for body_field, type_field in BODY_TYPE_FIELDS:
+            if test_case.get(type_field) == 'json' and body_field in test_case:
+                test_case[body_field] = json.loads(test_case[body_field])
+    return _hash_from_fields(
+        (k, v) for k, v in test_case.items()
+        if k in key_fields
+    )
+
+def index_file_path(case_file, index_dir, spec_dir, key_fields):
+    """Path of the index file for test case file *case_file*
+    
+    :param case_file: Path of the test case file
+    :param index_dir: Directory in which index files are kept
+    :param spec_dir: Directory containing the test case files
+    :param key_fields: Names of the fields from which case keys are computed
+    
+    The index file has the path of *case_file* relative to *spec_dir*, with
+    a digest of *key_fields* and '.idx' appended, within *index_dir*, so
+    indexes by different key fields are kept apart.
+    """
+    key_fields_digest = hashlib.sha256(
+        json.dumps(sorted(key_fields)).encode('utf-8')
+    ).hexdigest()[:12]
+    return os.path.join(
+        index_dir,
+        "{}.{}{}".format(os.path.relpath(case_file, spec_dir), key_fields_digest, INDEX_FILE_EXT),
+    )
+
+def indexed_cases(case_file, key_fields, *, body_type_magic=False, index_path=None):
+    """Get a :class:`list` of ``(case_key, location)`` for the cases in a file
+    
+    :param case_file: Path of the test case file
+    :param key_fields: Names of the fields from which case keys are computed
+    :keyword body_type_magic: See :func:`case_key`
+    :keyword index_path:
+        *optional* Path of the index file (see :func:`index_file_path`) to
+        use (and maintain) for *case_file*
+    
+    Entries are in file order; each *location* is a :class:`CaseLocation`.
+    
+    The index file records the key fields along with the index entries, and
+    is validated and maintained as described for
+    :meth:`.utils.FileIndex.entries`.
+    """
+    if index_path is None:
+        with _open_data_file(case_file, 'interface', binary=True) as file:
+            content = file.read()
+        return _locations(case_file, _scan_cases(content, key_fields, body_type_magic=body_type_magic))
+    
+    file_index = FileIndex(
+        case_file,
+        index_path,
+        format=INDEX_FORMAT,
+        kind='interface',
+        settings={'key_fields': sorted(key_fields), 'body_type_magic': body_type_magic},
+    )
+    return _locations(case_file, file_index.entries(
+        lambda content: _scan_cases(content, key_fields, body_type_magic=body_type_magic)
+    ))
+
+def _locations(case_file, entries):
+    return [
+        (case_key, CaseLocation(case_file, offset, document, item))
+        for case_key, offset, document, item in entries
+    ]
+
+def _scan_cases(content, key_fields, *, body_type_magic=False):
+    """Get ``[case_key, offset, document, item]`` for each case in *content*"""
+    indexer = _InterfaceFileIndexer(key_fields, body_type_magic=body_type_magic)
+    text = content.decode('utf-8')
+    loaded_documents = None
+    entries = []
+    
+    # Offsets from the parser count characters; convert them to byte offsets
+    # for seeking
+    byte_offset, char_offset = 0, 0
+    for event in _yaml_parse(text):
+        entry = indexer.read(event)
+        if entry is None:
+            continue
+        key_values, (offset, document, item) = entry
+        if key_values is None:
+            if loaded_documents is None:
+                loaded_documents = list(_yaml_load_all(text, safe_loading=False))
+            key_values = loaded_documents[document][item]
+        if offset is not None:
+            byte_offset += len(text[char_offset:offset].encode('utf-8'))
+            char_offset = offset
+            offset = byte_offset
+        entries.append([
+            case_key(key_values, key_fields, body_type_magic=body_type_magic),
+            offset,
+            document,
+            item,
+        ])
+    return entries
@@ -14,11 +14,16 @@
 
 from base64 import b64encode
 from codecs import ascii_decode
+from collections import namedtuple, OrderedDict
 import hashlib
 import itertools
+import threading
+import time
 import yaml
 from .exceptions import DataParseError
-from .json_asn1.convert import asn1_der
+from .json_asn1.der import encode as asn1_der
+from .stats import stats as _stats
+from .tracing import tracer as _tracer
 from .utils import def_enum
 from .yaml_tools import value_from_event_stream as _value_from_events
 
@@ -32,16 +37,207 @@ def hash_from_fields(test_case):
     The hash is computed by encoding *test_case* in ASN1 DER (see
     :const:`.json_asn1.types.ASN1_SOURCE` for the ASN1 syntax of the data
     format), then hashing with SHA-256, and finally Base64 encoding to get the
-    result.
+    result.  The DER encoding is written directly by :mod:`.json_asn1.der`;
+    :func:`.json_asn1.convert.asn1_der` produces the same octets through
+    :mod:`pyasn1` and is used for any value the direct encoder does not
+    handle.
     
     Note that this function hashes **all** key/value pairs of *test_case*.
+    
+    Results are memoized in :data:`case_key_memo`, so hashing the same
+    fields again (as happens each time a corpus of test cases is iterated)
+    costs only the construction of a canonical form of the fields.
     """
-    key = test_case if isinstance(test_case, dict) else dict(test_case)
-    key = asn1_der(key)
+    if _tracer.enabled:
+        with _tracer.sampled_span('hash_from_fields', 'hash'):
+            return _counted_hash(test_case)
+    return _counted_hash(test_case)
+
+def _counted_hash(test_case):
+    if _stats.enabled:
+        start = time.perf_counter()
+        try:
+            return _memoized_hash(test_case)
+        finally:
+            _stats.keys_hashed += 1
+            _stats.hash_seconds += time.perf_counter() - start
+    return _memoized_hash(test_case)
+
+def _memoized_hash(test_case):
+    fields = test_case if isinstance(test_case, dict) else dict(test_case)
+    try:
+        memo_key = canonical_form(fields)
+    except UncanonicalizableValue:
+        return _hash_of_der(fields)
+    return case_key_memo.lookup(memo_key, _hash_of_der, fields)
+
+def _hash_of_der(fields):
+    key = asn1_der(fields)
     key = hashlib.sha256(key).digest()
     key = ascii_decode(b64encode(key))[0]
     return key
 
+class UncanonicalizableValue(TypeError):
+    """Raised when a value has no canonical form for :class:`CaseKeyMemo`"""
+
+def canonical_form(value):
+    """Build a hashable form of a JSON-ic value for memoizing its case key
+    
+    Two values have equal canonical forms exactly when they have the same
+    DER encoding: mapping order is disregarded and lists and tuples are
+    equivalent.  Values that are not :class:`str`, :class:`int`,
+    :class:`float`, ``None``, mappings or lists/tuples of these -- or that
+    contain a cycle -- raise :class:`UncanonicalizableValue`.
+    """
+    in_progress = set()
+    
+    def step(value):
+        if value is None or isinstance(value, (str, int, float)):
+            return value
+        if id(value) in in_progress:
+            raise UncanonicalizableValue("cyclical object graph")
+        in_progress.add(id(value))
+        try:
+            if isinstance(value, dict):
+                return ('{}', frozenset(
+                    (step_key(k), step(v)) for k, v in value.items()
+                ))
+            elif isinstance(value, (list, tuple)):
+                return ('[]', tuple(step(item) for item in value))
+        finally:
+            in_progress.discard(id(value))
+        raise _uncanonicalizable(value)
+    
+    def step_key(k):
+        if not isinstance(k, str):
+            raise _uncanonicalizable(k)
+        return k
+    
+    return step(value)
+
+def _uncanonicalizable(value):
+    return UncanonicalizableValue(
+        "{} values have no canonical form".format(type(value).__name__)
+    )
+
+class RefreshReport(namedtuple('_RefreshReport', 'appeared disappeared changed files')):
+    """Changes found by a ``refresh()``
+    
+    .. attribute:: appeared
+    
+        :class:`frozenset` of case keys that are new
+    
+    .. attribute:: disappeared
+    
+        :class:`frozenset` of case keys that are gone
+    
+    .. attribute:: changed
+    
+        :class:`frozenset` of case keys whose data may have changed
+    
+    .. attribute:: files
+    
+        :class:`frozenset` of paths of the files that were read again or
+        dropped
+    
+    A report is true if anything changed.  Reports combine with ``|``.
+    """
+    def __new__(cls, appeared=frozenset(), disappeared=frozenset(), changed=frozenset(), files=frozenset()):
+        return super().__new__(cls, frozenset(appeared), frozenset(disappeared), frozenset(changed), frozenset(files))
+    
+    @classmethod
+    def comparing(cls, before, after, *, files=frozenset()):
+        """Build a report from mappings of case key to entry before and after
+        
+        Keys in both whose entries are not the same object are *changed*.
+        """
+        return cls(
+            appeared=after.keys() - before.keys(),
+            disappeared=before.keys() - after.keys(),
+            changed=(
+                case_key
+                for case_key in before.keys() & after.keys()
+                if before[case_key] is not after[case_key]
+            ),
+            files=files,
+        )
+    
+    def __bool__(self, ):
+        return any(field for field in tuple.__iter__(self))
+    
+    def __or__(self, other):
+        return type(self)(*(
+            mine | theirs
+            for mine, theirs in zip(tuple.__iter__(self), tuple.__iter__(other))
+        ))
+
+class CaseKeyMemo:
+    """Bounded, least-recently-used memo of case keys
+    
+    Entries map the :func:`canonical_form` of the hashed fields to the case
+    key.  When more than :attr:`maxsize` entries are held, the least recently
+    used entries are evicted.  A *maxsize* of 0 disables memoization.
+    
+    :attr:`hits`, :attr:`misses` and :attr:`evictions` count lookups that
+    were answered from the memo, lookups that computed the key, and entries
+    discarded to honor :attr:`maxsize`; :meth:`info` reports them together.
+    """
+    Info = namedtuple('Info', 'hits misses evictions maxsize currsize')
+    
+    def __init__(self, maxsize):
+        super().__init__()
+        self._maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+    
+    @property
+    def maxsize(self):
+        return self._maxsize
+    
+    @maxsize.setter
+    def maxsize(self, value):
+        with self._lock:
+            self._maxsize = value
+            self._evict()
+    
+    def lookup(self, memo_key, compute, *args):
+        """Get the case key for *memo_key*, calling *compute* with *args* on a miss"""
+        with self._lock:
+            try:
+                case_key = self._entries[memo_key]
+            except KeyError:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(memo_key)
+                self.hits += 1
+                return case_key
+        
+        case_key = compute(*args)
+        with self._lock:
+            if self._maxsize > 0:
+                self._entries[memo_key] = case_key
+                self._evict()
+        return case_key
+    
+    def info(self, ):
+        with self._lock:
+            return self.Info(self.hits, self.misses, self.evictions, self._maxsize, len(self._entries))
+    
+    def clear(self, ):
+        """Discard all entries and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+    
+    def _evict(self, ):
+        while len(self._entries) > max(self._maxsize, 0):
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+#: Process-wide :class:`CaseKeyMemo` used by :func:`hash_from_fields`
+case_key_memo = CaseKeyMemo(maxsize=16384)
+
 class IdentificationListReader:
     """Utility class to read case ID and associated events from a YAML event stream
     
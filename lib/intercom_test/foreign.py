@@ -1,10 +1,14 @@
+import functools
 import json
 import os.path
 import re
 import sys
-import yaml
 
-from . import __version__ as _package_version, __name__ as _package, framework
+from . import __version__ as _package_version, __name__ as _package, framework, snapshot_cache, stub_server
+from .augmentation import sqlite_store
+from .stats import stats as _stats
+from .tracing import tracer as _tracer
+from .yaml_tools import dump as _yaml_dump, load as _yaml_load
 
 try:
     from docopt_subcommands import command as subcommand, main
@@ -116,16 +120,19 @@ class Config(object):
     CASE_AUGMENTATION_KEYS = frozenset(('augmentation data', 'request keys'))
     
     case_augmenter = None
+    snapshot_cache_dir = None
     
     def __init__(self, filepath):
         super(Config, self).__init__()
         with open(filepath) as cfgfile:
-            cfg_data = yaml.safe_load(cfgfile)
+            cfg_data = _yaml_load(cfgfile)
         
         ref_dir = os.path.dirname(filepath)
         
         self.interface_dir = os.path.join(ref_dir, cfg_data['interfaces'])
         self.service_name = cfg_data['service name']
+        if 'snapshot cache' in cfg_data:
+            self.snapshot_cache_dir = os.path.join(ref_dir, cfg_data['snapshot cache'])
         
         which_aug_keys = self.CASE_AUGMENTATION_KEYS & set(cfg_data.keys())
         if self.CASE_AUGMENTATION_KEYS == which_aug_keys:
@@ -133,7 +140,9 @@ class Config(object):
                 pass
             CLICaseAugmenter.CASE_PRIMARY_KEYS = frozenset(cfg_data['request keys'])
             self.case_augmenter = CLICaseAugmenter(
-                os.path.join(ref_dir, cfg_data['augmentation data'])
+                os.path.join(ref_dir, cfg_data['augmentation data']),
+                compact_storage=cfg_data.get('augmentation storage'),
+                lazy_indexing=True,
             )
         elif which_aug_keys:
             print("Case augmentation partially specified (only {} given)!".format(
@@ -182,7 +191,40 @@ class Config(object):
     def _yaml_str(cls, s):
         if "\n" in s:
             raise ValueError("Cannot handle strings with newlines")
-        return yaml.dump(s).splitlines()[0]
+        return _yaml_dump(s).splitlines()[0]
+
+def _reporting_stats(fn):
+    """Decorate a subcommand to honor its ``--stats`` option"""
+    @functools.wraps(fn)
+    def wrapper(options):
+        if not options.get('--stats'):
+            return fn(options)
+        
+        _stats.reset()
+        _stats.enable()
+        try:
+            return fn(options)
+        finally:
+            _stats.disable()
+            print(_stats.report(), file=sys.stderr)
+    return wrapper
+
+def _writing_trace(fn):
+    """Decorate a subcommand to honor its ``--trace`` option"""
+    @functools.wraps(fn)
+    def wrapper(options):
+        trace_file = options.get('--trace')
+        if not trace_file:
+            return fn(options)
+        
+        _tracer.reset()
+        _tracer.enable(sample_every=int(options.get('--trace-sample') or 1))
+        try:
+            return fn(options)
+        finally:
+            _tracer.disable()
+            _tracer.write(trace_file)
+    return wrapper
 
 @subcommand()
 def init(options):
@@ -198,39 +240,57 @@ def init(options):
         raise SystemExit(1)
 
 @subcommand()
+@_reporting_stats
+@_writing_trace
 def enumerate(options):
-    """usage: {program} enumerate [options]
+    """usage: {program} enumerate [options] [--where COND]...
     
     Enumerate all test cases, including any configured augmentation data
     
+    Only cases satisfying every --where condition are enumerated.  A COND of
+    FIELD=VALUE requires the field to equal VALUE (read as YAML, so a flow
+    sequence like method=[GET, HEAD] accepts any of its items) and
+    FIELD^=PREFIX requires the field to be a string starting with PREFIX.
+    
     Options:
         -c CONFFILE, --config CONFFILE      path to configuration file
         -o FORMAT, --output FORMAT          format of output, e.g. yaml, jsonl [default: yaml]
+        -w COND, --where COND               condition on test case fields
+        --stats                             print counts of work done to stderr
+        --trace FILE                        write a Chrome trace of the work done to FILE
+        --trace-sample N                    trace one in N hashes and augmentations [default: 1]
     """
     config = Config(options.get('--config'))
     
+    case_filter = None
+    if options.get('--where'):
+        case_filter = framework.CaseFilter.parse(options['--where'])
+    
     icp_kwargs = {}
     case_provider = framework.InterfaceCaseProvider(
         config.interface_dir,
         config.service_name,
         case_augmenter=config.case_augmenter,
+        snapshot_cache_dir=config.snapshot_cache_dir,
     )
     
     outfmt = options['--output']
     if outfmt == 'yaml':
         def dump(c):
             print('---')
-            yaml.safe_dump(c, sys.stdout)
+            _yaml_dump(c, sys.stdout, safe=True)
     elif outfmt == 'jsonl':
         def dump(c):
             print(json.dumps(c))
     else:
         raise ValueError("{!r} is not a supported output format".format(outfmt))
     
-    for c in case_provider.cases():
+    for c in case_provider.cases(where=case_filter):
         dump(c)
 
 @subcommand()
+@_reporting_stats
+@_writing_trace
 def commit_updates(options):
     """usage: {program} commitupdates [options]
     
@@ -238,6 +298,9 @@ def commit_updates(options):
     
     Options:
         -c CONFFILE, --config CONFFILE      path to configuration file
+        --stats                             print counts of work done to stderr
+        --trace FILE                        write a Chrome trace of the work done to FILE
+        --trace-sample N                    trace one in N hashes and augmentations [default: 1]
     """
     config = Config(options.get('--config'))
     
@@ -249,6 +312,125 @@ def commit_updates(options):
     case_provider.update_compact_files()
 
 @subcommand()
+@_reporting_stats
+@_writing_trace
+def import_compact(options):
+    """usage: {program} importcompact [options] [<compact-file>...]
+    
+    Import YAML compact augmentation files into the SQLite augmentation data
+    store of the service.  Without any <compact-file> arguments, all YAML
+    compact files in the augmentation data directory are imported.
+    
+    Options:
+        -c CONFFILE, --config CONFFILE      path to configuration file
+        --stats                             print counts of work done to stderr
+        --trace FILE                        write a Chrome trace of the work done to FILE
+        --trace-sample N                    trace one in N hashes and augmentations [default: 1]
+    """
+    config = Config(options.get('--config'))
+    case_augmenter = _required_case_augmenter(config)
+    
+    compact_files = options['<compact-file>'] or [
+        file_path
+        for file_path in framework.data_files(case_augmenter.augmentation_data_dir)
+        if not file_path.endswith(case_augmenter.UPDATE_FILE_EXT)
+    ]
+    count = sqlite_store.import_compact_files(case_augmenter.compact_db_path, compact_files)
+    print("Imported {} entries into {}".format(count, case_augmenter.compact_db_path), file=sys.stderr)
+
+@subcommand()
+@_reporting_stats
+@_writing_trace
+def export_compact(options):
+    """usage: {program} exportcompact [options]
+    
+    Export the SQLite augmentation data store of the service to YAML compact
+    augmentation files.
+    
+    Options:
+        -c CONFFILE, --config CONFFILE      path to configuration file
+        -d DIR, --output-dir DIR            directory in which to write the
+                                            compact files (default: the
+                                            augmentation data directory)
+        --stats                             print counts of work done to stderr
+        --trace FILE                        write a Chrome trace of the work done to FILE
+        --trace-sample N                    trace one in N hashes and augmentations [default: 1]
+    """
+    config = Config(options.get('--config'))
+    case_augmenter = _required_case_augmenter(config)
+    
+    for file_path in sqlite_store.export_compact_files(
+        case_augmenter.compact_db_path,
+        options.get('--output-dir') or case_augmenter.augmentation_data_dir,
+    ):
+        print(file_path)
+
+@subcommand()
+@_reporting_stats
+@_writing_trace
+def warm_snapshots(options):
+    """usage: {program} warmsnapshots [options]
+    
+    Generate all test cases, storing snapshots of them in the snapshot cache
+    so later commands can replay them instead of parsing and augmenting the
+    test case files again.
+    
+    Options:
+        -c CONFFILE, --config CONFFILE      path to configuration file
+        -d DIR, --cache-dir DIR             snapshot cache directory (default:
+                                            'snapshot cache' from the config)
+        --stats                             print counts of work done to stderr
+        --trace FILE                        write a Chrome trace of the work done to FILE
+        --trace-sample N                    trace one in N hashes and augmentations [default: 1]
+    """
+    config = Config(options.get('--config'))
+    case_provider = framework.InterfaceCaseProvider(
+        config.interface_dir,
+        config.service_name,
+        case_augmenter=config.case_augmenter,
+        snapshot_cache_dir=_required_snapshot_cache_dir(config, options),
+    )
+    count = sum(1 for c in case_provider.cases())
+    snapshots = case_provider.snapshot_cache.snapshots()
+    print("Cached {} test cases; {} snapshots ({} bytes) in {}".format(
+        count,
+        len(snapshots),
+        sum(size for path, size, mtime in snapshots),
+        case_provider.snapshot_cache_dir,
+    ), file=sys.stderr)
+
+@subcommand()
+def clear_snapshots(options):
+    """usage: {program} clearsnapshots [options]
+    
+    Remove all snapshots from the snapshot cache.
+    
+    Options:
+        -c CONFFILE, --config CONFFILE      path to configuration file
+        -d DIR, --cache-dir DIR             snapshot cache directory (default:
+                                            'snapshot cache' from the config)
+    """
+    config = Config(options.get('--config'))
+    cache_dir = _required_snapshot_cache_dir(config, options)
+    removed = snapshot_cache.SnapshotCache(cache_dir).clear()
+    print("Removed {} snapshots from {}".format(removed, cache_dir), file=sys.stderr)
+
+def _required_snapshot_cache_dir(config, options):
+    cache_dir = options.get('--cache-dir') or config.snapshot_cache_dir
+    if cache_dir is None:
+        print("No snapshot cache is configured!", file=sys.stderr)
+        raise SystemExit(1)
+    return cache_dir
+
+def _required_case_augmenter(config):
+    if config.case_augmenter is None:
+        print("No augmentation data is configured!", file=sys.stderr)
+        raise SystemExit(1)
+    return config.case_augmenter
+
+@subcommand()
+@_reporting_stats
+@_writing_trace
 def merge_cases(options):
     """usage: {program} mergecases [options]
     
@@ -257,6 +439,9 @@ def merge_cases(options):
     
     Options:
         -c CONFFILE, --config CONFFILE      path to configuration file
+        --stats                             print counts of work done to stderr
+        --trace FILE                        write a Chrome trace of the work done to FILE
+        --trace-sample N                    trace one in N hashes and augmentations [default: 1]
     """
     config = Config(options.get('--config'))
     
@@ -266,6 +451,51 @@ def merge_cases(options):
     )
     case_provider.merge_test_extensions()
 
+@subcommand()
+@_reporting_stats
+@_writing_trace
+def serve(options):
+    """usage: {program} serve [options]
+    
+    Serve the test cases of the service as an HTTP stub: each request is
+    answered from the response fields of the test case with the same url,
+    method and request body.  Interrupt (Ctrl-C) to stop; request counts and
+    latencies are then printed to stderr.
+    
+    Options:
+        -c CONFFILE, --config CONFFILE      path to configuration file
+        -b ADDRESS, --bind ADDRESS          address on which to listen [default: 127.0.0.1]
+        -p PORT, --port PORT                port on which to listen [default: 8080]
+        --stats                             print counts of work done to stderr
+        --trace FILE                        write a Chrome trace of the work done to FILE
+        --trace-sample N                    trace one in N hashes and augmentations [default: 1]
+    """
+    config = Config(options.get('--config'))
+    
+    case_provider = framework.InterfaceCaseProvider(
+        config.interface_dir,
+        config.service_name,
+        case_augmenter=config.case_augmenter,
+        snapshot_cache_dir=config.snapshot_cache_dir,
+    )
+    responder = stub_server.CaseResponder(case_provider.cases())
+    if responder.duplicates:
+        print("{} test cases duplicate the request of an earlier case and will not be served".format(
+            responder.duplicates
+        ), file=sys.stderr)
+    
+    server = stub_server.StubServer((options['--bind'], int(options['--port'])), responder)
+    print("Serving {} test cases on http://{}:{}/".format(
+        len(responder), *server.server_address[:2]
+    ), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(server.report(), file=sys.stderr)
+
 def csmain():
     main(sys.argv[0], _package_version)
 
@@ -12,33 +12,67 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+import bisect
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
 import functools
 from io import StringIO
+import itertools
 import json
 import logging
 import os.path
+import pickle
 import shutil
+import threading
 import yaml
+from .case_filter import AllOf as _AllOf, CaseFilter, filtered_cases as _filtered_cases
+from .case_index import CaseIndex, load_case as _load_case
 from .cases import (
     IdentificationListReader as CaseIdListReader,
+    RefreshReport,
     hash_from_fields as _hash_from_fields,
 )
 from .exceptions import MultipleAugmentationEntriesError, NoAugmentationError
+from .sharding import (
+    BalancedShardFilter,
+    ShardFilter,
+    ShardResults,
+    TimingHistory,
+    balanced_assignment,
+    validated_shard,
+)
+from .snapshot_cache import (
+    SnapshotCache,
+    file_fingerprint as _file_fingerprint,
+    fingerprint as _snapshot_fingerprint,
+)
+from .stats import open_data_file as _open_data_file, stats as _stats
+from .tracing import tracer as _tracer
 from .augmentation.compact_file import (
     augment_dict_from,
     case_keys as case_keys_in_compact_file,
+    indexed_case_keys as indexed_case_keys_in_compact_file,
+    read_entries as read_compact_file_entries,
+    splice_updates as splice_compact_file_updates,
     TestCaseAugmenter as CompactFileAugmenter,
     Updater as CompactAugmentationUpdater,
+    write_case_index as write_compact_file_index,
 )
-from .augmentation import update_file
+from .augmentation import sqlite_store, update_file
+from .augmentation.sqlite_store import TestCaseAugmenter as StoreAugmenter
 from .utils import (
+    atomic_write,
     FilteredDictView as _FilteredDictView,
-    open_temp_copy,
 )
 from .yaml_tools import (
     YAML_EXT,
-    content_events as _yaml_content_events
+    content_events as _yaml_content_events,
+    dump as _yaml_dump,
+    emit as _yaml_emit,
+    load_all as _yaml_load_all,
+    parse as _yaml_parse,
 )
 
 logger = logging.getLogger(__name__)
@@ -59,10 +93,66 @@ class InterfaceCaseProvider:
     case is ``"json"``, and similarly for ``"response body"`` and
     ``"response type"``.
     
+    Setting :attr:`max_workers` (or passing *max_workers* to the
+    constructor) to a number greater than 1 causes :meth:`cases` to parse and
+    augment the test case files of the group in a pool of that many worker
+    processes, as long as the group has at least
+    :attr:`min_files_for_worker_pool` files and this object (including its
+    *case_augmenter*) can be pickled.  Cases are still generated in the same
+    order as when parsing serially.
+    
+    Setting :attr:`snapshot_cache_dir` (or passing *snapshot_cache_dir* to
+    the constructor) keeps snapshots of the cases generated from each test
+    case file in that directory (see :mod:`.snapshot_cache`), which
+    :meth:`cases` replays instead of parsing and augmenting the file again
+    as long as neither the file nor the augmentation data has changed.  The
+    augmentation data can only be fingerprinted if the *case_augmenter*
+    provides :meth:`~.CaseAugmenter.data_fingerprint`; cases are not cached
+    otherwise.
+    
+    When the cases are split among several shards (see :mod:`.sharding`),
+    the outcome of each shard is kept in :attr:`shard_results_dir` --
+    by default, the ``.shard-results`` subdirectory of the augmentation data
+    directory -- until the outcomes of all shards are known.  The shards of
+    a run must share a :attr:`shard_run_id` (or the
+    ``INTERCOM_TEST_SHARD_RUN_ID`` environment variable) for compact files
+    to be updated.  Setting :attr:`shard_timing_history` to the path of a
+    :class:`.sharding.TimingHistory` file splits the cases into shards of
+    about equal total duration rather than by hash.
+    
     .. automethod:: __init__
     """
     
     use_body_type_magic = False
+    max_workers = None
+    min_files_for_worker_pool = 4
+    
+    # Set this to a directory shared by all shards of a sharded run to keep
+    # their outcomes somewhere other than the augmentation data directory
+    shard_results_dir = None
+    
+    # Set this to an identifier shared by all shards of a sharded run (or
+    # set the INTERCOM_TEST_SHARD_RUN_ID environment variable); compact files
+    # are only updated from sharded runs with an identifier
+    shard_run_id = None
+    
+    # Set this to the path of a timing history file (see
+    # sharding.TimingHistory) to split sharded cases by recorded duration
+    # instead of by hash
+    shard_timing_history = None
+    
+    # Set this to False to index test case files for case_index() without
+    # reading or writing their index files, or set case_index_dir to keep
+    # the index files somewhere other than the .case-index subdirectory of
+    # the augmentation data directory
+    use_case_file_indexes = True
+    case_index_dir = None
+    
+    # Set this to a directory in which to keep snapshots of the test cases
+    # generated from each test case file, and snapshot_cache_max_bytes to
+    # limit the total size of the snapshots kept there
+    snapshot_cache_dir = None
+    snapshot_cache_max_bytes = None
     
     class _UpdateState(Enum):
         not_requested   = '-'
@@ -74,7 +164,7 @@ class InterfaceCaseProvider:
     
     _case_augmenter = None
     
-    def __init__(self, spec_dir, group_name, *, case_augmenter=None):
+    def __init__(self, spec_dir, group_name, *, case_augmenter=None, max_workers=None, snapshot_cache_dir=None):
         """Constructing an instance
         
         :param spec_dir: File system directory for test case specifications
@@ -82,6 +172,12 @@ class InterfaceCaseProvider:
         :keyword case_augmenter:
             *optional* An object providing the interface of a
             :class:`.CaseAugmenter`
+        :keyword max_workers:
+            *optional* Maximum number of worker processes to use for parsing
+            test case files (see :attr:`max_workers`)
+        :keyword snapshot_cache_dir:
+            *optional* Directory in which to cache the generated test cases
+            (see :attr:`snapshot_cache_dir`)
         
         The main test case file of the group is located in *spec_dir* and is
         named for *group_name* with the '.yml' extension added.  Extension
@@ -92,6 +188,11 @@ class InterfaceCaseProvider:
         self._spec_dir = spec_dir
         self._group_name = group_name
         self._compact_files_update = self._UpdateState.not_requested
+        self._case_indexes = {}
+        if max_workers is not None:
+            self.max_workers = max_workers
+        if snapshot_cache_dir is not None:
+            self.snapshot_cache_dir = snapshot_cache_dir
         if case_augmenter:
             self._case_augmenter = case_augmenter
             self._augmented_case = case_augmenter.augmented_test_case
@@ -116,24 +217,191 @@ class InterfaceCaseProvider:
         """Path to the main test file of the group for this instance"""
         return os.path.join(self.spec_dir, self.group_name + YAML_EXT)
     
+    @property
+    def snapshot_cache(self):
+        """The :class:`.SnapshotCache` used by this object, if any"""
+        if self.snapshot_cache_dir is None:
+            return None
+        return SnapshotCache(self.snapshot_cache_dir, max_bytes=self.snapshot_cache_max_bytes)
+    
     def extension_files(self, ):
         """Get an iterable of the extension files of this instance"""
         return extension_files(self.spec_dir, self.group_name)
     
-    def cases(self, ):
+    def case_files(self, ):
+        """Get a :class:`list` of the test case files of this instance
+        
+        The files are listed in the order in which :meth:`cases` reads them.
+        """
+        return [self.main_group_test_file] + sorted(self.extension_files())
+    
+    def cases(self, *, where=None, shard=None):
         """Generates :class:`dict`\ s of test case data
         
+        :keyword where:
+            *optional* A mapping of field names to conditions (see
+            :mod:`.case_filter`) that generated cases must satisfy, or a
+            :class:`.CaseFilter`
+        :keyword shard:
+            *optional* ``(index, count)`` of the shard of the cases to
+            generate (see :mod:`.sharding`); requires a *case_augmenter*,
+            whose :const:`~.CaseAugmenter.CASE_PRIMARY_KEYS` are used to
+            assign cases to shards
+        
         This method reads test cases from the group's main test case file
         and auxiliary files, possibly extending them with augmented data (if
         *case_augmentations* was given in the constructor).
+        
+        With *where* or *shard*, the cases are selected from the YAML events
+        of each case, so cases not selected are neither fully constructed nor
+        augmented.
+        
+        In a sharded run, compact augmentation files are updated (see
+        :meth:`update_compact_augmentation_on_success`) only when the cases
+        of every shard have passed.
         """
-        yield from self._cases_from_file(self.main_group_test_file)
-        for ext_file in sorted(self.extension_files()):
-            yield from self._cases_from_file(ext_file)
+        shard_filter, test_cases = self._selected_cases(where, shard)
+        any_cases = False
+        for test_case in test_cases:
+            any_cases = True
+            yield test_case
+        
+        self._finish_run(shard_filter, any_cases=any_cases)
+    
+    def _timed_cases(self, timings, *, where=None, shard=None):
+        """Generates ``(test_case, (augment_wall, augment_cpu))`` as :meth:`cases` generates cases"""
+        shard_filter, timed_cases = self._selected_cases(where, shard, timings=timings)
+        any_cases = False
+        for timed_case in timed_cases:
+            any_cases = True
+            yield timed_case
+        
+        self._finish_run(shard_filter, any_cases=any_cases)
+    
+    def _selected_cases(self, where, shard, *, timings=None):
+        case_filter = where
+        if case_filter is not None and not isinstance(case_filter, CaseFilter):
+            case_filter = CaseFilter(case_filter)
+        shard_filter = None
+        if shard is not None:
+            if self._case_augmenter is None:
+                raise ValueError("Sharding test cases requires a case augmenter")
+            if self.shard_timing_history is None:
+                shard_filter = ShardFilter(
+                    shard,
+                    self._case_augmenter.CASE_PRIMARY_KEYS,
+                    body_type_magic=self.use_body_type_magic,
+                )
+            else:
+                shard_filter = self._balanced_shard_filter(shard)
+            case_filter = shard_filter if case_filter is None else _AllOf((case_filter, shard_filter))
         
-        if self._compact_files_update is self._UpdateState.requested:
+        case_files = self.case_files()
+        if timings is None and self._use_worker_pool(case_files, case_filter):
+            test_cases = self._cases_from_files_in_worker_pool(case_files, case_filter)
+        else:
+            test_cases = (
+                test_case
+                for case_file in case_files
+                for test_case in self._cases_from_file(case_file, case_filter, timings)
+            )
+        return shard_filter, test_cases
+    
+    def _balanced_shard_filter(self, shard):
+        index, count = validated_shard(shard)
+        case_index = self.case_index()
+        case_index.refresh()
+        return BalancedShardFilter(
+            (index, count),
+            balanced_assignment(
+                case_index,
+                count,
+                TimingHistory(self.shard_timing_history).durations,
+            ),
+            case_index.key_fields,
+            body_type_magic=self.use_body_type_magic,
+        )
+    
+    def _finish_run(self, shard_filter, *, any_cases):
+        if shard_filter is not None:
+            self._record_shard_outcome(shard_filter, vacuous=not any_cases)
+        elif self._compact_files_update is self._UpdateState.requested:
             self.update_compact_files()
     
+    def case_index(self, key_fields=None):
+        """Get an index of the test cases of this instance by case key
+        
+        :param key_fields:
+            *optional* Names of the fields from which case keys are
+            computed; defaults to the :const:`~.CaseAugmenter.CASE_PRIMARY_KEYS`
+            of the *case_augmenter*
+        :rtype: .CaseIndex
+        
+        The index for a given set of *key_fields* is built when first
+        requested and kept by this object.  It holds only the location of
+        each case, so finding a case through it decodes only that case.
+        Unless :attr:`use_case_file_indexes` is false, the entries for each
+        test case file are cached in an index file in :attr:`case_index_dir`
+        -- by default, the ``.case-index`` subdirectory of the augmentation
+        data directory -- so unchanged files need not be parsed to build the
+        index.  Without a *case_augmenter* or :attr:`case_index_dir`, no
+        index files are used.
+        """
+        if key_fields is None:
+            if self._case_augmenter is None:
+                raise ValueError("key_fields must be given when there is no case augmenter")
+            key_fields = self._case_augmenter.CASE_PRIMARY_KEYS
+        key_fields = frozenset(key_fields)
+        index = self._case_indexes.get(key_fields)
+        if index is None:
+            index = self._case_indexes[key_fields] = CaseIndex(
+                self,
+                key_fields,
+                index_dir=self._case_index_dir(),
+            )
+        return index
+    
+    def _case_index_dir(self, ):
+        if not self.use_case_file_indexes:
+            return None
+        if self.case_index_dir is not None:
+            return self.case_index_dir
+        if self._case_augmenter is None:
+            return None
+        return os.path.join(self._case_augmenter.augmentation_data_dir, '.case-index')
+    
+    def refresh(self, ):
+        """Bring this object up to date with changed test case and augmentation files
+        
+        :returns:
+            A :class:`.RefreshReport` combining the reports of refreshing
+            each index built by :meth:`case_index` and the *case_augmenter*
+            (if it supports refreshing)
+        :raises MultipleAugmentationEntriesError:
+            if the changed augmentation data files conflict
+        
+        Only files whose size or modification time has changed are read
+        again, so this is cheap to call periodically from long-running
+        processes.  :meth:`cases` always reads the current files and needs no
+        refreshing.
+        """
+        report = RefreshReport()
+        for index in self._case_indexes.values():
+            report |= index.refresh()
+        refresh_augmentation = getattr(self._case_augmenter, 'refresh', None)
+        if refresh_augmentation is not None:
+            report |= refresh_augmentation()
+        return report
+    
+    def case_at(self, location):
+        """Load the test case at a :class:`.CaseLocation`
+        
+        The result is the same :class:`dict` :meth:`cases` would generate for
+        the case, including any augmentation.
+        """
+        test_case = self._with_body_types_parsed(_load_case(location))
+        return next(iter(self._augmented_cases((test_case,))))
+    
     def update_compact_augmentation_on_success(self, fn):
         """Decorator for activating compact data file updates
         
@@ -159,7 +427,7 @@ class InterfaceCaseProvider:
         
         return wrapper
     
-    def case_runners(self, fn, *, do_compact_updates=True):
+    def case_runners(self, fn, *, do_compact_updates=True, where=None, shard=None, timings=None):
         """Generates runner callables from a callable
         
         The callables in the returned iterable each call *fn* with all the
@@ -175,21 +443,205 @@ class InterfaceCaseProvider:
         * Each returned runner callable will log the test case as YAML prior
           to invoking *fn*, which is helpful when updating the augmenting data
           for the case becomes necessary
+        
+        *where* and *shard* select the cases for which runners are
+        generated, as for :meth:`cases`.
+        
+        Passing a :class:`.timing.CaseTimings` as *timings* records the wall
+        and CPU time of augmenting each case and of running *fn* on it, by
+        case key; the cases are then read serially, without the worker pool
+        or snapshot cache (see :mod:`.timing`).
         """
         
         if do_compact_updates:
             fn = self.update_compact_augmentation_on_success(fn)
         
-        for case in self.cases():
-            @functools.wraps(fn)
-            def wrapper(*args, **kwargs):
-                logger.info("{}\n{}".format(
-                    " CASE TESTED ".center(40, '*'),
-                    yaml.dump([case]),
-                ))
+        if timings is None:
+            for case in self.cases(where=where, shard=shard):
+                yield self._case_runner(fn, case)
+        else:
+            for case, augment_times in self._timed_cases(timings, where=where, shard=shard):
+                yield self._case_runner(fn, case, timings=timings, augment_times=augment_times)
+    
+    def _case_runner(self, fn, case, *, timings=None, augment_times=None):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            _log_case_tested(case)
+            if timings is None:
                 return fn(*args, case, **kwargs)
-            
-            yield wrapper
+            return timings.timed_run(self._timing_key(case), augment_times, fn, *args, case, **kwargs)
+        
+        return wrapper
+    
+    def _timing_key(self, test_case):
+        if self._case_augmenter is None:
+            return _hash_from_fields(test_case)
+        return self._case_augmenter.key_of_case(test_case)
+    
+    def run_all(self, fn, *, workers=None, do_compact_updates=True, where=None, shard=None):
+        """Run *fn* on each test case in a pool of worker processes
+        
+        :param fn:
+            Callable taking a test case :class:`dict`; it must be picklable
+            (e.g. a module-level function or a :func:`functools.partial` of
+            one)
+        :keyword workers:
+            *optional* Number of worker processes; defaults to the number of
+            processors
+        :keyword do_compact_updates:
+            As for :meth:`case_runners`
+        :returns:
+            A :class:`list` of :class:`CaseOutcome`, one per case in the order
+            of :meth:`cases`
+        :raises concurrent.futures.process.BrokenProcessPool:
+            if a worker process dies; compact files are then not updated
+        
+        Each case is logged (as by the runners from :meth:`case_runners`) and
+        passed to *fn* in a worker process; the return value or exception of
+        the call is brought back to this process.  Cases are read and
+        augmented in this process (see :attr:`max_workers`) while earlier
+        cases run, with a bounded number of cases in flight.
+        
+        With *do_compact_updates*, the outcomes are tallied here once all
+        cases have finished: compact augmentation files are updated (once)
+        only if every case passed, and not at all -- not even by later runs
+        through this object -- if any case failed, just as with
+        :meth:`update_compact_augmentation_on_success`.  *where* and *shard*
+        select the cases to run, as for :meth:`cases`.
+        """
+        pickle.dumps(fn) # Fail before reading any cases if fn cannot be sent
+        shard_filter, test_cases = self._selected_cases(where, shard)
+        outcomes = []
+        pending = deque()
+        
+        def collect_outcome():
+            test_case, future = pending.popleft()
+            exception = future.exception()
+            outcomes.append(CaseOutcome(
+                test_case,
+                None if exception is not None else future.result(),
+                exception,
+            ))
+        
+        CFUpdate = self._UpdateState
+        workers = workers or os.cpu_count() or 1
+        executor = ProcessPoolExecutor(max_workers=workers)
+        try:
+            for test_case in test_cases:
+                pending.append((test_case, executor.submit(_run_case_in_worker, fn, test_case)))
+                if len(pending) >= 2 * workers:
+                    collect_outcome()
+            while pending:
+                collect_outcome()
+        except:
+            # e.g. BrokenProcessPool: not every case was run
+            if do_compact_updates:
+                self._compact_files_update = CFUpdate.aborted
+            raise
+        finally:
+            for _, future in pending:
+                future.cancel()
+            executor.shutdown()
+        
+        if do_compact_updates and outcomes:
+            if not all(outcome.passed for outcome in outcomes):
+                self._compact_files_update = CFUpdate.aborted
+            elif self._compact_files_update is not CFUpdate.aborted:
+                self._compact_files_update = CFUpdate.requested
+        self._finish_run(shard_filter, any_cases=bool(outcomes))
+        return outcomes
+    
+    async def acases(self, *, where=None, shard=None, executor=None):
+        """Asynchronously generates :class:`dict`\ s of test case data
+        
+        :keyword executor:
+            *optional* :class:`concurrent.futures.Executor` in which to read
+            and augment the cases; defaults to the event loop's default
+            executor
+        
+        This asynchronous generator produces the same cases as :meth:`cases`
+        (see there for *where* and *shard*), but the reading and augmentation
+        of test case data -- and any compact file update at the end of the
+        cases -- is done in *executor*, keeping the event loop free.  The
+        next case is read while the consumer handles the current one.
+        """
+        test_cases = _iterate_in_executor(self.cases(where=where, shard=shard), executor)
+        try:
+            async for test_case in test_cases:
+                yield test_case
+        finally:
+            await test_cases.aclose()
+    
+    async def arun_all(self, coro_fn, *, concurrency=10, do_compact_updates=True, where=None, shard=None, executor=None):
+        """Run coroutine function *coro_fn* on each test case concurrently
+        
+        :param coro_fn:
+            Coroutine function taking a test case :class:`dict`
+        :keyword concurrency:
+            Maximum number of *coro_fn* calls running at once
+        :keyword do_compact_updates:
+            As for :meth:`case_runners`
+        :keyword executor:
+            As for :meth:`acases`
+        :returns:
+            A :class:`list` of :class:`CaseOutcome`, one per case in the order
+            of :meth:`cases`
+        
+        Cases are read and augmented as by :meth:`acases` and each is logged
+        (as by the runners from :meth:`case_runners`) before being awaited
+        under a semaphore of *concurrency*; reading stops while all slots
+        are taken.  An exception from *coro_fn* fails only its case.
+        
+        With *do_compact_updates*, compact augmentation files are updated
+        (once, in *executor*) after all cases have finished, only if every
+        case passed, exactly as for :meth:`run_all`.  *where* and *shard*
+        select the cases to run, as for :meth:`cases`.  If this coroutine is
+        cancelled, the running cases are cancelled and compact files are not
+        updated.
+        """
+        loop = asyncio.get_running_loop()
+        CFUpdate = self._UpdateState
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def run_case(test_case):
+            try:
+                _log_case_tested(test_case)
+                return CaseOutcome(test_case, await coro_fn(test_case), None)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                return CaseOutcome(test_case, None, e)
+            finally:
+                semaphore.release()
+        
+        shard_filter, test_cases = self._selected_cases(where, shard)
+        test_cases = _iterate_in_executor(test_cases, executor)
+        tasks = []
+        try:
+            async for test_case in test_cases:
+                await semaphore.acquire()
+                tasks.append(asyncio.ensure_future(run_case(test_case)))
+            outcomes = await asyncio.gather(*tasks)
+        except:
+            for task in tasks:
+                task.cancel()
+            if do_compact_updates:
+                self._compact_files_update = CFUpdate.aborted
+            raise
+        finally:
+            await test_cases.aclose()
+        
+        if do_compact_updates and outcomes:
+            if not all(outcome.passed for outcome in outcomes):
+                self._compact_files_update = CFUpdate.aborted
+            elif self._compact_files_update is not CFUpdate.aborted:
+                self._compact_files_update = CFUpdate.requested
+        await loop.run_in_executor(executor, functools.partial(
+            self._finish_run,
+            shard_filter,
+            any_cases=bool(outcomes),
+        ))
+        return outcomes
     
     def update_compact_files(self, ):
         """Calls the :class:`CaseAugmenter` to apply compact data file updates
@@ -209,26 +661,198 @@ class InterfaceCaseProvider:
             for ext_file in ext_files:
                 ext_file_ref = os.path.relpath(ext_file, os.path.join(self.spec_dir, self.group_name))
                 print("---\n# From {}\n".format(ext_file_ref), file=fixed_version_specs)
-                with open(ext_file) as ext_specs:
+                with _open_data_file(ext_file, 'interface') as ext_specs:
                     shutil.copyfileobj(ext_specs, fixed_version_specs)
         
         for ext_file in ext_files:
             os.remove(ext_file)
     
+    def _record_shard_outcome(self, shard_filter, *, vacuous=False):
+        CFUpdate = self._UpdateState
+        if self._compact_files_update is CFUpdate.not_requested and not vacuous:
+            # Nothing was run; the outcome of the shard is unknown
+            return
+        
+        results_dir = self.shard_results_dir
+        if results_dir is None:
+            results_dir = os.path.join(self._case_augmenter.augmentation_data_dir, '.shard-results')
+        shard_results = ShardResults(results_dir, shard_filter.count, run_id=self.shard_run_id)
+        if shard_results.record(
+            shard_filter.index,
+            passed=self._compact_files_update is not CFUpdate.aborted,
+        ):
+            self.update_compact_files()
+    
     def _augmented_case(self, x):
         """This method is defined to be overwritten on the instance level when augmented data is used"""
         return x
     
-    def _cases_from_file(self, filepath):
-        with open(filepath) as file:
-            for test_case in (
-                tc
-                for case_set in yaml.load_all(file)
-                for tc in case_set
-            ):
-                if self.use_body_type_magic:
-                    _parse_json_bodies(test_case)
-                yield self._augmented_case(test_case)
+    def _use_worker_pool(self, case_files, case_filter=None):
+        if (self.max_workers or 0) <= 1 or len(case_files) < self.min_files_for_worker_pool:
+            return False
+        try:
+            pickle.dumps((self, case_filter))
+        except (pickle.PicklingError, AttributeError, TypeError) as e:
+            logger.info("Parsing test case files serially; cannot send {!r} to worker processes: {}".format(self, e))
+            return False
+        return True
+    
+    def _cases_from_files_in_worker_pool(self, case_files, case_filter=None):
+        case_files = iter(case_files)
+        pending = deque()
+        executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            initializer=_init_case_file_worker,
+            initargs=(self,),
+        )
+        try:
+            # Keep a bounded number of files in flight so that the parsed
+            # cases do not pile up in memory ahead of the consumer
+            for case_file in itertools.islice(case_files, 2 * self.max_workers):
+                pending.append(executor.submit(_cases_from_file_in_worker, case_file, case_filter))
+            while pending:
+                file_cases = pending.popleft().result()
+                for case_file in itertools.islice(case_files, 1):
+                    pending.append(executor.submit(_cases_from_file_in_worker, case_file, case_filter))
+                yield from file_cases
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown()
+    
+    def _augmented_cases(self, test_cases, timings=None):
+        augmenter = self._case_augmenter
+        if timings is not None:
+            if augmenter is None:
+                return ((test_case, (0.0, 0.0)) for test_case in test_cases)
+            return timings.timed_augmentation(self._augmented_case, test_cases)
+        if getattr(augmenter, 'bulk_augmentation', False):
+            return augmenter.augmented_test_cases(test_cases)
+        return map(self._augmented_case, test_cases)
+    
+    def _cases_from_file(self, filepath, case_filter=None, timings=None):
+        if _tracer.enabled:
+            return _tracer.spanned_iteration(
+                'cases from ' + os.path.basename(filepath),
+                'parse',
+                self._file_cases(filepath, case_filter, timings),
+                file=filepath,
+            )
+        return self._file_cases(filepath, case_filter, timings)
+    
+    def _file_cases(self, filepath, case_filter=None, timings=None):
+        snapshot_cache = self.snapshot_cache if case_filter is None and timings is None else None
+        if snapshot_cache is not None:
+            fingerprint = self._snapshot_fingerprint(filepath)
+            if fingerprint is not None:
+                yield from snapshot_cache.cases(
+                    fingerprint,
+                    functools.partial(self._parsed_cases_from_file, filepath),
+                    source=os.path.relpath(filepath, self.spec_dir).replace(os.sep, '/'),
+                )
+                return
+        yield from self._parsed_cases_from_file(filepath, case_filter, timings)
+    
+    def _snapshot_fingerprint(self, filepath):
+        augmentation = None
+        if self._case_augmenter is not None:
+            data_fingerprint = getattr(self._case_augmenter, 'data_fingerprint', None)
+            if data_fingerprint is None:
+                return None
+            augmentation = data_fingerprint()
+        return _snapshot_fingerprint(
+            _file_fingerprint(filepath, self.spec_dir),
+            self.use_body_type_magic,
+            augmentation,
+        )
+    
+    def _parsed_cases_from_file(self, filepath, case_filter=None, timings=None):
+        with _open_data_file(filepath, 'interface') as file:
+            if case_filter is None:
+                test_cases = (
+                    tc
+                    for case_set in _yaml_load_all(file, safe_loading=False)
+                    for tc in case_set
+                )
+            else:
+                test_cases = _filtered_cases(file, case_filter, safe_loading=False)
+            yield from self._augmented_cases(
+                (self._with_body_types_parsed(tc) for tc in test_cases),
+                timings,
+            )
+    
+    def _with_body_types_parsed(self, test_case):
+        if self.use_body_type_magic:
+            _parse_json_bodies(test_case)
+        return test_case
+
+_worker_case_provider = None
+
+def _init_case_file_worker(case_provider):
+    global _worker_case_provider
+    _worker_case_provider = case_provider
+
+def _cases_from_file_in_worker(filepath, case_filter=None):
+    return list(_worker_case_provider._cases_from_file(filepath, case_filter))
+
+class CaseOutcome(namedtuple('_CaseOutcome', 'case result exception')):
+    """Outcome of running a test case with :meth:`InterfaceCaseProvider.run_all` or :meth:`~InterfaceCaseProvider.arun_all`
+    
+    .. attribute:: case
+    
+        The test case :class:`dict`
+    
+    .. attribute:: result
+    
+        The value returned by the runner, or ``None`` if it raised
+    
+    .. attribute:: exception
+    
+        The exception raised by the runner (or by the worker process running
+        it), or ``None`` if it returned
+    """
+    @property
+    def passed(self):
+        return self.exception is None
+
+def _augmenter_span_name(augment_case):
+    return 'augment ' + type(augment_case).__module__.rpartition('.')[2]
+
+def _log_case_tested(test_case):
+    logger.info("{}\n{}".format(
+        " CASE TESTED ".center(40, '*'),
+        _yaml_dump([test_case]),
+    ))
+
+def _run_case_in_worker(fn, test_case):
+    _log_case_tested(test_case)
+    return fn(test_case)
+
+async def _iterate_in_executor(iterator, executor=None):
+    """Asynchronously generate the items of a blocking *iterator*
+    
+    The iterator is advanced in *executor* (the event loop's default
+    executor if ``None``), one item ahead of the consumer.
+    """
+    loop = asyncio.get_running_loop()
+    fetch = functools.partial(next, iterator, _END_OF_ITERATION)
+    pending = loop.run_in_executor(executor, fetch)
+    try:
+        while True:
+            item = await pending
+            if item is _END_OF_ITERATION:
+                return
+            pending = loop.run_in_executor(executor, fetch)
+            yield item
+    finally:
+        if not pending.done():
+            # The iterator cannot be closed while it is being advanced
+            await asyncio.wait([pending])
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await loop.run_in_executor(executor, close)
+
+_END_OF_ITERATION = object()
 
 def extension_files(spec_dir, group_name):
     """Iterator of file paths for extensions of a test case group
@@ -240,6 +864,14 @@ def extension_files(spec_dir, group_name):
 
 def data_files(dir_path):
     """Generate data file paths from the given directory"""
+    if _tracer.enabled:
+        with _tracer.span('data_files', 'scan', dir=dir_path):
+            file_paths = list(_data_files(dir_path))
+        yield from file_paths
+        return
+    yield from _data_files(dir_path)
+
+def _data_files(dir_path):
     try:
         dir_listing = os.listdir(dir_path)
     except FileNotFoundError:
@@ -293,6 +925,30 @@ class CaseAugmenter:
     .update.yml is used (with the goal of updating the .yml file with the
     new augmentation values).
     
+    To avoid parsing every compact file each time an instance is
+    constructed, the case keys and offsets found in each compact file are
+    kept in a sidecar index file (the compact file path with '.idx'
+    appended), which is rebuilt whenever the compact file changes.  These
+    index files are derived data and, like update files, should typically be
+    ignored by the version control system.  Set
+    :attr:`use_compact_file_indexes` to ``False`` to disable them.
+    
+    Alternatively, with :attr:`compact_storage` set to ``'sqlite'``, the
+    compact data is kept in an SQLite database in the augmentation data
+    directory (see :mod:`.augmentation.sqlite_store`) and YAML compact files
+    there are ignored.  Each database entry remembers the compact file it
+    would otherwise be in, so update files and conflict detection work as
+    they do for YAML compact files.  The functions
+    :func:`.sqlite_store.import_compact_files` and
+    :func:`.sqlite_store.export_compact_files` convert between the two.
+    
+    Construction normally reads (the indexes of) all augmentation data files,
+    raising :class:`.MultipleAugmentationEntriesError` for conflicting
+    entries.  With :attr:`lazy_indexing` set, construction does not touch the
+    augmentation data directory; it is indexed -- and conflicts raised -- on
+    first use of any method needing augmentation data, before any augmented
+    test case is returned.
+    
     Methods of this class depend on the class-level presence of
     :const:`CASE_PRIMARY_KEYS`, which is not provided in this class.  To use
     this class's functionality, derive from it and define this constant in
@@ -307,35 +963,254 @@ class CaseAugmenter:
     # execution from loaded YAML
     safe_loading = True
     
-    def __init__(self, augmentation_data_dir):
+    # Set this to False to always index compact files by parsing them rather
+    # than using (and maintaining) their sidecar index files
+    use_compact_file_indexes = True
+    
+    # Set this to True to have InterfaceCaseProvider augment test cases in
+    # batches of (at most) bulk_batch_size through augmented_test_cases
+    bulk_augmentation = False
+    bulk_batch_size = 1000
+    
+    # Set this to 'sqlite' to keep compact augmentation data in an SQLite
+    # database (named COMPACT_DB_FILE_NAME, in the augmentation data
+    # directory) instead of in YAML compact files
+    compact_storage = 'yaml'
+    COMPACT_DB_FILE_NAME = "compact.sqlite3"
+    COMPACT_STORAGE_TYPES = frozenset(('yaml', 'sqlite'))
+    
+    # Set this to False to have update_compact_files re-emit every entry of
+    # an updated compact file instead of splicing the updated entries into
+    # the file's existing text
+    splice_compact_updates = True
+    
+    # Set this to True to defer reading the augmentation data directory until
+    # augmentation data is first needed
+    lazy_indexing = False
+    
+    def __init__(self, augmentation_data_dir, *, compact_storage=None, lazy_indexing=None):
         """Constructing an instance
         
         :param augmentation_data_dir:
             path to directory holding the augmentation data
+        :keyword compact_storage:
+            *optional* override of :attr:`compact_storage`, either
+            ``'yaml'`` or ``'sqlite'``
+        :keyword lazy_indexing:
+            *optional* override of :attr:`lazy_indexing`
         """
         super().__init__()
-        # Initialize info on extension data location
-        self._case_augmenters = {}
-        self._updates = {} # compact_file_path -> dict of update readers
-        working_files = []
+        if compact_storage is not None and compact_storage != self.compact_storage:
+            self.compact_storage = compact_storage
+        if self.compact_storage not in self.COMPACT_STORAGE_TYPES:
+            raise ValueError("{!r} is not a supported compact storage type".format(self.compact_storage))
+        if lazy_indexing is not None and lazy_indexing is not self.lazy_indexing:
+            self.lazy_indexing = lazy_indexing
         self._augmentation_data_dir = augmentation_data_dir
-        for file_path in data_files(augmentation_data_dir):
-            if file_path.endswith(self.UPDATE_FILE_EXT):
-                working_files.append(file_path)
-            else:
-                self._load_compact_refs(file_path)
-        self._index_working_files(working_files)
+        self._indexing_lock = threading.Lock()
+        self._indexed = False
+        if not self.lazy_indexing:
+            self._ensure_indexed()
+    
+    def __getstate__(self, ):
+        state = dict(self.__dict__)
+        del state['_indexing_lock']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._indexing_lock = threading.Lock()
+    
+    def _ensure_indexed(self, ):
+        """Index the augmentation data directory, if not already done
+        
+        Any :class:`.MultipleAugmentationEntriesError` is raised from here, so
+        every method using the index calls this first.  When indexing fails,
+        the next call tries again.
+        """
+        if self._indexed:
+            return
+        with self._indexing_lock:
+            if self._indexed:
+                return
+            self._index_data_files()
+            self._indexed = True
+    
+    def _index_data_files(self, ):
+        # Initialize info on extension data location
+        self._source_stats = {} # source path -> (size, mtime_ns) when indexed
+        self._compact_refs = {} # compact file (or database) path -> dict of compact readers
+        self._update_refs = {} # update file path -> dict of update readers
+        self._compact_entry_offsets = {} # compact_file_path -> sorted entry offsets
+        if self.compact_storage == 'sqlite':
+            for file_path in data_files(self.augmentation_data_dir):
+                if not file_path.endswith(self.UPDATE_FILE_EXT):
+                    logger.warning("Ignoring {} because compact data is stored in {}".format(
+                        file_path,
+                        self.compact_db_path,
+                    ))
+        for source_path, source_stat in self._data_sources().items():
+            self._load_source(source_path, source_stat)
+        self._merge_refs()
+    
+    def refresh(self, ):
+        """Re-index the augmentation data files that have changed
+        
+        :returns:
+            A :class:`.RefreshReport` of the case keys whose augmentation
+            appeared, disappeared or (possibly) changed
+        :raises MultipleAugmentationEntriesError:
+            if the changed files conflict; the previous index is kept
+        
+        The augmentation data directory is listed and each data file
+        stat-ed; only files that are new or whose size or modification time
+        differ from when they were last indexed are read again.  Conflicts
+        are checked among the in-memory entries of all files.  Augmentation
+        of a case key is reported as changed when it comes from a different
+        entry or from a file that was read again.
+        """
+        with self._indexing_lock:
+            if not self._indexed:
+                self._index_data_files()
+                self._indexed = True
+                return RefreshReport(
+                    appeared=frozenset(self._case_augmenters),
+                    files=frozenset(self._source_stats),
+                )
+            
+            sources = self._data_sources()
+            changed_files = frozenset(
+                source_path
+                for source_path, source_stat in sources.items()
+                if self._source_stats.get(source_path) != source_stat
+            )
+            removed_files = frozenset(self._source_stats) - frozenset(sources)
+            if not (changed_files or removed_files):
+                return RefreshReport()
+            
+            prior_state = [
+                dict(getattr(self, attr))
+                for attr in self._REFRESHED_STATE
+            ]
+            prior_augmenters = self._case_augmenters
+            try:
+                for source_path in removed_files:
+                    self._drop_source(source_path)
+                for source_path in changed_files:
+                    self._drop_source(source_path)
+                    self._load_source(source_path, sources[source_path])
+                self._merge_refs()
+            except:
+                for attr, value in zip(self._REFRESHED_STATE, prior_state):
+                    setattr(self, attr, value)
+                raise
+            
+            return RefreshReport.comparing(
+                prior_augmenters,
+                self._case_augmenters,
+                files=changed_files | removed_files,
+            )
+    
+    _REFRESHED_STATE = ('_source_stats', '_compact_refs', '_update_refs', '_compact_entry_offsets')
+    
+    def _data_sources(self, ):
+        """Get ``(size, mtime_ns)`` of each augmentation data source, by path"""
+        source_paths = [
+            file_path
+            for file_path in data_files(self.augmentation_data_dir)
+            if self.compact_storage == 'yaml' or file_path.endswith(self.UPDATE_FILE_EXT)
+        ]
+        if self.compact_storage == 'sqlite':
+            source_paths.append(self.compact_db_path)
+        
+        sources = {}
+        for source_path in source_paths:
+            try:
+                source_stat = os.stat(source_path)
+            except FileNotFoundError:
+                continue
+            sources[source_path] = (source_stat.st_size, source_stat.st_mtime_ns)
+        return sources
+    
+    def _load_source(self, source_path, source_stat):
+        if source_path.endswith(self.UPDATE_FILE_EXT):
+            self._update_refs[source_path] = update_file.index(
+                [source_path],
+                self.CASE_PRIMARY_KEYS,
+                safe_loading=self.safe_loading,
+            )
+        elif self.compact_storage == 'sqlite':
+            self._compact_refs[source_path] = self._compact_store_refs()
+        else:
+            self._compact_refs[source_path] = self._compact_file_refs(source_path)
+        self._source_stats[source_path] = source_stat
+    
+    def _drop_source(self, source_path):
+        for attr in self._REFRESHED_STATE:
+            getattr(self, attr).pop(source_path, None)
     
     @property
     def augmentation_data_dir(self):
         return self._augmentation_data_dir
     
-    def _load_compact_refs(self, file_path):
-        for case_key, start_byte in case_keys_in_compact_file(file_path):
-            if case_key in self._case_augmenters:
-                self._excessive_augmentation_data(case_key, self._case_augmenters[case_key].file_path, file_path)
-            self._case_augmenters[case_key] = CompactFileAugmenter(file_path, start_byte, case_key, safe_loading=self.safe_loading)
-            self._case_augmenters[case_key].safe_loading = self.safe_loading
+    def data_fingerprint(self, ):
+        """Get a JSON-serializable description of the augmentation data
+        
+        The result describes the settings of this object and the content
+        and relative path of each augmentation data file, so it changes
+        whenever augmentation would give different results.  It is used to
+        fingerprint cached test cases (see :mod:`.snapshot_cache`).
+        """
+        file_paths = sorted(data_files(self.augmentation_data_dir))
+        if self.compact_storage == 'sqlite':
+            file_paths.append(self.compact_db_path)
+        return {
+            'class': "{0.__module__}.{0.__qualname__}".format(type(self)),
+            'case primary keys': sorted(self.CASE_PRIMARY_KEYS),
+            'safe loading': self.safe_loading,
+            'compact storage': self.compact_storage,
+            'files': [
+                _file_fingerprint(file_path, self.augmentation_data_dir)
+                for file_path in file_paths
+            ],
+        }
+    
+    @property
+    def compact_db_path(self):
+        """Path to the SQLite database used when :attr:`compact_storage` is ``'sqlite'``"""
+        return os.path.join(self.augmentation_data_dir, self.COMPACT_DB_FILE_NAME)
+    
+    def _compact_store_refs(self, ):
+        refs = {}
+        store = sqlite_store.Store(self.compact_db_path)
+        for case_key, source in store.entries():
+            file_path = os.path.join(self.augmentation_data_dir, source)
+            if case_key in refs:
+                self._excessive_augmentation_data(case_key, refs[case_key].file_path, file_path)
+            refs[case_key] = StoreAugmenter(store, file_path, case_key, safe_loading=self.safe_loading)
+        return refs
+    
+    def _compact_file_refs(self, file_path):
+        if self.use_compact_file_indexes:
+            compact_case_keys = indexed_case_keys_in_compact_file(file_path)
+        else:
+            compact_case_keys = case_keys_in_compact_file(file_path)
+        refs = {}
+        for case_key, start_byte in compact_case_keys:
+            if case_key in refs:
+                self._excessive_augmentation_data(case_key, file_path, file_path)
+            refs[case_key] = CompactFileAugmenter(file_path, start_byte, case_key, safe_loading=self.safe_loading)
+            refs[case_key].safe_loading = self.safe_loading
+        self._compact_entry_offsets[file_path] = sorted(
+            start_byte for _, start_byte in compact_case_keys
+            if start_byte is not None
+        )
+        return refs
+    
+    def _compact_entry_span(self, augmenter):
+        offsets = self._compact_entry_offsets[augmenter.file_path]
+        i = bisect.bisect_right(offsets, augmenter.offset)
+        return (augmenter.offset, offsets[i] if i < len(offsets) else None)
     
     def _excessive_augmentation_data(self, case_key, file1, file2):
         if file1 == file2:
@@ -351,31 +1226,46 @@ class CaseAugmenter:
             )
         raise MultipleAugmentationEntriesError(error_msg)
     
-    def _index_working_files(self, working_files):
-        for case_key, augmenter in update_file.index(working_files, self.CASE_PRIMARY_KEYS, safe_loading=self.safe_loading).items():
-            existing_augmenter = self._case_augmenters.get(case_key)
-            if isinstance(existing_augmenter, CompactFileAugmenter):
-                if augmenter.deposit_file_path != existing_augmenter.file_path:
+    def _merge_refs(self, ):
+        """Combine the entries of all sources, checking for conflicts"""
+        case_augmenters = {}
+        for source_path in sorted(self._compact_refs):
+            for case_key, augmenter in self._compact_refs[source_path].items():
+                if case_key in case_augmenters:
+                    self._excessive_augmentation_data(case_key, case_augmenters[case_key].file_path, augmenter.file_path)
+                case_augmenters[case_key] = augmenter
+        
+        updates = {}
+        update_augmenters = {}
+        for source_path in sorted(self._update_refs):
+            for case_key, augmenter in self._update_refs[source_path].items():
+                if case_key in update_augmenters:
                     raise MultipleAugmentationEntriesError(
-                        "case {} conflicts with case \"{}\" in {}; if present, this case must be in {}".format(
+                        "case {} conflicts with case {}".format(
                             augmenter.case_reference,
-                            case_key,
-                            existing_augmenter.file_path,
-                            os.path.basename(existing_augmenter.file_path).replace(
-                                YAML_EXT,
-                                self.UPDATE_FILE_EXT
-                            ),
+                            update_augmenters[case_key].case_reference,
                         )
                     )
-            elif existing_augmenter is not None:
-                raise MultipleAugmentationEntriesError(
-                    "case {} conflicts with case {}".format(
-                        augmenter.case_reference,
-                        existing_augmenter.case_reference,
-                    )
-                )
-            self._updates.setdefault(augmenter.deposit_file_path, {})[case_key] = augmenter
-            self._case_augmenters[case_key] = augmenter
+                existing_augmenter = case_augmenters.get(case_key)
+                if existing_augmenter is not None:
+                    if augmenter.deposit_file_path != existing_augmenter.file_path:
+                        raise MultipleAugmentationEntriesError(
+                            "case {} conflicts with case \"{}\" in {}; if present, this case must be in {}".format(
+                                augmenter.case_reference,
+                                case_key,
+                                existing_augmenter.file_path,
+                                os.path.basename(existing_augmenter.file_path).replace(
+                                    YAML_EXT,
+                                    self.UPDATE_FILE_EXT
+                                ),
+                            )
+                        )
+                update_augmenters[case_key] = augmenter
+                updates.setdefault(augmenter.deposit_file_path, {})[case_key] = augmenter
+                case_augmenters[case_key] = augmenter
+        
+        self._case_augmenters = case_augmenters
+        self._updates = updates
     
     @classmethod
     def key_of_case(cls, test_case):
@@ -394,15 +1284,74 @@ class CaseAugmenter:
         :returns: Test case with additional key/value pairs
         :rtype: dict
         """
-        case_key = self.key_of_case(test_case)
+        return self._augmented_test_case(test_case, self.key_of_case(test_case))
+    
+    def _augmented_test_case(self, test_case, case_key):
+        self._ensure_indexed()
         augment_case = self._case_augmenters.get(case_key)
+        if _stats.enabled:
+            _stats.count_augmentation_lookup(augment_case)
         if not augment_case:
             return test_case
         
         aug_test_case = dict(test_case)
-        augment_case(aug_test_case)
+        if _tracer.enabled:
+            with _tracer.sampled_span(_augmenter_span_name(augment_case), 'augment'):
+                augment_case(aug_test_case)
+        else:
+            augment_case(aug_test_case)
         return aug_test_case
     
+    def augmented_test_cases(self, test_cases):
+        """Generate augmented test cases from an iterable of test cases
+        
+        :param test_cases: An iterable of test case :class:`dict`\ s
+        :returns: An iterable of the augmented test cases, in the same order
+        
+        Each result is the same as :meth:`augmented_test_case` would return,
+        but the test cases are taken in batches of up to
+        :attr:`bulk_batch_size`, and for each batch every compact file
+        holding augmentation data needed by the batch is read sequentially
+        once -- parsing only the needed entries, located by their indexed
+        offsets -- instead of being reopened and reparsed for each test case.
+        """
+        self._ensure_indexed()
+        test_cases = iter(test_cases)
+        while True:
+            batch = list(itertools.islice(test_cases, max(self.bulk_batch_size, 1)))
+            if not batch:
+                break
+            
+            case_keys = [self.key_of_case(test_case) for test_case in batch]
+            spans_by_compact_file = {}
+            for case_key in case_keys:
+                augment_case = self._case_augmenters.get(case_key)
+                if isinstance(augment_case, CompactFileAugmenter) and augment_case.offset is not None:
+                    spans_by_compact_file.setdefault(augment_case.file_path, {})[case_key] = (
+                        self._compact_entry_span(augment_case)
+                    )
+            
+            augmentations = {}
+            for file_path, case_spans in spans_by_compact_file.items():
+                with _tracer.span('read_entries', 'augment', file=file_path, entries=len(case_spans)):
+                    augmentations.update(read_compact_file_entries(
+                        file_path,
+                        case_spans,
+                        safe_loading=self.safe_loading,
+                    ))
+            
+            for test_case, case_key in zip(batch, case_keys):
+                augmentation = augmentations.get(case_key)
+                if augmentation is None:
+                    yield self._augmented_test_case(test_case, case_key)
+                else:
+                    if _stats.enabled:
+                        _stats.count_augmentation_lookup(self._case_augmenters[case_key], bulk=True)
+                    aug_test_case = dict(test_case)
+                    for k, v in augmentation.items():
+                        aug_test_case.setdefault(k, v)
+                    yield aug_test_case
+    
     def augmented_test_case_events(self, case_key, case_id_events):
         """Generate YAML events for a test case
         
@@ -415,7 +1364,10 @@ class CaseAugmenter:
         This is used internally when extending an updates file with the existing
         data from a case, given the ID of the case as YAML.
         """
+        self._ensure_indexed()
         case_augmenter = self._case_augmenters.get(case_key)
+        if _stats.enabled:
+            _stats.count_augmentation_lookup(case_augmenter)
         yield yaml.MappingStartEvent(None, None, True, flow_style=False)
         yield from case_id_events
         if case_augmenter is not None:
@@ -424,18 +1376,57 @@ class CaseAugmenter:
     
     def update_compact_files(self, ):
         """Update compact data files from update data files"""
+        with _tracer.span('update_compact_files', 'update'):
+            return self._update_compact_files()
+    
+    def _update_compact_files(self, ):
+        self._ensure_indexed()
+        if self.compact_storage == 'sqlite':
+            return self._update_compact_store()
+        
         for file_path, updates in self._updates.items():
+            if (
+                self.splice_compact_updates
+                and os.path.exists(file_path)
+                and splice_compact_file_updates(
+                    file_path,
+                    _FilteredDictView(
+                        updates,
+                        value_transform=self._full_yaml_mapping_events_from_update_augmentation
+                    ),
+                    self.CASE_PRIMARY_KEYS,
+                    use_index=self.use_compact_file_indexes,
+                )
+            ):
+                continue
+            
+            content = StringIO()
             if os.path.exists(file_path):
-                with open_temp_copy(file_path) as instream, open(file_path, 'w') as outstream:
+                with _open_data_file(file_path, 'compact') as instream:
                     updated_events = self._updated_compact_events(
-                        yaml.parse(instream),
+                        _yaml_parse(instream),
                         updates
                     )
                     
-                    yaml.emit(updated_events, outstream)
+                    _yaml_emit(updated_events, content)
             else:
-                with open(file_path, 'w') as outstream:
-                    yaml.emit(self._fresh_content_events(updates.items()), outstream)
+                _yaml_emit(self._fresh_content_events(updates.items()), content)
+            
+            with atomic_write(file_path) as outstream:
+                outstream.write(content.getvalue())
+            if self.use_compact_file_indexes:
+                write_compact_file_index(file_path)
+    
+    def _update_compact_store(self, ):
+        store = sqlite_store.Store(self.compact_db_path)
+        try:
+            for file_path, updates in self._updates.items():
+                store.put_entries(os.path.basename(file_path), [
+                    (case_key, sqlite_store.data_from_mapping_events(augmenter.case_data_events()))
+                    for case_key, augmenter in updates.items()
+                ])
+        finally:
+            store.close()
     
     def extend_updates(self, file_name_base):
         """Create an object for extending a particular update file
@@ -531,7 +1522,7 @@ class UpdateExtender:
         """Append the full test case with its current augmentation data to the target file
         
         :param stream:
-            A file-like object (which could be passed to :func:`yaml.parse`)
+            A file-like object (which could be passed to :func:`.yaml_tools.parse`)
         
         The *stream* contains YAML identifying the test case in question.  The
         identifying YAML from the test case _plus_ the augmentative key/value
@@ -549,7 +1540,7 @@ class UpdateExtender:
             stream = buffered_input
         
         id_list_reader = CaseIdListReader(self._case_augmenter.CASE_PRIMARY_KEYS, safe_loading=self.safe_loading)
-        for event in yaml.parse(stream):
+        for event in _yaml_parse(stream):
             test_case = id_list_reader.read(event)
             if test_case is None:
                 continue
@@ -560,7 +1551,7 @@ class UpdateExtender:
             )
             # Append augmentation case to self.file_name
             with open(self.file_name, 'a') as outstream:
-                yaml.emit(
+                _yaml_emit(
                     self._case_yaml_events(case_as_currently_augmented_events),
                     outstream,
                 )
@@ -0,0 +1,138 @@
+# Copyright 2018 PayTrace, Inc.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Direct DER encoding of JSON-ic values
+
+The functions in this module produce the same octets as
+:func:`.convert.asn1_der` for the JSON ASN.1 schema in :mod:`.types`, but
+write the DER bytes directly instead of building a :mod:`pyasn1` object tree
+first.  Values this encoder does not understand (e.g. non-string mapping keys
+or numeric types other than :class:`int` and :class:`float`) are handed to
+:func:`.convert.asn1_der`, which remains the reference implementation.
+"""
+
+from numbers import Number
+from pyasn1.type.base import Asn1Item
+from .convert import asn1_der as reference_der
+
+# Universal tags used by the JSON ASN.1 schema
+NULL_TAG = 0x05
+REAL_TAG = 0x09
+UTF8STRING_TAG = 0x0c
+SEQUENCE_TAG = 0x30
+SET_TAG = 0x31
+# KeyValuePair ::= [APPLICATION 1] IMPLICIT SEQUENCE {...}
+KEY_VALUE_PAIR_TAG = 0x61
+
+_NULL_OCTETS = bytes((NULL_TAG, 0))
+_PLUS_INFINITY = float('inf')
+_MINUS_INFINITY = float('-inf')
+
+class UnsupportedValue(Exception):
+    """Raised internally when a value must be encoded by the reference encoder"""
+
+def encode(value):
+    """DER-encode a JSON-ic *value* as a ``JSONValue``
+    
+    :param value: the value to encode
+    :returns: the DER encoding of *value*
+    :rtype: bytes
+    :raises ValueError: if *value* contains an object cycle
+    """
+    try:
+        return _Encoder().value(value)
+    except UnsupportedValue:
+        return reference_der(value)
+
+def tlv(tag, content):
+    """Build a DER tag-length-value triple with a single-octet *tag*"""
+    length = len(content)
+    if length < 0x80:
+        return bytes((tag, length)) + content
+    length_octets = length.to_bytes((length.bit_length() + 7) // 8, 'big')
+    return bytes((tag, 0x80 | len(length_octets))) + length_octets + content
+
+def real_content(value):
+    """Content octets of a REAL as encoded by :mod:`pyasn1`'s DER encoder
+    
+    :mod:`pyasn1` normalizes every :class:`int` and finite :class:`float` to
+    base 10, which DER then emits in ISO 6093 NR3 character form.
+    """
+    if isinstance(value, float):
+        if value == _PLUS_INFINITY:
+            return b'\x40'
+        if value == _MINUS_INFINITY:
+            return b'\x41'
+        # Mirrors pyasn1.type.univ.Real.prettyIn, including its use of
+        # floating point multiplication, so the mantissa is identical
+        e = 0
+        while int(value) != value:
+            value *= 10
+            e -= 1
+        m = int(value)
+    else:
+        m, e = int(value), 0
+    
+    if not m:
+        return b''
+    while m % 10 == 0:
+        m //= 10
+        e += 1
+    return b'\x03%dE%s%d' % (m, b'+' if e == 0 else b'', e)
+
+class _Encoder:
+    def __init__(self, ):
+        super().__init__()
+        self._visited_objs = set()
+    
+    def value(self, value):
+        # The order of these tests follows .convert.asn1 so that values
+        # belonging to several categories are encoded the same way
+        if id(value) in self._visited_objs:
+            raise ValueError("Cannot convert cyclical object graph")
+        
+        if isinstance(value, Asn1Item):
+            raise UnsupportedValue(value)
+        elif isinstance(value, str):
+            return tlv(UTF8STRING_TAG, value.encode('utf-8'))
+        elif isinstance(value, Number):
+            if not isinstance(value, (int, float)):
+                raise UnsupportedValue(value)
+            return tlv(REAL_TAG, real_content(value))
+        elif value is None:
+            return _NULL_OCTETS
+        elif callable(getattr(value, 'items', None)):
+            self._visited_objs.add(id(value))
+            return self.object(value.items())
+        elif isinstance(value, (list, tuple)):
+            if isinstance(value, list):
+                self._visited_objs.add(id(value))
+            return tlv(SEQUENCE_TAG, b''.join(self.value(item) for item in value))
+        raise UnsupportedValue(value)
+    
+    def object(self, items):
+        chunks = []
+        for k, v in items:
+            if not isinstance(k, str):
+                raise UnsupportedValue(k)
+            chunks.append(tlv(
+                KEY_VALUE_PAIR_TAG,
+                tlv(UTF8STRING_TAG, k.encode('utf-8')) + self.value(v)
+            ))
+        
+        # DER orders SET OF components by their zero-padded encodings
+        if len(chunks) > 1:
+            padded_len = max(map(len, chunks))
+            chunks.sort(key=lambda chunk: chunk.ljust(padded_len, b'\x00'))
+        return tlv(SET_TAG, b''.join(chunks))
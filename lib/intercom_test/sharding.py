@@ -0,0 +1,285 @@
+# Copyright 2018 PayTrace, Inc.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Splitting the test cases of an interface among independent runs
+
+A sharded run divides the test cases among *count* shards (e.g. pytest-xdist
+workers or CI nodes), each generating only the cases of its own *index* by
+passing ``shard=(index, count)`` to :meth:`.InterfaceCaseProvider.cases` or
+:meth:`.InterfaceCaseProvider.case_runners`.  Cases are assigned by their
+case key, so the assignment is stable as long as the key fields of the cases
+do not change.  A :class:`ShardFilter` (a case filter, see
+:mod:`.case_filter`) selects the cases of a shard from the YAML events of
+the test case files, so each shard decodes and augments only its own cases.
+
+Hashing gives each shard about the same number of cases, but not the same
+amount of work when the durations of cases vary widely.  With a
+:class:`TimingHistory` of case durations (e.g. recorded from a
+:class:`.timing.CaseTimings`), :func:`balanced_assignment` instead packs the
+cases into shards of about equal total duration, and a
+:class:`BalancedShardFilter` selects the cases so assigned to a shard (see
+:attr:`.InterfaceCaseProvider.shard_timing_history`).  Every shard must see
+the same history file and test case files to compute the same assignment.
+
+Compact augmentation files may only be updated from update files once the
+cases of all shards have passed.  Each shard records its outcome with
+:class:`ShardResults` in a directory shared by the shards; the shard
+completing a set in which every shard passed updates the compact files.
+The shards of a run must share a run identifier (see :const:`RUN_ID_ENV_VAR`
+and :attr:`.InterfaceCaseProvider.shard_run_id`) to tell their outcomes
+from those of other runs; without one, outcomes are not recorded and the
+compact files are not updated.
+"""
+
+from base64 import b64decode
+import heapq
+import json
+import logging
+import os
+import os.path
+import shutil
+import uuid
+from .case_index import case_key as _case_key, BODY_TYPE_FIELDS
+from .utils import atomic_write
+
+logger = logging.getLogger(__name__)
+
+# Environment variable identifying a sharded run to all of its shards
+RUN_ID_ENV_VAR = 'INTERCOM_TEST_SHARD_RUN_ID'
+
+PASSED = 'passed'
+FAILED = 'failed'
+
+def validated_shard(shard):
+    """Check and normalize a ``(index, count)`` shard specification
+    
+    :raises ValueError: if *shard* does not describe one of *count* shards
+    """
+    index, count = (int(n) for n in shard)
+    if count < 1 or not 0 <= index < count:
+        raise ValueError("{!r} is not a valid (index, count) shard".format(shard))
+    return index, count
+
+def shard_of(case_key, count):
+    """Get the index of the shard (of *count*) to which a case key belongs"""
+    return int.from_bytes(b64decode(case_key), 'big') % count
+
+class ShardFilter:
+    """Case filter accepting the cases belonging to one shard
+    
+    :param shard: ``(index, count)`` of the shard
+    :param key_fields: Names of the fields from which case keys are computed
+    :keyword body_type_magic:
+        Whether JSON bodies are decoded before computing case keys (see
+        :attr:`.InterfaceCaseProvider.use_body_type_magic`)
+    """
+    def __init__(self, shard, key_fields, *, body_type_magic=False):
+        super().__init__()
+        self.index, self.count = validated_shard(shard)
+        self.key_fields = frozenset(key_fields)
+        self.body_type_magic = body_type_magic
+        self.fields = self.key_fields
+        if body_type_magic:
+            self.fields = self.fields | frozenset(
+                type_field
+                for body_field, type_field in BODY_TYPE_FIELDS
+                if body_field in self.key_fields
+            )
+    
+    def __repr__(self, ):
+        return "{}({!r}, {!r})".format(type(self).__name__, (self.index, self.count), sorted(self.key_fields))
+    
+    def accepts(self, values):
+        case_key = _case_key(values, self.key_fields, body_type_magic=self.body_type_magic)
+        return shard_of(case_key, self.count) == self.index
+
+class BalancedShardFilter(ShardFilter):
+    """Case filter accepting the cases assigned to one shard
+    
+    :param shard: ``(index, count)`` of the shard
+    :param assignment:
+        :class:`dict` of shard index by case key, as from
+        :func:`balanced_assignment`; cases whose keys are not in it are
+        assigned by :func:`shard_of`
+    :param key_fields: As for :class:`ShardFilter`
+    :keyword body_type_magic: As for :class:`ShardFilter`
+    """
+    def __init__(self, shard, assignment, key_fields, *, body_type_magic=False):
+        super().__init__(shard, key_fields, body_type_magic=body_type_magic)
+        self.assignment = assignment
+    
+    def accepts(self, values):
+        case_key = _case_key(values, self.key_fields, body_type_magic=self.body_type_magic)
+        index = self.assignment.get(case_key)
+        if index is None:
+            index = shard_of(case_key, self.count)
+        return index == self.index
+
+def balanced_assignment(case_keys, count, durations):
+    """Assign case keys to shards so that shards take about equally long
+    
+    :param case_keys: Keys of the cases to assign
+    :param int count: Number of shards
+    :param durations: Mapping of case key to duration (e.g. in seconds)
+    :returns: :class:`dict` of shard index by case key
+    
+    Cases with a duration are taken longest first and each put in the shard
+    with the least total duration so far (the LPT rule).  Cases without a
+    duration are then split by count, each going to the shard with the
+    fewest of them (and, among those, the least total duration).  Ties are
+    broken by case key and shard index, making the assignment deterministic.
+    """
+    case_keys = sorted(set(case_keys))
+    assignment = {}
+    
+    shard_loads = [(0.0, index) for index in range(count)]
+    for case_duration, case_key in sorted(
+        ((durations[k], k) for k in case_keys if k in durations),
+        key=lambda item: (-item[0], item[1]),
+    ):
+        load, index = heapq.heappop(shard_loads)
+        assignment[case_key] = index
+        heapq.heappush(shard_loads, (load + case_duration, index))
+    
+    shard_counts = [(0, load, index) for load, index in shard_loads]
+    heapq.heapify(shard_counts)
+    for case_key in case_keys:
+        if case_key in assignment:
+            continue
+        cases, load, index = heapq.heappop(shard_counts)
+        assignment[case_key] = index
+        heapq.heappush(shard_counts, (cases + 1, load, index))
+    return assignment
+
+class TimingHistory:
+    """Durations of test cases, by case key, kept in a JSON file
+    
+    :param file_path: Path of the history file
+    
+    A missing or unreadable file gives an empty history.  Durations recorded
+    for a case replace its earlier duration; :meth:`save` writes the history
+    back to the file.
+    
+    .. attribute:: durations
+    
+        :class:`dict` of duration in seconds by case key
+    """
+    def __init__(self, file_path):
+        super().__init__()
+        self.file_path = file_path
+        self.durations = {}
+        try:
+            with open(file_path) as infile:
+                durations = json.load(infile)
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            logger.warning("Ignoring unreadable timing history {}: {}".format(file_path, e))
+            return
+        if isinstance(durations, dict):
+            self.durations.update(
+                (k, float(v)) for k, v in durations.items()
+                if isinstance(v, (int, float))
+            )
+    
+    def __len__(self, ):
+        return len(self.durations)
+    
+    def record(self, case_key, seconds):
+        self.durations[case_key] = seconds
+    
+    def record_timings(self, timings):
+        """Record the total wall time of each case in a :class:`.timing.CaseTimings`
+        
+        This is the time spent augmenting the case and running the test
+        function on it (:attr:`.timing.CaseTiming.total_wall`), by which
+        :meth:`.timing.CaseTimings.slowest` also ranks cases.  Reading and
+        parsing the test case files is not timed per case.
+        """
+        for timing in timings.records:
+            self.record(timing.case_key, timing.total_wall)
+    
+    def save(self, ):
+        with atomic_write(self.file_path) as outfile:
+            json.dump(self.durations, outfile, indent=0, sort_keys=True)
+            outfile.write("\n")
+
+class ShardResults:
+    """Outcomes of the shards of a sharded run, kept in a shared directory
+    
+    :param dir_path: Directory (shared by all shards) in which to keep outcomes
+    :param count: Number of shards in the run
+    :keyword run_id:
+        *optional* Identifier of the run, keeping its outcomes apart from
+        those of other runs; defaults to the value of the environment
+        variable named by :const:`RUN_ID_ENV_VAR`, if set
+    
+    Outcomes are kept in one file per shard until the outcomes of all shards
+    are known, at which point the shard recording the last outcome removes
+    them.  Without a run identifier, the outcomes left by an interrupted run
+    could not be told from those of the current run, so :meth:`record`
+    records nothing and never reports a completed run.
+    """
+    def __init__(self, dir_path, count, *, run_id=None):
+        super().__init__()
+        if run_id is None:
+            run_id = os.environ.get(RUN_ID_ENV_VAR) or None
+        self.count = count
+        self.run_id = run_id
+        self.run_dir = None if run_id is None else os.path.join(
+            dir_path,
+            "{}-{}".format(count, run_id),
+        )
+    
+    def record(self, index, passed):
+        """Record the outcome of a shard
+        
+        :returns:
+            ``True`` if this completes the outcomes of the run and every shard
+            passed, otherwise ``False``
+        
+        When several shards finish at once, exactly one of them collects the
+        completed outcomes.
+        """
+        if self.run_id is None:
+            logger.warning(
+                "Shard outcome not recorded and compact augmentation not updated: "
+                "sharded runs need a run identifier (set %s)",
+                RUN_ID_ENV_VAR,
+            )
+            return False
+        
+        os.makedirs(self.run_dir, exist_ok=True)
+        with atomic_write(os.path.join(self.run_dir, str(index))) as outfile:
+            print(PASSED if passed else FAILED, file=outfile)
+        
+        outcome_files = [os.path.join(self.run_dir, str(i)) for i in range(self.count)]
+        if not all(os.path.exists(f) for f in outcome_files):
+            return False
+        
+        # Renaming the directory claims the outcomes; only one shard can
+        # succeed at it, even from different hosts
+        claimed_dir = "{}.claimed-{}".format(self.run_dir, uuid.uuid4().hex)
+        try:
+            os.rename(self.run_dir, claimed_dir)
+        except OSError:
+            return False
+        try:
+            outcomes = []
+            for i in range(self.count):
+                with open(os.path.join(claimed_dir, str(i))) as infile:
+                    outcomes.append(infile.read().strip())
+        finally:
+            shutil.rmtree(claimed_dir, ignore_errors=True)
+        return all(outcome == PASSED for outcome in outcomes)
@@ -0,0 +1,297 @@
+# Copyright 2018 PayTrace, Inc.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Persistent cache of the test cases generated from test case files
+
+Parsing and augmenting the test cases of a large interface takes far longer
+than reading back the resulting :class:`dict`\ s.  A :class:`SnapshotCache`
+keeps, in a directory, the cases generated from each test case file -- after
+augmentation and JSON body parsing -- in a binary snapshot named for a
+*fingerprint* of everything the cases depend on: the content (SHA-256) and
+relative path of the test case file and of every augmentation data file, the
+relevant settings of the :class:`.InterfaceCaseProvider` and
+:class:`.CaseAugmenter`, and the version of this package.  Fingerprints do
+not depend on where the files are checked out or when they were modified,
+so a cache directory can be carried between CI runs.  A changed input
+changes the fingerprint, so stale snapshots are never read.  Storing a
+snapshot for a test case file removes the older snapshots of the same file,
+and the remaining snapshots are evicted, least recently used first, once
+they exceed :attr:`SnapshotCache.max_bytes`.
+
+Each snapshot starts with a header identifying the snapshot format, followed
+by the cases, each pickled separately.  Pickling may construct arbitrary
+objects when loading, so the cache directory must be no more writable than
+the test case files themselves.
+"""
+
+import glob
+import hashlib
+import io
+import json
+import logging
+import os
+import os.path
+import pickle
+from .utils import atomic_write
+from .version import __version__ as _package_version
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FILE_EXT = '.snapshot'
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_HEADER = b'intercom_test case snapshot %d\n' % SNAPSHOT_FORMAT
+PICKLE_PROTOCOL = pickle.HIGHEST_PROTOCOL
+
+class SnapshotCache:
+    """Directory of snapshots of generated test cases
+    
+    :param cache_dir: Directory in which to keep snapshots (created if needed)
+    :keyword max_bytes: *optional* override of :attr:`max_bytes`
+    """
+    
+    # Set this to the total size (in bytes) of the snapshots to keep in the
+    # cache directory; the least recently used are removed beyond this
+    max_bytes = 256 * 2**20
+    
+    def __init__(self, cache_dir, *, max_bytes=None):
+        super().__init__()
+        if max_bytes is not None and max_bytes != self.max_bytes:
+            self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+    
+    def snapshot_path(self, fingerprint, source=None):
+        """Path of the snapshot for *fingerprint*
+        
+        :param source:
+            *optional* Identifier (e.g. relative path) of the test case file
+            from which the cases come; snapshots of one *source* share a
+            file name prefix
+        """
+        if source is not None:
+            fingerprint = "{}-{}".format(_source_prefix(source), fingerprint)
+        return os.path.join(self.cache_dir, fingerprint + SNAPSHOT_FILE_EXT)
+    
+    def cases(self, fingerprint, build, *, source=None):
+        """Generate test cases from the snapshot for *fingerprint*
+        
+        :param fingerprint: Fingerprint (see :func:`fingerprint`) of the cases
+        :param build:
+            Callable returning an iterable of the cases, called if there is no
+            usable snapshot for *fingerprint*
+        :keyword source: See :meth:`snapshot_path`
+        
+        When *build* is called, the cases it generates are recorded as they
+        are generated and the snapshot is written once the last has been
+        generated (so not if iteration stops early).
+        """
+        test_cases = self.load(fingerprint, source)
+        if test_cases is not None:
+            yield from test_cases
+            return
+        
+        snapshot = io.BytesIO()
+        snapshot.write(SNAPSHOT_HEADER)
+        pickler = pickle.Pickler(snapshot, PICKLE_PROTOCOL)
+        for test_case in build():
+            if pickler is not None:
+                try:
+                    pickler.dump(test_case)
+                except (pickle.PicklingError, TypeError, AttributeError) as e:
+                    logger.info("Not caching test cases {}: {}".format(fingerprint, e))
+                    pickler = None
+            yield test_case
+        if pickler is not None:
+            self.store(fingerprint, snapshot.getvalue(), source=source)
+    
+    def load(self, fingerprint, source=None):
+        """Get a :class:`list` of the cases in the snapshot for *fingerprint*
+        
+        Returns ``None`` if there is no readable snapshot for *fingerprint*
+        (and *source*, see :meth:`snapshot_path`).  Loading a snapshot marks
+        it as recently used.
+        """
+        snapshot_path = self.snapshot_path(fingerprint, source)
+        try:
+            with open(snapshot_path, 'rb') as instream:
+                content = instream.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.debug("Unable to read snapshot %s: %s", snapshot_path, e)
+            return None
+        if not content.startswith(SNAPSHOT_HEADER):
+            return None
+        
+        snapshot = io.BytesIO(content)
+        snapshot.seek(len(SNAPSHOT_HEADER))
+        unpickler = pickle.Unpickler(snapshot)
+        test_cases = []
+        try:
+            while snapshot.tell() < len(content):
+                test_cases.append(unpickler.load())
+        except Exception as e:
+            logger.debug("Ignoring unreadable snapshot %s: %s", snapshot_path, e)
+            return None
+        
+        try:
+            os.utime(snapshot_path)
+        except OSError:
+            pass
+        return test_cases
+    
+    def store(self, fingerprint, content, *, source=None):
+        """Write a snapshot and evict snapshots beyond :attr:`max_bytes`
+        
+        :param fingerprint: Fingerprint of the cases in the snapshot
+        :param bytes content: Complete content of the snapshot file
+        :keyword source:
+            *optional* Source of the cases (see :meth:`snapshot_path`); other
+            snapshots of the same source are removed
+        
+        Failure to write the snapshot is not an error.
+        """
+        snapshot_path = self.snapshot_path(fingerprint, source)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with atomic_write(snapshot_path, binary=True) as outstream:
+                outstream.write(content)
+        except OSError as e:
+            logger.debug("Unable to write snapshot %s: %s", snapshot_path, e)
+            return
+        if source is not None:
+            self.prune(source, keep=snapshot_path)
+        self.evict(keep=snapshot_path)
+    
+    def prune(self, source, *, keep=None):
+        """Remove the snapshots of *source* (see :meth:`snapshot_path`)
+        
+        :keyword keep: *optional* path of a snapshot not to remove
+        :returns: The number of snapshots removed
+        """
+        removed = 0
+        for snapshot_path in glob.glob(os.path.join(
+            glob.escape(self.cache_dir),
+            "{}-*{}".format(_source_prefix(source), SNAPSHOT_FILE_EXT),
+        )):
+            if snapshot_path == keep:
+                continue
+            try:
+                os.remove(snapshot_path)
+            except FileNotFoundError:
+                continue
+            removed += 1
+        return removed
+    
+    def snapshots(self, ):
+        """Get a :class:`list` of ``(path, size, mtime)`` for all snapshots
+        
+        The list is ordered from least to most recently used.
+        """
+        result = []
+        for snapshot_path in glob.glob(os.path.join(glob.escape(self.cache_dir), '*' + SNAPSHOT_FILE_EXT)):
+            try:
+                file_stat = os.stat(snapshot_path)
+            except FileNotFoundError:
+                continue
+            result.append((snapshot_path, file_stat.st_size, file_stat.st_mtime_ns))
+        result.sort(key=lambda entry: entry[2])
+        return result
+    
+    def evict(self, *, keep=None):
+        """Remove least recently used snapshots beyond :attr:`max_bytes`
+        
+        :keyword keep: *optional* path of a snapshot not to remove
+        :returns: The number of snapshots removed
+        """
+        snapshots = self.snapshots()
+        total = sum(size for path, size, mtime in snapshots)
+        removed = 0
+        for snapshot_path, size, mtime in snapshots:
+            if total <= self.max_bytes:
+                break
+            if snapshot_path == keep:
+                continue
+            try:
+                os.remove(snapshot_path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return removed
+    
+    def clear(self, ):
+        """Remove all snapshots, returning the number removed"""
+        removed = 0
+        for snapshot_path, size, mtime in self.snapshots():
+            try:
+                os.remove(snapshot_path)
+            except FileNotFoundError:
+                continue
+            removed += 1
+        return removed
+
+def fingerprint(*components):
+    """Compute a fingerprint from JSON-serializable *components*
+    
+    The version of this package and the snapshot format are always included.
+    """
+    description = json.dumps(
+        [SNAPSHOT_FORMAT, _package_version] + list(components),
+        sort_keys=True,
+        default=repr,
+    )
+    return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+def file_fingerprint(file_path, base_dir):
+    """Get a JSON-serializable ``[path, sha256]`` for a file
+    
+    :param file_path: Path of the file
+    :param base_dir: Directory to which the path in the result is relative
+    
+    The digest is ``None`` for a file that does not exist.  Digests are
+    remembered for the life of the process and only computed again when the
+    size or modification time of the file changes.
+    """
+    return [
+        os.path.relpath(file_path, base_dir).replace(os.sep, '/'),
+        file_digest(file_path),
+    ]
+
+def file_digest(file_path):
+    """Get the SHA-256 hex digest of a file's content (``None`` if missing)"""
+    memo_key = os.path.abspath(file_path)
+    try:
+        file_stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    stamp = (file_stat.st_size, file_stat.st_mtime_ns)
+    memo = _file_digests.get(memo_key)
+    if memo is not None and memo[0] == stamp:
+        return memo[1]
+    
+    digest = hashlib.sha256()
+    try:
+        with open(file_path, 'rb') as instream:
+            for block in iter(lambda: instream.read(2**20), b''):
+                digest.update(block)
+    except FileNotFoundError:
+        return None
+    digest = digest.hexdigest()
+    _file_digests[memo_key] = (stamp, digest)
+    return digest
+
+_file_digests = {} # absolute path -> ((size, mtime_ns), sha256 hex)
+
+def _source_prefix(source):
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()[:16]
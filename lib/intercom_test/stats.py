@@ -0,0 +1,191 @@
+# Copyright 2018 PayTrace, Inc.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Opt-in counters of the work done by this package
+
+When slow test case iteration needs explaining, enable :data:`stats` to
+count the data files opened and bytes read from them (by kind of file), the
+YAML events and documents processed, the test case keys hashed and the time
+spent hashing, and the augmentation lookups served by each augmentation
+backend::
+
+    from intercom_test.stats import stats
+    
+    stats.enable()
+    cases = list(case_provider.cases())
+    print(stats.report())
+
+While disabled (the default), instrumented code does no more than check
+:attr:`Stats.enabled`.  Counts cover only the current process -- work done
+in worker processes (see :attr:`.InterfaceCaseProvider.max_workers`) is not
+included -- and updates from concurrent threads are not synchronized.
+"""
+
+from collections import Counter
+import io
+
+class Stats:
+    """Counters of work done by this package
+    
+    .. attribute:: files_opened
+    
+        :class:`collections.Counter` of data files opened, by kind of file
+        (e.g. ``'interface'``, ``'compact'``, ``'compact index'``,
+        ``'update'``)
+    
+    .. attribute:: bytes_read
+    
+        :class:`collections.Counter` of bytes read from data files, by kind
+        of file
+    
+    .. attribute:: yaml_events
+    
+        Number of YAML events generated by :func:`.yaml_tools.parse`
+    
+    .. attribute:: yaml_documents
+    
+        Number of YAML documents loaded whole (e.g. test case files)
+    
+    .. attribute:: keys_hashed
+    
+        Number of calls to :func:`.cases.hash_from_fields`
+    
+    .. attribute:: hash_seconds
+    
+        Total wall time spent in :func:`.cases.hash_from_fields`
+    
+    .. attribute:: augmentation_lookups
+    
+        :class:`collections.Counter` of test case augmentation lookups, by
+        backend (the module of the augmenter found, e.g. ``'compact_file'``,
+        or ``'none'`` when the case has no augmentation data)
+    """
+    enabled = False
+    
+    def __init__(self, ):
+        super().__init__()
+        self.reset()
+    
+    def enable(self, ):
+        self.enabled = True
+    
+    def disable(self, ):
+        self.enabled = False
+    
+    def reset(self, ):
+        """Zero all counters"""
+        self.files_opened = Counter()
+        self.bytes_read = Counter()
+        self.yaml_events = 0
+        self.yaml_documents = 0
+        self.keys_hashed = 0
+        self.hash_seconds = 0.0
+        self.augmentation_lookups = Counter()
+    
+    def snapshot(self, ):
+        """Get the current counts as a JSON-compatible :class:`dict`"""
+        return {
+            'files_opened': dict(self.files_opened),
+            'bytes_read': dict(self.bytes_read),
+            'yaml_events': self.yaml_events,
+            'yaml_documents': self.yaml_documents,
+            'keys_hashed': self.keys_hashed,
+            'hash_seconds': self.hash_seconds,
+            'augmentation_lookups': dict(self.augmentation_lookups),
+        }
+    
+    def report(self, ):
+        """Get a human-readable, multi-line summary of the current counts"""
+        lines = []
+        def add_counter(title, counter):
+            lines.append("{}: {}".format(title, sum(counter.values())))
+            for k, count in sorted(counter.items()):
+                lines.append("    {}: {}".format(k, count))
+        
+        add_counter("Files opened", self.files_opened)
+        add_counter("Bytes read", self.bytes_read)
+        lines.append("YAML events parsed: {}".format(self.yaml_events))
+        lines.append("YAML documents loaded: {}".format(self.yaml_documents))
+        lines.append("Keys hashed: {} ({:.3f} s)".format(self.keys_hashed, self.hash_seconds))
+        add_counter("Augmentation lookups", self.augmentation_lookups)
+        return "\n".join(lines)
+    
+    def count_augmentation_lookup(self, augmenter, *, bulk=False):
+        if augmenter is None:
+            backend = 'none'
+        else:
+            backend = type(augmenter).__module__.rpartition('.')[2]
+        if bulk:
+            backend += ' (bulk)'
+        self.augmentation_lookups[backend] += 1
+    
+    def counted_events(self, events):
+        for event in events:
+            self.yaml_events += 1
+            yield event
+    
+    def counted_documents(self, documents):
+        for document in documents:
+            self.yaml_documents += 1
+            yield document
+
+stats = Stats()
+
+def open_data_file(path, kind, *, binary=False):
+    """Open a data file for reading, counting it in :data:`stats` if enabled
+    
+    :param path: Path of the file to open
+    :param str kind: Kind of data file, for :attr:`Stats.files_opened`
+    :keyword binary: Whether to open the file in binary mode
+    """
+    if not stats.enabled:
+        return open(path, 'rb' if binary else 'r')
+    
+    stats.files_opened[kind] += 1
+    buffered = io.BufferedReader(_ReadCounter(open(path, 'rb', buffering=0), kind))
+    return buffered if binary else io.TextIOWrapper(buffered)
+
+class _ReadCounter(io.RawIOBase):
+    def __init__(self, raw, kind):
+        super().__init__()
+        self._raw = raw
+        self._kind = kind
+        self.name = raw.name
+    
+    def readinto(self, b):
+        n = self._raw.readinto(b)
+        if n:
+            stats.bytes_read[self._kind] += n
+        return n
+    
+    def readable(self, ):
+        return True
+    
+    def seekable(self, ):
+        return self._raw.seekable()
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._raw.seek(offset, whence)
+    
+    def tell(self, ):
+        return self._raw.tell()
+    
+    def fileno(self, ):
+        return self._raw.fileno()
+    
+    def close(self, ):
+        try:
+            self._raw.close()
+        finally:
+            super().close()
@@ -0,0 +1,337 @@
+# Copyright 2018 PayTrace, Inc.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""HTTP stub service answering requests from interface test cases
+
+A :class:`CaseResponder` indexes HTTP test cases by the case key (see
+:meth:`.CaseAugmenter.key_of_case`) of their request fields -- those in
+:const:`.HTTPCaseAugmenter.CASE_PRIMARY_KEYS` -- so that the case matching a
+request is found with a single :class:`dict` lookup however many cases
+there are.  A :class:`StubServer` serves the responses of the matched cases
+over HTTP, handling each connection in its own thread, and keeps request
+counts and a bounded sample of latencies for :meth:`StubServer.report`.
+Request bodies may be framed by ``Content-Length`` or by chunked transfer
+coding; a request whose body cannot be read is answered with an error
+status and its connection closed.
+
+Test case fields used in building responses are:
+
+``response status``
+    the HTTP status code (default: 200)
+
+``response headers``
+    *optional* mapping of additional response headers; any
+    ``Content-Length`` or ``Transfer-Encoding`` given here is dropped, as
+    the server frames the response itself
+
+``response body``
+    sent as JSON unless it is a string, which is sent as given (as JSON if
+    ``response type`` is ``json``, otherwise as plain text)
+"""
+
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import random
+import re
+import threading
+import time
+from .framework import HTTPCaseAugmenter
+from .utils import percentile as _percentile
+
+logger = logging.getLogger(__name__)
+
+# Response headers computed by the server, never taken from a test case
+FRAMING_HEADERS = frozenset(('content-length', 'transfer-encoding'))
+
+# Longest chunk size or trailer line accepted in a chunked request body
+MAX_CHUNK_LINE = 65536
+
+_CHUNK_SIZE = re.compile(rb'[0-9A-Fa-f]+')
+
+class CaseResponder:
+    """Index of HTTP test cases by request fields
+    
+    :param cases: An iterable of HTTP test case :class:`dict`\ s
+    
+    When several cases have the same request fields, the first is used and
+    the others are counted in :attr:`duplicates`.
+    
+    Cases are keyed as by :attr:`.InterfaceCaseProvider.use_body_type_magic`:
+    a ``"request body"`` given as JSON text with a ``"request type"`` of
+    ``"json"`` is keyed by its decoded value, so requests match it however
+    the JSON is formatted.  A ``"request body"`` of ``null`` is the same as
+    none.
+    """
+    KEY_FIELDS = HTTPCaseAugmenter.CASE_PRIMARY_KEYS
+    
+    def __init__(self, cases):
+        super().__init__()
+        self._cases = {}
+        self.duplicates = 0
+        for case in cases:
+            key = HTTPCaseAugmenter.key_of_case(_request_fields(case))
+            if key in self._cases:
+                self.duplicates += 1
+                continue
+            if case.get('response body') is not None and not status_allows_body(_response_status(case)):
+                logger.warning("Ignoring response body of {} {} case; status {} responses have no body".format(
+                    case.get('method'),
+                    case.get('url'),
+                    _response_status(case),
+                ))
+            self._cases[key] = case
+    
+    def __len__(self, ):
+        return len(self._cases)
+    
+    def match(self, method, url, body=b''):
+        """Get the test case for a request, or ``None`` if there is none
+        
+        :param str method: HTTP method of the request
+        :param str url: Request URL (path and query string)
+        :param bytes body: Request body
+        
+        A non-empty *body* is matched as decoded JSON if it is valid JSON,
+        and otherwise (or if that finds no case) as text; an empty body, or
+        one of JSON ``null``, matches a case without a ``"request body"``.
+        A ``HEAD`` request for which there is no case matches the ``GET``
+        case for *url*.
+        """
+        case = self._match(method, url, body)
+        if case is None and method == 'HEAD':
+            case = self._match('GET', url, body)
+        return case
+    
+    def _match(self, method, url, body):
+        for body_value in _body_values(body):
+            fields = {'url': url, 'method': method}
+            if body_value is not None:
+                fields['request body'] = body_value
+            case = self._cases.get(HTTPCaseAugmenter.key_of_case(fields))
+            if case is not None:
+                return case
+        return None
+
+def _request_fields(case):
+    """Get *case* with its ``"request body"`` as a request would be matched"""
+    if 'request body' not in case:
+        return case
+    body = case['request body']
+    if case.get('request type') == 'json' and isinstance(body, str):
+        try:
+            body = json.loads(body)
+        except ValueError:
+            return case
+    if body is None:
+        return dict((k, v) for k, v in case.items() if k != 'request body')
+    if body is case['request body']:
+        return case
+    return dict(case, **{'request body': body})
+
+def _body_values(body):
+    if not body:
+        yield None
+        return
+    text = body.decode('utf-8', errors='replace')
+    try:
+        yield json.loads(text)
+    except ValueError:
+        pass
+    yield text
+
+def status_allows_body(status):
+    """Whether a response with HTTP *status* may have a body (and ``Content-Length``)"""
+    return not (100 <= status < 200 or status in (204, 304))
+
+def _response_status(case):
+    return int(case.get('response status', 200))
+
+def response_parts(case):
+    """Get ``(status, headers, payload)`` for the response of *case*
+    
+    The payload is empty for statuses that do not allow a body (see
+    :func:`status_allows_body`), whatever the ``"response body"`` of *case*.
+    """
+    status = _response_status(case)
+    headers = dict(
+        (name, value)
+        for name, value in (case.get('response headers') or {}).items()
+        if name.lower() not in FRAMING_HEADERS
+    )
+    body = case.get('response body')
+    if body is None or not status_allows_body(status):
+        payload = b''
+    elif isinstance(body, str):
+        payload = body.encode('utf-8')
+        _default_header(
+            headers,
+            'Content-Type',
+            'application/json' if case.get('response type') == 'json' else 'text/plain; charset=utf-8',
+        )
+    else:
+        payload = json.dumps(body).encode('utf-8')
+        _default_header(headers, 'Content-Type', 'application/json')
+    return status, headers, payload
+
+def _default_header(headers, name, value):
+    """Set header *name* in *headers* unless it is there in any letter case"""
+    if not any(existing.lower() == name.lower() for existing in headers):
+        headers[name] = value
+
+class StubServer(ThreadingHTTPServer):
+    """Threaded HTTP server answering requests through a :class:`CaseResponder`
+    
+    :param server_address: ``(host, port)`` on which to listen
+    :param CaseResponder responder: Source of responses
+    """
+    daemon_threads = True
+    
+    # Listen backlog, allowing many clients to connect at once
+    request_queue_size = 1024
+    
+    # Maximum number of request latencies kept (as a uniform random sample
+    # of all requests) for the percentiles in report()
+    latency_sample_size = 10000
+    
+    def __init__(self, server_address, responder):
+        self.responder = responder
+        self.request_counts = Counter()
+        self.latencies = []
+        self.max_latency = None
+        self._random = random.Random()
+        self._stats_lock = threading.Lock()
+        super().__init__(server_address, _StubRequestHandler)
+    
+    def record_request(self, matched, latency):
+        with self._stats_lock:
+            self.request_counts['matched' if matched else 'unmatched'] += 1
+            if self.max_latency is None or latency > self.max_latency:
+                self.max_latency = latency
+            
+            # Reservoir sampling keeps self.latencies a uniform sample
+            requests = sum(self.request_counts.values())
+            if len(self.latencies) < self.latency_sample_size:
+                self.latencies.append(latency)
+            else:
+                i = self._random.randrange(requests)
+                if i < len(self.latencies):
+                    self.latencies[i] = latency
+    
+    def report(self, ):
+        """Get a human-readable summary of requests served and their latencies
+        
+        Latency percentiles are estimated from a sample of at most
+        :attr:`latency_sample_size` requests; the maximum is exact.
+        """
+        with self._stats_lock:
+            latencies = sorted(self.latencies)
+            counts = Counter(self.request_counts)
+            max_latency = self.max_latency
+        lines = ["Requests: {} ({} matched, {} unmatched)".format(
+            counts['matched'] + counts['unmatched'], counts['matched'], counts['unmatched'],
+        )]
+        if latencies:
+            lines.append("Latency (ms): " + ", ".join(
+                ["{} {:.3f}".format(label, 1000 * _percentile(latencies, p))
+                for label, p in (('p50', 50), ('p90', 90), ('p99', 99))]
+                + ["max {:.3f}".format(1000 * max_latency)]
+            ))
+        return "\n".join(lines)
+
+class _StubRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections alive between requests from a client
+    protocol_version = 'HTTP/1.1'
+    
+    def _respond(self, ):
+        start = time.perf_counter()
+        try:
+            body = self._request_body()
+        except _UnreadableBody as e:
+            # The end of the request is unknown, so the connection cannot
+            # be used for another request
+            self.close_connection = True
+            self.send_error(e.status, e.message)
+            self.server.record_request(False, time.perf_counter() - start)
+            return
+        case = self.server.responder.match(self.command, self.path, body)
+        if case is None:
+            status, headers, payload = 404, {'Content-Type': 'application/json'}, json.dumps({
+                'error': "No test case matches this request",
+                'method': self.command,
+                'url': self.path,
+            }).encode('utf-8')
+        else:
+            status, headers, payload = response_parts(case)
+        
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, str(value))
+        if status_allows_body(status):
+            # For HEAD, the length of the body a GET would get
+            self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        if payload and self.command != 'HEAD':
+            self.wfile.write(payload)
+        self.server.record_request(case is not None, time.perf_counter() - start)
+    
+    def _request_body(self, ):
+        transfer_encoding = self.headers.get('Transfer-Encoding')
+        if transfer_encoding is not None:
+            if transfer_encoding.strip().lower() != 'chunked':
+                raise _UnreadableBody(501, "Unsupported Transfer-Encoding {!r}".format(transfer_encoding))
+            return self._chunked_body()
+        
+        length = self.headers.get('Content-Length') or '0'
+        if not length.strip().isdigit():
+            raise _UnreadableBody(400, "Invalid Content-Length {!r}".format(length))
+        length = int(length)
+        return self.rfile.read(length) if length else b''
+    
+    def _chunked_body(self, ):
+        chunks = []
+        while True:
+            size_text = self._chunk_line().split(b';', 1)[0].strip()
+            if not _CHUNK_SIZE.fullmatch(size_text):
+                raise _UnreadableBody(400, "Invalid chunk size in request body")
+            size = int(size_text, 16)
+            if size == 0:
+                break
+            chunk = self.rfile.read(size)
+            if len(chunk) < size or self._chunk_line() != b'':
+                raise _UnreadableBody(400, "Truncated chunk in request body")
+            chunks.append(chunk)
+        
+        # Trailer fields are ignored
+        while self._chunk_line() != b'':
+            pass
+        return b''.join(chunks)
+    
+    def _chunk_line(self, ):
+        line = self.rfile.readline(MAX_CHUNK_LINE + 1)
+        if len(line) > MAX_CHUNK_LINE or not line.endswith(b'\n'):
+            raise _UnreadableBody(400, "Malformed chunked request body")
+        return line.rstrip(b'\r\n')
+    
+    do_GET = do_HEAD = do_POST = do_PUT = do_PATCH = do_DELETE = do_OPTIONS = _respond
+    
+    def log_message(self, format, *args):
+        logger.debug("%s - " + format, self.address_string(), *args)
+
+class _UnreadableBody(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
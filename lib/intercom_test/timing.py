@@ -0,0 +1,188 @@
+# Copyright 2018 PayTrace, Inc.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Opt-in timing of test cases run through :meth:`.InterfaceCaseProvider.case_runners`
+
+Pass a :class:`CaseTimings` to :meth:`~.InterfaceCaseProvider.case_runners`
+to record, for each case, the wall and CPU time spent augmenting the case
+(in :meth:`.CaseAugmenter.augmented_test_case`) and running the test function
+on it::
+
+    from intercom_test.timing import CaseTimings
+    
+    timings = CaseTimings()
+    for runner in case_provider.case_runners(test_fn, timings=timings):
+        runner()
+    timings.write_json('case-timings.json')
+
+Records are keyed by case key: the :meth:`~.CaseAugmenter.key_of_case` of
+the provider's *case_augmenter*, or the hash of all fields of the case when
+there is none.  CPU times are those of the whole process
+(:func:`time.process_time`), so they include any other threads running at
+the same time.
+
+Reading and parsing the test case files is not part of either time.  So
+that every case is augmented -- one case at a time -- in this process, timed
+runs read the test case files serially, without the worker pool (see
+:attr:`.InterfaceCaseProvider.max_workers`), the snapshot cache or bulk
+augmentation.
+"""
+
+from collections import namedtuple
+import csv
+import json
+import time
+from .utils import percentile as _percentile
+
+PERCENTILES = (('p50', 50), ('p90', 90), ('p99', 99), ('max', 100))
+
+class CaseTiming(namedtuple('_CaseTiming', 'case_key augment_wall augment_cpu run_wall run_cpu passed')):
+    """Timing of one test case, in seconds
+    
+    .. attribute:: case_key
+    
+        Case key of the test case
+    
+    .. attribute:: augment_wall
+    .. attribute:: augment_cpu
+    
+        Time spent augmenting the case (zero without a *case_augmenter*)
+    
+    .. attribute:: run_wall
+    .. attribute:: run_cpu
+    
+        Time spent in the test function
+    
+    .. attribute:: passed
+    
+        Whether the test function returned (rather than raising)
+    """
+    @property
+    def total_wall(self):
+        return self.augment_wall + self.run_wall
+    
+    @property
+    def total_cpu(self):
+        return self.augment_cpu + self.run_cpu
+
+class CaseTimings:
+    """Collected :class:`CaseTiming` records
+    
+    .. attribute:: records
+    
+        :class:`list` of :class:`CaseTiming`, in the order the test functions
+        finished
+    """
+    METRICS = ('augment_wall', 'augment_cpu', 'run_wall', 'run_cpu', 'total_wall', 'total_cpu')
+    
+    def __init__(self, ):
+        super().__init__()
+        self.records = []
+    
+    def __len__(self, ):
+        return len(self.records)
+    
+    def timed_augmentation(self, augment, test_cases):
+        """Generate ``(augmented_case, (wall, cpu))`` with the time *augment* takes on each case"""
+        for test_case in test_cases:
+            wall_start, cpu_start = time.perf_counter(), time.process_time()
+            test_case = augment(test_case)
+            yield test_case, (time.perf_counter() - wall_start, time.process_time() - cpu_start)
+    
+    def timed_run(self, case_key, augment_times, fn, *args, **kwargs):
+        """Call *fn* and record a :class:`CaseTiming` for it"""
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        passed = False
+        try:
+            result = fn(*args, **kwargs)
+            passed = True
+            return result
+        finally:
+            self.records.append(CaseTiming(
+                case_key,
+                *augment_times,
+                time.perf_counter() - wall_start,
+                time.process_time() - cpu_start,
+                passed,
+            ))
+    
+    def slowest(self, n=10):
+        """Get the *n* :class:`CaseTiming` records of greatest total wall time"""
+        return sorted(self.records, key=lambda record: record.total_wall, reverse=True)[:n]
+    
+    def summary(self, *, top=10):
+        """Get a JSON-compatible :class:`dict` summarizing the records
+        
+        The summary gives the number of cases (and of those that failed),
+        the total and percentiles of each of :attr:`METRICS`, and the *top*
+        slowest cases by total wall time.
+        """
+        summary = {
+            'cases': len(self.records),
+            'failed': sum(not record.passed for record in self.records),
+            'metrics': {},
+            'slowest': [self._record_dict(record) for record in self.slowest(top)],
+        }
+        if self.records:
+            for metric in self.METRICS:
+                values = sorted(getattr(record, metric) for record in self.records)
+                metric_summary = summary['metrics'][metric] = {'total': sum(values)}
+                for label, p in PERCENTILES:
+                    metric_summary[label] = _percentile(values, p)
+        return summary
+    
+    def write_json(self, path, *, top=10):
+        """Write the :meth:`summary` as JSON to the file at *path*"""
+        with open(path, 'w') as outstream:
+            json.dump(self.summary(top=top), outstream, indent=2)
+            outstream.write("\n")
+    
+    def write_csv(self, path, *, top=None):
+        """Write the records as CSV, slowest first, to the file at *path*
+        
+        :keyword top: *optional* Number of records to write
+        """
+        records = self.slowest(len(self.records) if top is None else top)
+        with open(path, 'w', newline='') as outstream:
+            writer = csv.writer(outstream)
+            writer.writerow(('case_key',) + self.METRICS + ('passed',))
+            for record in records:
+                record = self._record_dict(record)
+                writer.writerow([record[field] for field in ('case_key',) + self.METRICS + ('passed',)])
+    
+    def report(self, *, top=10):
+        """Get a human-readable, multi-line summary of the records"""
+        summary = self.summary(top=top)
+        lines = ["Cases timed: {} ({} failed)".format(summary['cases'], summary['failed'])]
+        for metric, metric_summary in summary['metrics'].items():
+            lines.append("{}: total {:.3f} s; ".format(metric, metric_summary['total']) + ", ".join(
+                "{} {:.3f}".format(label, metric_summary[label])
+                for label, _ in PERCENTILES
+            ))
+        if summary['slowest']:
+            lines.append("Slowest cases (augment + run wall s):")
+            for record in summary['slowest']:
+                lines.append("    {:.3f} = {:.3f} + {:.3f} {}".format(
+                    record['total_wall'],
+                    record['augment_wall'],
+                    record['run_wall'],
+                    record['case_key'],
+                ))
+        return "\n".join(lines)
+    
+    def _record_dict(self, record):
+        result = record._asdict()
+        result['total_wall'] = record.total_wall
+        result['total_cpu'] = record.total_cpu
+        return result
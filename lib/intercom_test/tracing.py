@@ -0,0 +1,174 @@
+# Copyright 2018 PayTrace, Inc.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Opt-in timeline of the work done by this package
+
+Where :mod:`.stats` counts work, :data:`tracer` records when it happens: enable
+it to record nested spans for scanning data directories, indexing compact
+and update augmentation files, parsing each test case file, hashing case
+keys, augmenting cases and updating compact files, then write them as a
+Chrome trace file (viewable in ``chrome://tracing`` or Perfetto)::
+
+    from intercom_test.tracing import tracer
+    
+    tracer.enable(sample_every=100)
+    cases = list(case_provider.cases())
+    tracer.write('cases.trace.json')
+
+Spans that occur once per case (hashing and augmentation) are *sampled*:
+only one in every *sample_every* of them, per kind, is recorded, limiting the
+overhead and size of traces of large sets of test cases.
+
+While disabled (the default), instrumented code does no more than check
+:attr:`Tracer.enabled` or enter a context manager that does nothing.  As
+with :mod:`.stats`, only work done in the current process is recorded.
+"""
+
+from collections import Counter
+import json
+import os
+import threading
+import time
+
+class Tracer:
+    """Recorder of timed spans of work
+    
+    .. attribute:: events
+    
+        :class:`list` of the Chrome trace events recorded
+    
+    .. attribute:: sample_every
+    
+        Only one of this many sampled spans of each name is recorded
+    """
+    enabled = False
+    sample_every = 1
+    
+    def __init__(self, ):
+        super().__init__()
+        self.reset()
+    
+    def enable(self, *, sample_every=None):
+        if sample_every is not None:
+            self.sample_every = max(int(sample_every), 1)
+        self.enabled = True
+    
+    def disable(self, ):
+        self.enabled = False
+    
+    def reset(self, ):
+        """Discard all recorded spans"""
+        self.events = []
+        self._sample_counts = Counter()
+        self._origin = time.perf_counter()
+    
+    def span(self, name, category, **args):
+        """Get a context manager recording the time spent in its body as a span
+        
+        Nothing is recorded while this tracer is disabled.
+        """
+        if not self.enabled:
+            return _NOT_RECORDED
+        return _Span(self, name, category, args)
+    
+    def sampled_span(self, name, category, **args):
+        """Like :meth:`span`, but recording only one in :attr:`sample_every`"""
+        if not self.enabled:
+            return _NOT_RECORDED
+        count = self._sample_counts[name]
+        self._sample_counts[name] = count + 1
+        if count % self.sample_every:
+            return _NOT_RECORDED
+        args['sampled'] = self.sample_every
+        return _Span(self, name, category, args)
+    
+    def spanned_iteration(self, name, category, iterable, **args):
+        """Generate the items of *iterable*, recording its iteration as a span
+        
+        The span extends from the first request for an item until *iterable*
+        is exhausted (or the generator closed), and so includes the time the
+        consumer spends between items; the time spent getting the items is
+        given as the ``busy_ms`` argument of the span.
+        """
+        iterator = iter(iterable)
+        start = time.perf_counter()
+        busy = 0.0
+        items = 0
+        try:
+            while True:
+                item_start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    busy += time.perf_counter() - item_start
+                items += 1
+                yield item
+        finally:
+            args.update(items=items, busy_ms=round(busy * 1000, 3))
+            self._add_span(name, category, start, time.perf_counter(), args)
+    
+    def trace(self, ):
+        """Get the recorded spans as a JSON-compatible Chrome trace :class:`dict`"""
+        return {
+            'traceEvents': list(self.events),
+            'displayTimeUnit': 'ms',
+            'otherData': {'sample_every': self.sample_every},
+        }
+    
+    def write(self, path):
+        """Write the recorded spans to a Chrome trace file at *path*"""
+        with open(path, 'w') as outstream:
+            json.dump(self.trace(), outstream)
+    
+    def _add_span(self, name, category, start, end, args):
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': round((start - self._origin) * 1e6, 3),
+            'dur': round((end - start) * 1e6, 3),
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+        }
+        if args:
+            event['args'] = args
+        self.events.append(event)
+
+class _Span:
+    def __init__(self, tracer, name, category, args):
+        super().__init__()
+        self._tracer = tracer
+        self._name = name
+        self._category = category
+        self._args = args
+    
+    def __enter__(self, ):
+        self._start = time.perf_counter()
+    
+    def __exit__(self, *exc_info):
+        self._tracer._add_span(self._name, self._category, self._start, time.perf_counter(), self._args)
+        return False
+
+class _NotRecorded:
+    def __enter__(self, ):
+        return None
+    
+    def __exit__(self, *exc_info):
+        return False
+
+_NOT_RECORDED = _NotRecorded()
+
+tracer = Tracer()
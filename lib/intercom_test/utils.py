@@ -14,8 +14,17 @@
 
 from contextlib import contextmanager
 import enum
+import hashlib
+import json
+import logging
+import os
 import shutil
+import stat
 import tempfile
+import uuid
+from .stats import open_data_file as _open_data_file
+
+logger = logging.getLogger(__name__)
 
 def def_enum(fn):
     """Decorator allowing a function to DRYly define an enumeration
@@ -49,6 +58,158 @@ def open_temp_copy(path, binary=False, *, blocksize=None):
         copied_file.seek(0)
         yield copied_file
 
+@contextmanager
+def atomic_write(path, binary=False, *, newline=None):
+    """Open a file that replaces *path* only once it is completely written
+    
+    The content is written to a temporary file in the directory of *path*,
+    which is renamed over *path* when the context exits without an
+    exception; otherwise the temporary file is removed and *path* is left
+    untouched.  The permissions of an existing *path* are preserved.
+    *newline* is passed to :func:`open` for a text file.
+    """
+    bflag = 'b' if binary else ''
+    dir_path, base_name = os.path.split(path)
+    while True:
+        temp_path = os.path.join(dir_path, '.{}.{}.tmp'.format(base_name, uuid.uuid4().hex[:12]))
+        try:
+            fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+            break
+        except FileExistsError:
+            continue
+    try:
+        try:
+            os.chmod(temp_path, stat.S_IMODE(os.stat(path).st_mode))
+        except FileNotFoundError:
+            pass
+        with open(fd, 'w' + bflag, newline=None if binary else newline) as outstream:
+            yield outstream
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+def percentile(sorted_values, percent):
+    """Get the nearest-rank *percent* percentile of non-empty *sorted_values*"""
+    rank = max(1, -(-len(sorted_values) * percent // 100))
+    return sorted_values[int(rank) - 1]
+
+class FileIndex:
+    """Entries derived from a data file, kept in a validated JSON index file
+    
+    :param data_path: Path of the indexed data file
+    :param index_path: Path of the index file
+    :param int format: Format of the index file; an index file of any other
+        format is not used
+    :param str kind: Kind of the data file, for :func:`.stats.open_data_file`
+    :param dict settings: JSON-compatible settings on which the entries
+        depend; an index file recorded with other settings is not used
+    
+    The index file records the size, modification time and SHA-256 digest of
+    the data file along with the entries.  Failure to read or write the index
+    file is not an error.
+    """
+    RECORDED = ('size', 'mtime_ns', 'sha256', 'entries')
+    
+    def __init__(self, data_path, index_path, *, format, kind, settings=None):
+        super().__init__()
+        self.data_path = data_path
+        self.index_path = index_path
+        self.format = format
+        self.kind = kind
+        self.settings = dict(settings or {})
+    
+    def entries(self, build):
+        """Get the entries for the data file, using the index file if valid
+        
+        :param build: Callable building the (JSON-compatible) entries from the
+            :class:`bytes` content of the data file
+        
+        When the size and modification time of the data file match the index,
+        the recorded entries are returned without reading the data file; when
+        only its digest matches, the recorded entries are returned and the
+        index file is refreshed.  Otherwise the entries are built and the
+        index file is rewritten.
+        """
+        index = self._read()
+        file_stat = os.stat(self.data_path)
+        if (
+            index is not None
+            and index['size'] == file_stat.st_size
+            and index['mtime_ns'] == file_stat.st_mtime_ns
+        ):
+            return index['entries']
+        
+        file_stat, content = self._read_data()
+        digest = hashlib.sha256(content).hexdigest()
+        if index is not None and index['size'] == len(content) and index['sha256'] == digest:
+            entries = index['entries']
+        else:
+            entries = build(content)
+        self._write(file_stat, digest, entries)
+        return entries
+    
+    def rebuild(self, build):
+        """Build the entries for the data file and (re)write the index file
+        
+        :param build: As for :meth:`entries`
+        """
+        file_stat, content = self._read_data()
+        entries = build(content)
+        self._write(file_stat, hashlib.sha256(content).hexdigest(), entries)
+        return entries
+    
+    def record(self, entries):
+        """(Re)write the index file with *entries* already known for the data file"""
+        with _open_data_file(self.data_path, self.kind, binary=True) as stream:
+            file_stat = os.fstat(stream.fileno())
+            digest = hashlib.sha256()
+            for block in iter(lambda: stream.read(65536), b''):
+                digest.update(block)
+        self._write(file_stat, digest.hexdigest(), entries)
+    
+    def _read_data(self, ):
+        with _open_data_file(self.data_path, self.kind, binary=True) as stream:
+            return os.fstat(stream.fileno()), stream.read()
+    
+    def _read(self, ):
+        try:
+            with _open_data_file(self.index_path, self.kind + ' index') as stream:
+                index = json.load(stream)
+            if (
+                index.get('format') != self.format
+                or not all(name in index for name in self.RECORDED)
+                or any(index[name] != value for name, value in self.settings.items())
+            ):
+                return None
+            return index
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            logger.debug("Ignoring unreadable index file %s: %s", self.index_path, e)
+            return None
+    
+    def _write(self, file_stat, digest, entries):
+        index = dict(
+            self.settings,
+            format=self.format,
+            size=file_stat.st_size,
+            mtime_ns=file_stat.st_mtime_ns,
+            sha256=digest,
+            entries=entries,
+        )
+        try:
+            index_dir = os.path.dirname(self.index_path)
+            if index_dir:
+                os.makedirs(index_dir, exist_ok=True)
+            with atomic_write(self.index_path) as outstream:
+                json.dump(index, outstream)
+        except OSError as e:
+            logger.debug("Unable to write index file %s: %s", self.index_path, e)
+
 class FilteredDictView:
     """:class:`dict`-like access to a key-filtered and value-transformed :class:`dict`
     
@@ -12,22 +12,282 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from io import StringIO
+import collections.abc
+import functools
+import itertools
+import os
+import threading
 import yaml
+from .stats import stats as _stats
 
 YAML_EXT = '.yml'
 
+# Set INTERCOM_TEST_PURE_YAML in the environment (to any non-empty value) or
+# call use_libyaml(False) to use the pure-Python PyYAML implementation even
+# when PyYAML was built with libyaml
+_libyaml_requested = not os.environ.get('INTERCOM_TEST_PURE_YAML')
+
+def use_libyaml(enabled=True):
+    """Select whether the libyaml (C) implementation is used, if available
+    
+    All YAML parsing, loading, emitting and dumping in this package goes
+    through the functions of this module, which use PyYAML's libyaml-based
+    classes (e.g. :class:`yaml.CSafeLoader`) when PyYAML was built with
+    libyaml and *enabled* was last given as ``True`` (the default).  Passing
+    ``False`` forces the pure-Python classes, e.g. for comparing the two.
+    """
+    global _libyaml_requested
+    _libyaml_requested = bool(enabled)
+
+def libyaml_in_use():
+    """Indicates whether the libyaml (C) implementation is currently used"""
+    return _libyaml_requested and yaml.__with_libyaml__
+
+def loader_class(*, safe_loading=True):
+    """Get the loader class to use for parsing/loading YAML"""
+    if libyaml_in_use():
+        return yaml.CSafeLoader if safe_loading else yaml.CLoader
+    return yaml.SafeLoader if safe_loading else yaml.Loader
+
+def dumper_class(*, safe=False):
+    """Get the dumper class to use for emitting/dumping YAML"""
+    if libyaml_in_use():
+        return yaml.CSafeDumper if safe else yaml.CDumper
+    return yaml.SafeDumper if safe else yaml.Dumper
+
+def parse(stream):
+    """Generate the YAML events of *stream* (like :func:`yaml.parse`)
+    
+    Events carry the same :attr:`start_mark` and :attr:`end_mark` positions
+    (character offsets into *stream*) whichever implementation is used.
+    """
+    events = yaml.parse(stream, Loader=loader_class())
+    if _stats.enabled:
+        return _stats.counted_events(events)
+    return events
+
+def load(stream, *, safe_loading=True):
+    """Load a single YAML document from *stream* (like :func:`yaml.load`)"""
+    if _stats.enabled:
+        _stats.yaml_documents += 1
+    return yaml.load(stream, Loader=loader_class(safe_loading=safe_loading))
+
+def load_all(stream, *, safe_loading=True):
+    """Load all YAML documents from *stream* (like :func:`yaml.load_all`)"""
+    documents = yaml.load_all(stream, Loader=loader_class(safe_loading=safe_loading))
+    if _stats.enabled:
+        return _stats.counted_documents(documents)
+    return documents
+
+def emit(events, stream=None, **kwargs):
+    """Emit YAML *events* to *stream* (like :func:`yaml.emit`)"""
+    return yaml.emit(events, stream, Dumper=dumper_class(), **kwargs)
+
+def dump(data, stream=None, *, safe=False, **kwargs):
+    """Dump *data* as YAML to *stream* (like :func:`yaml.dump`)"""
+    return yaml.dump(data, stream, Dumper=dumper_class(safe=safe), **kwargs)
+
 def content_events(value):
-    """Return an iterable of events presenting *value* within a YAML document"""
-    return (
-        e for e in yaml.parse(StringIO(yaml.dump(value)))
-        if not isinstance(e, (
-            yaml.StreamStartEvent,
-            yaml.DocumentStartEvent,
-            yaml.DocumentEndEvent,
-            yaml.StreamEndEvent,
-        ))
-    )
+    """Return an iterable of events presenting *value* within a YAML document
+    
+    The events are those :func:`parse` would generate from the output of
+    :func:`dump` for *value* -- including the scalar styles, tags and
+    implicit flags the emitter would settle on -- but are produced directly
+    from the representation of *value*, without writing or parsing any YAML
+    text.
+    """
+    return iter(_EventSerializer(libyaml=libyaml_in_use()).events(value))
+
+class _NullStream:
+    def write(self, data):
+        pass
+
+# Provides the emitter's scalar analysis and tag abbreviation
+_emitter = yaml.emitter.Emitter(_NullStream())
+_emitter.tag_prefixes = dict(yaml.emitter.Emitter.DEFAULT_TAG_PREFIXES)
+
+@functools.lru_cache(maxsize=4096)
+def _scalar_analysis(value):
+    return _emitter.analyze_scalar(value)
+
+@functools.lru_cache(maxsize=256)
+def _prepared_tag(tag):
+    return _emitter.prepare_tag(tag)
+
+class _EventSerializer(yaml.serializer.Serializer, yaml.representer.Representer, yaml.resolver.Resolver):
+    """Serializer of values to the events a parser produces from their YAML
+    
+    The choices an emitter makes when writing YAML text -- scalar style,
+    whether a tag must be written, flow vs. block collections, simple vs.
+    complex mapping keys -- determine the events a parser generates when
+    reading the text back.  This class makes those choices as the emitter of
+    the selected implementation (*libyaml* or pure-Python) would, and so
+    generates the parser's events directly from the represented nodes.
+    """
+    def __init__(self, *, libyaml):
+        yaml.serializer.Serializer.__init__(self)
+        yaml.representer.Representer.__init__(self)
+        yaml.resolver.Resolver.__init__(self)
+        self._libyaml = libyaml
+        
+        # Represent and resolve as the dumper used by dump() would, including
+        # any representers or resolvers added to it
+        dumper = dumper_class()
+        self.yaml_representers = dumper.yaml_representers
+        self.yaml_multi_representers = dumper.yaml_multi_representers
+        self.yaml_implicit_resolvers = dumper.yaml_implicit_resolvers
+        
+        # The parsers differ in how they present the plain scalar style
+        self._plain_style = '' if libyaml else None
+    
+    def events(self, value):
+        node = self.represent_data(value)
+        self.anchor_node(node)
+        events = []
+        self._serialize(node, events)
+        return events
+    
+    def _serialize(self, node, events, *, flow=False, simple_key=False, mapping_context=False, indention=False):
+        if node in self.serialized_nodes:
+            events.append(yaml.AliasEvent(self.anchors[node]))
+            return
+        anchor = self.anchors[node]
+        self.serialized_nodes[node] = True
+        
+        if isinstance(node, yaml.ScalarNode):
+            events.append(self._scalar_event(node, anchor, flow=flow, simple_key=simple_key))
+            return
+        
+        implicit = (node.tag == self.resolve(type(node), node.value, True))
+        tag = None if implicit else node.tag
+        flow_style = bool(flow or node.flow_style or not node.value)
+        
+        if isinstance(node, yaml.SequenceNode):
+            if (
+                mapping_context and not flow_style and not self._libyaml
+                and not (indention and anchor is None and tag is None)
+            ):
+                # The pure-Python emitter writes an indentless sequence,
+                # for which the pure-Python parser reports no style
+                flow_style = None
+            events.append(yaml.SequenceStartEvent(anchor, tag, tag is None, flow_style=flow_style))
+            for item in node.value:
+                self._serialize(item, events, flow=bool(flow_style))
+            events.append(yaml.SequenceEndEvent())
+        else:
+            events.append(yaml.MappingStartEvent(anchor, tag, tag is None, flow_style=flow_style))
+            for key, value in node.value:
+                simple = self._is_simple_key(key)
+                self._serialize(
+                    key, events,
+                    flow=bool(flow_style),
+                    simple_key=simple,
+                    mapping_context=True,
+                    indention=True,
+                )
+                self._serialize(
+                    value, events,
+                    flow=bool(flow_style),
+                    mapping_context=True,
+                    indention=not simple,
+                )
+            events.append(yaml.MappingEndEvent())
+    
+    def _scalar_event(self, node, anchor, *, flow, simple_key):
+        implicit = (
+            node.tag == self.resolve(yaml.ScalarNode, node.value, (True, False)),
+            node.tag == self.resolve(yaml.ScalarNode, node.value, (False, True)),
+        )
+        analysis = _scalar_analysis(node.value)
+        if self._libyaml:
+            style, tag = self._libyaml_scalar_style(node, implicit, analysis, flow=flow, simple_key=simple_key)
+        else:
+            style, tag = self._scalar_style(node, implicit, analysis, flow=flow, simple_key=simple_key)
+        
+        if (style == '' and tag is None) or tag == '!':
+            implicit = (True, False)
+        elif tag is None:
+            implicit = (False, True)
+        else:
+            implicit = (False, False)
+        return yaml.ScalarEvent(
+            anchor, tag, implicit, node.value,
+            style=self._plain_style if style == '' else style,
+        )
+    
+    def _scalar_style(self, node, implicit, analysis, *, flow, simple_key):
+        # Mirrors yaml.emitter.Emitter.choose_scalar_style and .process_tag
+        style = node.style
+        if style == '"':
+            chosen = '"'
+        elif not style and implicit[0] and not (
+            simple_key and (analysis.empty or analysis.multiline)
+        ) and (
+            analysis.allow_flow_plain if flow else analysis.allow_block_plain
+        ):
+            chosen = ''
+        elif style and style in '|>' and not flow and not simple_key and analysis.allow_block:
+            chosen = style
+        elif (not style or style == "'") and analysis.allow_single_quoted and not (
+            simple_key and analysis.multiline
+        ):
+            chosen = "'"
+        else:
+            chosen = '"'
+        
+        if (chosen == '' and implicit[0]) or (chosen != '' and implicit[1]):
+            return chosen, None
+        return chosen, node.tag
+    
+    def _libyaml_scalar_style(self, node, implicit, analysis, *, flow, simple_key):
+        # Mirrors yaml_emitter_select_scalar_style from libyaml
+        tag_written = not (implicit[0] or implicit[1])
+        style = node.style or ''
+        if simple_key and analysis.multiline:
+            style = '"'
+        if style == '':
+            if not (analysis.allow_flow_plain if flow else analysis.allow_block_plain):
+                style = "'"
+            if not node.value and (flow or simple_key):
+                style = "'"
+            if not tag_written and not implicit[0]:
+                style = "'"
+        if style == "'" and not analysis.allow_single_quoted:
+            style = '"'
+        if style in ('|', '>') and (flow or simple_key or not analysis.allow_block):
+            style = '"'
+        
+        if tag_written:
+            return style, node.tag
+        if not implicit[1] and style != '':
+            return style, '!'
+        return style, None
+    
+    def _is_simple_key(self, node):
+        # Mirrors the emitters' check_simple_key
+        if node in self.serialized_nodes:
+            return len(self.anchors[node]) < 128
+        length = len(self.anchors[node] or '')
+        if isinstance(node, yaml.ScalarNode):
+            analysis = _scalar_analysis(node.value)
+            if self._libyaml:
+                if analysis.multiline:
+                    return False
+                if self.resolve(yaml.ScalarNode, node.value, (True, False)) != node.tag and (
+                    self.resolve(yaml.ScalarNode, node.value, (False, True)) != node.tag
+                ):
+                    length += len(_prepared_tag(node.tag))
+                return length + len(node.value.encode('utf-8')) <= 128
+            length += len(_prepared_tag(node.tag)) + len(analysis.scalar)
+            return length < 128 and not (analysis.empty or analysis.multiline)
+        
+        if node.value:
+            return False
+        if self._libyaml:
+            if node.tag != self.resolve(type(node), node.value, True):
+                length += len(_prepared_tag(node.tag))
+            return length <= 128
+        return length + len(_prepared_tag(node.tag)) < 128
 
 class EventsToNodes(yaml.composer.Composer, yaml.resolver.Resolver):
 
@@ -66,25 +326,138 @@ class EventsToNodes(yaml.composer.Composer, yaml.resolver.Resolver):
 def value_from_event_stream(content_events, *, safe_loading=True):
     """Convert an iterable of YAML events to a Pythonic value
     
-    The *content_events* MUST NOT include stream or document events.
+    The *content_events* MUST NOT include stream or document events.  Only
+    the events of the first node in *content_events* are consumed.
+    
+    Plain, untagged collections and scalars -- by far the most common
+    content -- are built directly from the events, resolving and
+    constructing scalars as the loader would.  Any node with an anchor or
+    alias, an explicit collection tag, or a merge key is instead composed
+    and constructed by PyYAML.
     """
     content_events = iter(content_events)
-    events = [yaml.StreamStartEvent(), yaml.DocumentStartEvent()]
+    first_event = next(content_events)
+    converter = _event_converter(safe_loading)
+    if isinstance(first_event, yaml.ScalarEvent) and first_event.anchor is None:
+        try:
+            return converter.scalar_value(first_event)
+        except _NeedsComposition:
+            pass
+    
+    events = [first_event]
     depth = 0
+    event = first_event
     while True:
-        events.append(next(content_events))
-        if isinstance(events[-1], yaml.CollectionStartEvent):
+        if isinstance(event, yaml.CollectionStartEvent):
             depth += 1
-        elif isinstance(events[-1], yaml.CollectionEndEvent):
+        elif isinstance(event, yaml.CollectionEndEvent):
             depth -= 1
         
         if depth == 0:
             break
-    events.extend([yaml.DocumentEndEvent(), yaml.StreamEndEvent()])
-    node = yaml.compose(events, Loader=EventsToNodes)
-    node_constructor = (
-        yaml.constructor.SafeConstructor
-        if safe_loading else
-        yaml.constructor.Constructor
-    )()
-    return node_constructor.construct_object(node, True)
+        event = next(content_events)
+        events.append(event)
+    
+    try:
+        return converter.value(events)
+    except _NeedsComposition:
+        return converter.composed_value(events)
+
+_SEQ_TAG = 'tag:yaml.org,2002:seq'
+_MAP_TAG = 'tag:yaml.org,2002:map'
+_STR_TAG = 'tag:yaml.org,2002:str'
+
+class _NeedsComposition(Exception):
+    """Raised internally when events must be composed into nodes to be converted"""
+
+_event_converters = threading.local()
+
+def _event_converter(safe_loading):
+    # Converters hold constructor state, so each thread has its own
+    converters = _event_converters.__dict__
+    safe_loading = bool(safe_loading)
+    converter = converters.get(safe_loading)
+    if converter is None:
+        converter = converters[safe_loading] = _EventConverter(
+            yaml.constructor.SafeConstructor
+            if safe_loading else
+            yaml.constructor.Constructor
+        )
+    return converter
+
+class _EventConverter(yaml.resolver.Resolver):
+    """Reusable converter of the events of a node to a Pythonic value"""
+    def __init__(self, constructor_class):
+        super().__init__()
+        self._constructor = constructor_class()
+        constructors = self._constructor.yaml_constructors
+        self._plain_collections = (
+            constructors.get(_SEQ_TAG) is yaml.constructor.SafeConstructor.construct_yaml_seq
+            and constructors.get(_MAP_TAG) is yaml.constructor.SafeConstructor.construct_yaml_map
+        )
+    
+    def value(self, events):
+        """Convert the complete list of *events* of a node"""
+        if not self._plain_collections:
+            raise _NeedsComposition()
+        events = iter(events)
+        return self._value(next(events), events)
+    
+    def composed_value(self, events):
+        """Convert *events* of a node by composing and constructing a node"""
+        node = yaml.compose(
+            itertools.chain(
+                (yaml.StreamStartEvent(), yaml.DocumentStartEvent()),
+                events,
+                (yaml.DocumentEndEvent(), yaml.StreamEndEvent()),
+            ),
+            Loader=EventsToNodes,
+        )
+        return self._construct(node)
+    
+    def scalar_value(self, event):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = self.resolve(yaml.ScalarNode, event.value, event.implicit)
+        if tag == _STR_TAG:
+            return event.value
+        if tag not in self._constructor.yaml_constructors:
+            # e.g. merge ("<<") and value ("=") keys, which only the
+            # mapping construction handles
+            raise _NeedsComposition()
+        return self._construct(yaml.ScalarNode(
+            tag, event.value, event.start_mark, event.end_mark,
+            style=event.style,
+        ))
+    
+    def _value(self, event, events):
+        if isinstance(event, yaml.AliasEvent) or event.anchor is not None:
+            raise _NeedsComposition()
+        if isinstance(event, yaml.ScalarEvent):
+            return self.scalar_value(event)
+        if isinstance(event, yaml.SequenceStartEvent):
+            if event.tag not in (None, '!', _SEQ_TAG):
+                raise _NeedsComposition()
+            result = []
+            for event in events:
+                if isinstance(event, yaml.SequenceEndEvent):
+                    return result
+                result.append(self._value(event, events))
+        if event.tag not in (None, '!', _MAP_TAG):
+            raise _NeedsComposition()
+        result = {}
+        for event in events:
+            if isinstance(event, yaml.MappingEndEvent):
+                return result
+            key = self._value(event, events)
+            if not isinstance(key, collections.abc.Hashable):
+                raise _NeedsComposition()
+            result[key] = self._value(next(events), events)
+    
+    def _construct(self, node):
+        constructor = self._constructor
+        try:
+            return constructor.construct_object(node, deep=True)
+        finally:
+            constructor.constructed_objects = {}
+            constructor.recursive_objects = {}
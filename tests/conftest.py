@@ -0,0 +1,95 @@
+# Copyright 2018 PayTrace, Inc.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os.path
+import sys
+
+# Test the package in this working copy rather than any installed copy
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lib'))
+
+import pytest
+
+MAIN_CASES = """\
+- url: /items
+  method: GET
+  response status: 200
+- &created
+  url: /items
+  method: POST
+  request body: {name: widget}
+  response status: 201
+- <<: *created
+  request body: {name: gadget}
+- url: /items/1
+  method: DELETE
+  response status: 204
+- url: /ítems/ñ
+  method: GET
+  response status: 404
+---
+- url: /orders
+  method: GET
+  request type: json
+  request body: '{"q": 1}'
+  response status: 200
+- url: /orders
+  method: PUT
+  request body: null
+  response status: 405
+"""
+
+def extension_cases(n):
+    return "".join(
+        "- url: /ext{0}/{1}\n"
+        "  method: {2}\n"
+        "  response status: {3}\n".format(n, i, ('GET', 'POST')[i % 2], 200 + i)
+        for i in range(6)
+    )
+
+@pytest.fixture
+def spec_dir(tmp_path):
+    """Directory of interface test cases for the group ``'service'``
+    
+    The group has a main file (of two documents, including an anchor,
+    alias and merge key, a JSON body and non-ASCII text) and three extension
+    files.
+    """
+    spec_dir = tmp_path / 'spec'
+    (spec_dir / 'service').mkdir(parents=True)
+    (spec_dir / 'service.yml').write_text(MAIN_CASES, encoding='utf8')
+    for n in range(3):
+        (spec_dir / 'service' / 'ext{}.yml'.format(n)).write_text(extension_cases(n))
+    return spec_dir
+
+@pytest.fixture
+def aug_dir(tmp_path):
+    """Empty augmentation data directory"""
+    aug_dir = tmp_path / 'augmentation'
+    aug_dir.mkdir()
+    return aug_dir
+
+@pytest.fixture(params=['libyaml', 'pure'])
+def yaml_implementation(request):
+    """Run the test with each of the YAML implementations of :mod:`.yaml_tools`"""
+    from intercom_test import yaml_tools
+    import yaml
+    if request.param == 'libyaml' and not yaml.__with_libyaml__:
+        pytest.skip("PyYAML was built without libyaml")
+    was_in_use = yaml_tools._libyaml_requested
+    yaml_tools.use_libyaml(request.param == 'libyaml')
+    try:
+        yield request.param
+    finally:
+        yaml_tools.use_libyaml(was_in_use)
@@ -0,0 +1,124 @@
+# Copyright 2018 PayTrace, Inc.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests of :meth:`~intercom_test.framework.InterfaceCaseProvider.acases` and :meth:`~intercom_test.framework.InterfaceCaseProvider.arun_all`"""
+
+import asyncio
+import os.path
+import pytest
+import yaml
+from intercom_test.framework import HTTPCaseAugmenter, InterfaceCaseProvider
+
+def provider(spec_dir, aug_dir):
+    return InterfaceCaseProvider(
+        str(spec_dir),
+        'service',
+        case_augmenter=HTTPCaseAugmenter(str(aug_dir)),
+    )
+
+@pytest.fixture
+def update_file(aug_dir):
+    with open(str(aug_dir / 'service.update.yml'), 'w') as outstream:
+        yaml.safe_dump([
+            {'url': '/items', 'method': 'GET', 'note': 'updated'},
+        ], outstream)
+
+def compact_file(aug_dir):
+    return str(aug_dir / 'service.yml')
+
+async def echo_url(test_case):
+    await asyncio.sleep(0)
+    return test_case['url']
+
+async def fail_on_delete(test_case):
+    if test_case['method'] == 'DELETE':
+        raise ValueError("cannot delete " + test_case['url'])
+    return await echo_url(test_case)
+
+def test_acases_matches_cases(spec_dir, aug_dir):
+    case_provider = provider(spec_dir, aug_dir)
+    
+    async def collect():
+        return [test_case async for test_case in case_provider.acases(where={'method': 'GET'})]
+    
+    assert asyncio.run(collect()) == list(case_provider.cases(where={'method': 'GET'}))
+
+def test_outcomes_in_case_order(spec_dir, aug_dir):
+    case_provider = provider(spec_dir, aug_dir)
+    outcomes = asyncio.run(case_provider.arun_all(fail_on_delete, concurrency=3))
+    
+    assert [outcome.case for outcome in outcomes] == list(case_provider.cases())
+    failed = [outcome for outcome in outcomes if not outcome.passed]
+    assert [outcome.case['url'] for outcome in failed] == ['/items/1']
+    assert isinstance(failed[0].exception, ValueError)
+    assert all(
+        outcome.result == outcome.case['url']
+        for outcome in outcomes if outcome.passed
+    )
+
+def test_concurrency_limit(spec_dir, aug_dir):
+    running = set()
+    most_running = 0
+    
+    async def track(test_case):
+        nonlocal most_running
+        running.add(id(test_case))
+        most_running = max(most_running, len(running))
+        await asyncio.sleep(0.01)
+        running.discard(id(test_case))
+    
+    outcomes = asyncio.run(provider(spec_dir, aug_dir).arun_all(track, concurrency=2))
+    assert all(outcome.passed for outcome in outcomes)
+    assert most_running == 2
+
+def test_compact_files_updated_when_all_pass(spec_dir, aug_dir, update_file):
+    asyncio.run(provider(spec_dir, aug_dir).arun_all(echo_url))
+    with open(compact_file(aug_dir)) as instream:
+        assert yaml.safe_load(instream) == {
+            HTTPCaseAugmenter.key_of_case({'url': '/items', 'method': 'GET'}): {'note': 'updated'},
+        }
+
+def test_compact_files_not_updated_when_a_case_fails(spec_dir, aug_dir, update_file):
+    case_provider = provider(spec_dir, aug_dir)
+    asyncio.run(case_provider.arun_all(fail_on_delete))
+    assert not os.path.exists(compact_file(aug_dir))
+    
+    asyncio.run(case_provider.arun_all(echo_url))
+    assert not os.path.exists(compact_file(aug_dir))
+
+def test_reading_error_aborts_update(spec_dir, aug_dir, update_file):
+    (spec_dir / 'service' / 'ext9.yml').write_text("- {url: /bad\n")
+    case_provider = provider(spec_dir, aug_dir)
+    with pytest.raises(yaml.YAMLError):
+        asyncio.run(case_provider.arun_all(echo_url))
+    assert not os.path.exists(compact_file(aug_dir))
+
+def test_cancellation_aborts_update(spec_dir, aug_dir, update_file):
+    case_provider = provider(spec_dir, aug_dir)
+    
+    async def block(test_case):
+        await asyncio.sleep(60)
+    
+    async def cancel_run():
+        run = asyncio.ensure_future(case_provider.arun_all(block, concurrency=2))
+        await asyncio.sleep(0.1)
+        run.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await run
+    
+    asyncio.run(cancel_run())
+    assert not os.path.exists(compact_file(aug_dir))
+    asyncio.run(case_provider.arun_all(echo_url))
+    assert not os.path.exists(compact_file(aug_dir))
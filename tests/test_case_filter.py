@@ -0,0 +1,123 @@
+# Copyright 2018 PayTrace, Inc.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests of :mod:`intercom_test.case_filter` and ``cases(where=...)``"""
+
+from io import StringIO
+import pytest
+from intercom_test.case_filter import CaseFilter, Prefix, filtered_cases
+from intercom_test.framework import HTTPCaseAugmenter, InterfaceCaseProvider
+
+WHERE_AND_PREDICATE = [
+    (
+        {'method': 'GET'},
+        lambda case: case.get('method') == 'GET',
+    ),
+    (
+        {'url': Prefix('/ext1/')},
+        lambda case: case.get('url', '').startswith('/ext1/'),
+    ),
+    (
+        {'method': {'POST', 'DELETE'}, 'response status': [201, 204, 201]},
+        lambda case: case.get('method') in ('POST', 'DELETE') and case.get('response status') in (201, 204),
+    ),
+    (
+        {'request body': {'name': 'gadget'}},
+        lambda case: case.get('request body') == {'name': 'gadget'},
+    ),
+    (
+        {'request body': None},
+        lambda case: 'request body' in case and case['request body'] is None,
+    ),
+    (
+        {'response status': lambda status: status >= 400},
+        lambda case: case.get('response status', 0) >= 400,
+    ),
+    (
+        {'url': '/ítems/ñ'},
+        lambda case: case.get('url') == '/ítems/ñ',
+    ),
+    (
+        {'no such field': 'x'},
+        lambda case: False,
+    ),
+]
+
+def provider(spec_dir, aug_dir=None):
+    return InterfaceCaseProvider(
+        str(spec_dir),
+        'service',
+        case_augmenter=None if aug_dir is None else HTTPCaseAugmenter(str(aug_dir)),
+    )
+
+@pytest.mark.parametrize('where, predicate', WHERE_AND_PREDICATE)
+def test_where_matches_filtering_cases(spec_dir, aug_dir, where, predicate):
+    for case_provider in (provider(spec_dir), provider(spec_dir, aug_dir)):
+        expected = [case for case in case_provider.cases() if predicate(case)]
+        assert list(case_provider.cases(where=where)) == expected
+        assert list(case_provider.cases(where=CaseFilter(where))) == expected
+
+def test_where_selects_runners(spec_dir):
+    case_provider = provider(spec_dir)
+    urls = [
+        runner(lambda case: case['url'])
+        for runner in case_provider.case_runners(
+            lambda fn, case: fn(case),
+            do_compact_updates=False,
+            where={'method': 'DELETE'},
+        )
+    ]
+    assert urls == ['/items/1']
+
+def test_filtered_cases_resolve_merge_keys():
+    stream = StringIO(
+        "- &base {url: /a, method: GET}\n"
+        "- {<<: *base, method: POST}\n"
+        "- *base\n"
+    )
+    assert list(filtered_cases(stream, CaseFilter({'url': '/a', 'method': 'POST'}))) == [
+        {'url': '/a', 'method': 'POST'},
+    ]
+
+def test_parse_equality_as_yaml():
+    case_filter = CaseFilter.parse(['response status=200', 'method = [GET, HEAD]', 'note='])
+    assert case_filter.conditions == {
+        'response status': 200,
+        'method': ['GET', 'HEAD'],
+        'note': '',
+    }
+    assert case_filter.accepts({'response status': 200, 'method': 'HEAD', 'note': ''})
+    assert not case_filter.accepts({'response status': '200', 'method': 'HEAD', 'note': ''})
+
+def test_parse_prefix():
+    case_filter = CaseFilter.parse(['url^=/items/'])
+    assert case_filter.conditions == {'url': Prefix('/items/')}
+    assert isinstance(case_filter.conditions['url'], Prefix)
+    assert case_filter.accepts({'url': '/items/3'})
+    assert not case_filter.accepts({'url': '/item'})
+    assert not case_filter.accepts({'url': 3})
+
+def test_parse_rejects_condition_without_equals():
+    with pytest.raises(ValueError):
+        CaseFilter.parse(['method'])
+
+def test_parsed_filter_matches_cases(spec_dir):
+    case_provider = provider(spec_dir)
+    expected = [
+        case for case in case_provider.cases()
+        if case['url'].startswith('/items') and case['method'] == 'POST'
+    ]
+    assert len(expected) == 2
+    assert list(case_provider.cases(where=CaseFilter.parse(['url^=/items', 'method=POST']))) == expected
@@ -0,0 +1,101 @@
+# Copyright 2018 PayTrace, Inc.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Differential tests of :mod:`intercom_test.json_asn1.der`
+
+The direct DER writer must produce exactly the octets of the pyasn1-based
+reference, :func:`intercom_test.json_asn1.convert.asn1_der`, since case
+keys are hashes of these octets.  The values compared are a fixed list of
+edge cases (infinities, signed zero, long lengths, non-ASCII strings, key
+ordering ties) and values generated from seeded random number generators.
+"""
+
+import random
+import pytest
+from intercom_test.json_asn1 import der
+from intercom_test.json_asn1.convert import asn1_der
+
+EDGE_CASES = [
+    None, True, False,
+    0, 1, -1, 127, 128, -128, -129, 255, 256, 2**63, -2**63, 2**70, -2**70,
+    0.0, -0.0, 0.5, 0.1, 1.1, -2.5e-7, 1e300, 1e-300, 5e-324, 123.456,
+    float('inf'), float('-inf'),
+    "", "a", "é" * 200, "中文", "x" * 127, "x" * 128, "x" * 255,
+    "x" * 256, "x" * 70000,
+    [], (), [1, "a", None], (1, 2), [[[]]],
+    {}, {"a": 1}, {"b": 1, "a": 2}, {"ab": 1, "a": 1}, {"a": 1, "ab": 1},
+    {"a": "x" * 200, "b": "y"}, {"k%d" % i: i for i in range(50)},
+    {"é": 1, "e": 2, "z": 3},
+    {
+        "url": "/foo", "method": "GET",
+        "request body": {"z": [1, {"y": None}], "a": "q"},
+    },
+]
+
+FUZZ_SEEDS = range(5)
+FUZZ_COUNT = 500
+
+def generated_values(count, seed):
+    """Generate *count* random JSON-ic values deterministically from *seed*"""
+    rng = random.Random(seed)
+    
+    def text(max_length):
+        return "".join(
+            rng.choice("abé中 ")
+            for _ in range(rng.randrange(max_length))
+        )
+    
+    def value(depth):
+        kind = rng.randrange(8 if depth < 4 else 5)
+        if kind == 0:
+            return None
+        if kind == 1:
+            return rng.randrange(-10**6, 10**6)
+        if kind == 2:
+            return rng.uniform(-1e4, 1e4)
+        if kind == 3:
+            return text(200)
+        if kind == 4:
+            return rng.choice([True, False, 10**rng.randrange(30)])
+        if kind == 5:
+            return [value(depth + 1) for _ in range(rng.randrange(5))]
+        if kind == 6:
+            return tuple(value(depth + 1) for _ in range(rng.randrange(5)))
+        return dict(
+            (text(4) or "k", value(depth + 1))
+            for _ in range(rng.randrange(6))
+        )
+    
+    for _ in range(count):
+        yield value(0)
+
+@pytest.mark.parametrize('value', EDGE_CASES, ids=lambda value: repr(value)[:40])
+def test_edge_case_matches_reference(value):
+    assert der.encode(value) == asn1_der(value)
+
+@pytest.mark.parametrize('seed', FUZZ_SEEDS)
+def test_generated_values_match_reference(seed):
+    mismatched = [
+        value
+        for value in generated_values(FUZZ_COUNT, seed)
+        if der.encode(value) != asn1_der(value)
+    ]
+    assert mismatched == []
+
+def test_cyclic_value_rejected():
+    value = []
+    value.append(value)
+    with pytest.raises(ValueError):
+        der.encode(value)
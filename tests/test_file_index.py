@@ -0,0 +1,85 @@
+# Copyright 2018 PayTrace, Inc.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests of :class:`intercom_test.utils.FileIndex`"""
+
+import json
+import os
+from intercom_test.utils import FileIndex
+
+def counting_builder(calls):
+    def build(content):
+        calls.append(content)
+        return [len(content)]
+    return build
+
+def file_index(tmp_path, **kwargs):
+    data_path = tmp_path / 'data.txt'
+    if not data_path.exists():
+        data_path.write_bytes(b'abc')
+    return FileIndex(
+        str(data_path),
+        str(tmp_path / 'index' / 'data.idx'),
+        format=1,
+        kind='test',
+        **kwargs
+    )
+
+def test_index_reused_while_data_file_unchanged(tmp_path):
+    calls = []
+    assert file_index(tmp_path).entries(counting_builder(calls)) == [3]
+    assert file_index(tmp_path).entries(counting_builder(calls)) == [3]
+    assert len(calls) == 1
+
+def test_index_reused_when_only_mtime_changed(tmp_path):
+    calls = []
+    index = file_index(tmp_path)
+    index.entries(counting_builder(calls))
+    os.utime(index.data_path, ns=(0, 0))
+    assert index.entries(counting_builder(calls)) == [3]
+    assert len(calls) == 1
+    with open(index.index_path) as stream:
+        assert json.load(stream)['mtime_ns'] == 0
+
+def test_index_rebuilt_when_content_changed(tmp_path):
+    calls = []
+    index = file_index(tmp_path)
+    index.entries(counting_builder(calls))
+    with open(index.data_path, 'wb') as stream:
+        stream.write(b'abcdef')
+    assert index.entries(counting_builder(calls)) == [6]
+    assert len(calls) == 2
+
+def test_index_with_other_settings_not_used(tmp_path):
+    calls = []
+    file_index(tmp_path, settings={'fields': ['a']}).entries(counting_builder(calls))
+    file_index(tmp_path, settings={'fields': ['b']}).entries(counting_builder(calls))
+    assert len(calls) == 2
+
+def test_unreadable_index_rebuilt(tmp_path):
+    calls = []
+    index = file_index(tmp_path)
+    os.makedirs(os.path.dirname(index.index_path))
+    with open(index.index_path, 'w') as stream:
+        stream.write('{"format": 1}')
+    assert index.entries(counting_builder(calls)) == [3]
+    assert len(calls) == 1
+
+def test_recorded_entries_used(tmp_path):
+    calls = []
+    index = file_index(tmp_path)
+    index.record(['recorded'])
+    assert index.entries(counting_builder(calls)) == ['recorded']
+    assert not calls
@@ -0,0 +1,131 @@
+# Copyright 2018 PayTrace, Inc.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests of :meth:`intercom_test.framework.InterfaceCaseProvider.run_all`"""
+
+from concurrent.futures.process import BrokenProcessPool
+import os
+import os.path
+import pickle
+import pytest
+import yaml
+from intercom_test.framework import HTTPCaseAugmenter, InterfaceCaseProvider
+
+# Runners are module-level functions so they can be sent to worker processes
+
+def url_and_pid(test_case):
+    return test_case['url'], os.getpid()
+
+def fail_on_delete(test_case):
+    if test_case['method'] == 'DELETE':
+        raise ValueError("cannot delete " + test_case['url'])
+    return test_case['url']
+
+def die_on_delete(test_case):
+    if test_case['method'] == 'DELETE':
+        os._exit(1)
+    return test_case['url']
+
+def provider(spec_dir, aug_dir):
+    return InterfaceCaseProvider(
+        str(spec_dir),
+        'service',
+        case_augmenter=HTTPCaseAugmenter(str(aug_dir)),
+    )
+
+@pytest.fixture
+def update_file(aug_dir):
+    with open(str(aug_dir / 'service.update.yml'), 'w') as outstream:
+        yaml.safe_dump([
+            {'url': '/items', 'method': 'GET', 'note': 'updated'},
+        ], outstream)
+
+def compact_file(aug_dir):
+    return str(aug_dir / 'service.yml')
+
+def test_outcomes_in_case_order(spec_dir, aug_dir):
+    case_provider = provider(spec_dir, aug_dir)
+    outcomes = case_provider.run_all(url_and_pid, workers=2)
+    
+    assert [outcome.case for outcome in outcomes] == list(case_provider.cases())
+    assert all(outcome.passed and outcome.exception is None for outcome in outcomes)
+    assert [outcome.result[0] for outcome in outcomes] == [
+        test_case['url'] for test_case in case_provider.cases()
+    ]
+    assert os.getpid() not in {outcome.result[1] for outcome in outcomes}
+
+def test_failure_fails_only_its_case(spec_dir, aug_dir):
+    outcomes = provider(spec_dir, aug_dir).run_all(fail_on_delete, workers=2)
+    
+    failed = [outcome for outcome in outcomes if not outcome.passed]
+    assert [outcome.case['url'] for outcome in failed] == ['/items/1']
+    assert isinstance(failed[0].exception, ValueError)
+    assert failed[0].result is None
+    assert all(
+        outcome.result == outcome.case['url']
+        for outcome in outcomes if outcome.passed
+    )
+
+def test_where_and_shard_select_cases(spec_dir, aug_dir):
+    case_provider = provider(spec_dir, aug_dir)
+    outcomes = case_provider.run_all(fail_on_delete, workers=2, where={'method': 'POST'})
+    assert [outcome.case for outcome in outcomes] == list(case_provider.cases(where={'method': 'POST'}))
+    
+    case_provider.shard_run_id = 'run'
+    shard_cases = [
+        outcome.case
+        for index in range(2)
+        for outcome in case_provider.run_all(url_and_pid, workers=2, shard=(index, 2))
+    ]
+    assert sorted(map(repr, shard_cases)) == sorted(map(repr, case_provider.cases()))
+
+def test_unpicklable_runner_rejected_before_reading(spec_dir, aug_dir, monkeypatch):
+    case_provider = provider(spec_dir, aug_dir)
+    
+    def no_reading(*args, **kwargs):
+        raise AssertionError("cases read")
+    
+    monkeypatch.setattr(case_provider, '_selected_cases', no_reading)
+    with pytest.raises((pickle.PicklingError, AttributeError)):
+        case_provider.run_all(lambda test_case: None)
+
+def test_compact_files_updated_when_all_pass(spec_dir, aug_dir, update_file):
+    provider(spec_dir, aug_dir).run_all(url_and_pid, workers=2)
+    with open(compact_file(aug_dir)) as instream:
+        assert yaml.safe_load(instream) == {
+            HTTPCaseAugmenter.key_of_case({'url': '/items', 'method': 'GET'}): {'note': 'updated'},
+        }
+
+def test_compact_files_not_updated_when_a_case_fails(spec_dir, aug_dir, update_file):
+    case_provider = provider(spec_dir, aug_dir)
+    case_provider.run_all(fail_on_delete, workers=2)
+    assert not os.path.exists(compact_file(aug_dir))
+    
+    # Nor by a later, passing run through the same provider
+    case_provider.run_all(url_and_pid, workers=2)
+    assert not os.path.exists(compact_file(aug_dir))
+
+def test_compact_files_not_updated_without_do_compact_updates(spec_dir, aug_dir, update_file):
+    provider(spec_dir, aug_dir).run_all(url_and_pid, workers=2, do_compact_updates=False)
+    assert not os.path.exists(compact_file(aug_dir))
+
+def test_broken_pool_aborts_update(spec_dir, aug_dir, update_file):
+    case_provider = provider(spec_dir, aug_dir)
+    with pytest.raises(BrokenProcessPool):
+        case_provider.run_all(die_on_delete, workers=2)
+    assert not os.path.exists(compact_file(aug_dir))
+    
+    case_provider.run_all(url_and_pid, workers=2)
+    assert not os.path.exists(compact_file(aug_dir))
@@ -0,0 +1,205 @@
+# Copyright 2018 PayTrace, Inc.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests of :mod:`intercom_test.sharding` and ``cases(shard=...)``"""
+
+import os
+import os.path
+import pytest
+import yaml
+from intercom_test import sharding
+from intercom_test.framework import HTTPCaseAugmenter, InterfaceCaseProvider
+from intercom_test.timing import CaseTiming, CaseTimings
+from intercom_test.sharding import (
+    ShardResults,
+    TimingHistory,
+    balanced_assignment,
+    shard_of,
+)
+
+def provider(spec_dir, aug_dir, **kwargs):
+    case_provider = InterfaceCaseProvider(
+        str(spec_dir),
+        'service',
+        case_augmenter=HTTPCaseAugmenter(str(aug_dir)),
+    )
+    for name, value in kwargs.items():
+        setattr(case_provider, name, value)
+    return case_provider
+
+def case_key(test_case):
+    return HTTPCaseAugmenter.key_of_case(test_case)
+
+def assert_partition(case_provider, count):
+    all_cases = list(case_provider.cases())
+    shards = [list(case_provider.cases(shard=(index, count))) for index in range(count)]
+    
+    # Every case is in exactly one shard, and each shard keeps file order
+    assert sorted(map(repr, all_cases)) == sorted(repr(case) for shard in shards for case in shard)
+    for shard in shards:
+        positions = [all_cases.index(case) for case in shard]
+        assert positions == sorted(positions)
+    return shards
+
+@pytest.mark.parametrize('count', [1, 2, 3, 5])
+@pytest.mark.parametrize('body_type_magic', [False, True])
+def test_shards_partition_cases(spec_dir, aug_dir, count, body_type_magic):
+    case_provider = provider(spec_dir, aug_dir, use_body_type_magic=body_type_magic)
+    shards = assert_partition(case_provider, count)
+    for index, shard in enumerate(shards):
+        assert all(shard_of(case_key(case), count) == index for case in shard)
+
+def test_shard_with_where(spec_dir, aug_dir):
+    case_provider = provider(spec_dir, aug_dir)
+    where = {'method': 'GET'}
+    selected = [
+        case
+        for index in range(3)
+        for case in case_provider.cases(where=where, shard=(index, 3))
+    ]
+    assert sorted(map(repr, selected)) == sorted(map(repr, case_provider.cases(where=where)))
+
+def test_shard_requires_augmenter(spec_dir):
+    case_provider = InterfaceCaseProvider(str(spec_dir), 'service')
+    with pytest.raises(ValueError):
+        list(case_provider.cases(shard=(0, 2)))
+
+@pytest.mark.parametrize('shard', [(2, 2), (-1, 2), (0, 0)])
+def test_invalid_shard_rejected(spec_dir, aug_dir, shard):
+    with pytest.raises(ValueError):
+        list(provider(spec_dir, aug_dir).cases(shard=shard))
+
+def test_shard_of_is_stable():
+    # Shards must not move between releases or hosts: the assignment
+    # depends only on the case key
+    key = case_key({'url': '/items', 'method': 'GET'})
+    assert key == 'tdyi6OGzIX4oSPavPPCQ4JwhqWvXc9jcoI7SPAjjcQA='
+    assert [shard_of(key, count) for count in range(1, 8)] == [0, 0, 0, 0, 0, 0, 2]
+
+def test_balanced_assignment_packs_by_duration():
+    durations = {'a': 5.0, 'b': 4.0, 'c': 3.0, 'd': 3.0, 'e': 1.0}
+    assignment = balanced_assignment(['e', 'd', 'c', 'b', 'a', 'x', 'y'], 2, durations)
+    assert assignment == balanced_assignment(['a', 'b', 'c', 'd', 'e', 'x', 'y'], 2, durations)
+    loads = [0.0, 0.0]
+    counts = [0, 0]
+    for key, index in assignment.items():
+        if key in durations:
+            loads[index] += durations[key]
+        else:
+            counts[index] += 1
+    assert sorted(loads) == [8.0, 8.0]
+    assert counts == [1, 1]
+
+def test_balanced_shards_partition_cases(spec_dir, aug_dir, tmp_path):
+    history_path = str(tmp_path / 'timings.json')
+    history = TimingHistory(history_path)
+    for n, test_case in enumerate(provider(spec_dir, aug_dir).cases()):
+        if n % 3:
+            history.record(case_key(test_case), float(n))
+    history.save()
+    
+    case_provider = provider(spec_dir, aug_dir, shard_timing_history=history_path)
+    assert_partition(case_provider, 3)
+    assert TimingHistory(history_path).durations == history.durations
+
+def test_timing_history_records_total_wall_time(tmp_path):
+    timings = CaseTimings()
+    timings.records.append(CaseTiming('a', 0.5, 0.25, 1.0, 0.75, True))
+    timings.records.append(CaseTiming('b', 0.0, 0.0, 2.0, 1.5, False))
+    history = TimingHistory(str(tmp_path / 'timings.json'))
+    history.record_timings(timings)
+    assert history.durations == {'a': 1.5, 'b': 2.0}
+    assert [r.case_key for r in timings.slowest()] == sorted(
+        history.durations, key=history.durations.get, reverse=True
+    )
+
+def test_unreadable_timing_history_is_empty(tmp_path):
+    history_path = tmp_path / 'timings.json'
+    history_path.write_text("not json")
+    assert len(TimingHistory(str(history_path))) == 0
+
+def test_results_need_run_id(tmp_path, monkeypatch):
+    monkeypatch.delenv(sharding.RUN_ID_ENV_VAR, raising=False)
+    results = ShardResults(str(tmp_path / 'results'), 1)
+    assert not results.record(0, passed=True)
+    assert not os.path.exists(str(tmp_path / 'results'))
+
+def test_results_run_id_from_environment(tmp_path, monkeypatch):
+    monkeypatch.setenv(sharding.RUN_ID_ENV_VAR, 'run-7')
+    results = ShardResults(str(tmp_path), 2)
+    assert results.run_id == 'run-7'
+    assert results.run_dir == os.path.join(str(tmp_path), '2-run-7')
+
+@pytest.mark.parametrize('failing', [None, 0, 2])
+def test_last_shard_claims_outcomes(tmp_path, failing):
+    results_dir = str(tmp_path)
+    outcomes = [
+        ShardResults(results_dir, 3, run_id='r1').record(index, passed=index != failing)
+        for index in (2, 0, 1)
+    ]
+    assert outcomes == [False, False, failing is None]
+    # The claimed outcomes are removed, so a later run starts afresh
+    assert os.listdir(results_dir) == []
+
+def test_outcomes_claimed_once(tmp_path):
+    results_dir = str(tmp_path)
+    ShardResults(results_dir, 2, run_id='r1').record(0, passed=True)
+    first = ShardResults(results_dir, 2, run_id='r1')
+    second = ShardResults(results_dir, 2, run_id='r1')
+    # Both shards finish; the first to rename the directory claims it
+    assert first.record(1, passed=True)
+    assert not second.record(1, passed=True)
+
+def test_runs_kept_apart(tmp_path):
+    results_dir = str(tmp_path)
+    assert not ShardResults(results_dir, 2, run_id='old').record(0, passed=False)
+    assert not ShardResults(results_dir, 2, run_id='new').record(1, passed=True)
+    assert ShardResults(results_dir, 2, run_id='new').record(0, passed=True)
+    assert os.listdir(results_dir) == ['2-old']
+
+def run_shard(spec_dir, aug_dir, index, count, fail_urls=()):
+    case_provider = provider(spec_dir, aug_dir, shard_run_id='run-1')
+    
+    def test_fn(test_case):
+        assert test_case['url'] not in fail_urls
+    
+    for runner in case_provider.case_runners(test_fn, shard=(index, count)):
+        try:
+            runner()
+        except AssertionError:
+            pass
+
+def write_update_file(spec_dir, aug_dir):
+    with open(str(aug_dir / 'service.update.yml'), 'w') as outstream:
+        yaml.safe_dump([
+            {'url': '/ext0/0', 'method': 'GET', 'note': 'updated'},
+        ], outstream)
+
+def test_compact_files_updated_when_all_shards_pass(spec_dir, aug_dir):
+    write_update_file(spec_dir, aug_dir)
+    compact_file = str(aug_dir / 'service.yml')
+    run_shard(spec_dir, aug_dir, 0, 2)
+    assert not os.path.exists(compact_file)
+    run_shard(spec_dir, aug_dir, 1, 2)
+    with open(compact_file) as instream:
+        assert yaml.safe_load(instream) == {
+            case_key({'url': '/ext0/0', 'method': 'GET'}): {'note': 'updated'},
+        }
+
+def test_compact_files_not_updated_when_a_shard_fails(spec_dir, aug_dir):
+    write_update_file(spec_dir, aug_dir)
+    run_shard(spec_dir, aug_dir, 0, 2, fail_urls={'/items', '/orders', '/ext1/1', '/ext2/2'})
+    run_shard(spec_dir, aug_dir, 1, 2, fail_urls={'/items', '/orders', '/ext1/1', '/ext2/2'})
+    assert not os.path.exists(str(aug_dir / 'service.yml'))
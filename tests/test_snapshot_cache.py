@@ -0,0 +1,179 @@
+# Copyright 2018 PayTrace, Inc.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests of :mod:`intercom_test.snapshot_cache`"""
+
+import os
+import os.path
+import pickle
+import time
+import pytest
+import yaml
+from intercom_test.framework import HTTPCaseAugmenter, InterfaceCaseProvider
+from intercom_test.snapshot_cache import SNAPSHOT_HEADER, SnapshotCache
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    return str(tmp_path / 'snapshots')
+
+def provider(spec_dir, aug_dir, cache_dir, **kwargs):
+    case_provider = InterfaceCaseProvider(
+        str(spec_dir),
+        'service',
+        case_augmenter=HTTPCaseAugmenter(str(aug_dir)),
+        snapshot_cache_dir=cache_dir,
+    )
+    for name, value in kwargs.items():
+        setattr(case_provider, name, value)
+    return case_provider
+
+def cached_cases(spec_dir, aug_dir, cache_dir, monkeypatch):
+    """Get the cases of a fresh provider, failing if any file is parsed"""
+    case_provider = provider(spec_dir, aug_dir, cache_dir)
+    
+    def no_parsing(*args, **kwargs):
+        raise AssertionError("test case file parsed")
+    
+    with monkeypatch.context() as patch:
+        patch.setattr(case_provider, '_parsed_cases_from_file', no_parsing)
+        return list(case_provider.cases())
+
+def rewrite(file_path, text):
+    # Move the modification time on, so a change is seen even within the
+    # timestamp granularity of the file system
+    stat = os.stat(str(file_path))
+    file_path.write_text(text, encoding='utf8')
+    os.utime(str(file_path), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+def snapshot_paths(cache_dir):
+    return sorted(path for path, size, mtime in SnapshotCache(cache_dir).snapshots())
+
+def test_snapshots_replayed(spec_dir, aug_dir, cache_dir, monkeypatch):
+    expected = list(provider(spec_dir, aug_dir, cache_dir).cases())
+    assert len(snapshot_paths(cache_dir)) == 4
+    assert cached_cases(spec_dir, aug_dir, cache_dir, monkeypatch) == expected
+
+def test_partial_iteration_writes_no_snapshot(spec_dir, aug_dir, cache_dir):
+    test_cases = provider(spec_dir, aug_dir, cache_dir).cases()
+    next(test_cases)
+    test_cases.close()
+    assert snapshot_paths(cache_dir) == []
+
+def test_edited_case_file_invalidates_snapshot(spec_dir, aug_dir, cache_dir, monkeypatch):
+    list(provider(spec_dir, aug_dir, cache_dir).cases())
+    before = snapshot_paths(cache_dir)
+    
+    ext_file = spec_dir / 'service' / 'ext1.yml'
+    rewrite(ext_file, ext_file.read_text().replace('/ext1/', '/edited/'))
+    test_cases = list(provider(spec_dir, aug_dir, cache_dir).cases())
+    assert '/edited/0' in [test_case['url'] for test_case in test_cases]
+    assert '/ext1/0' not in [test_case['url'] for test_case in test_cases]
+    
+    # Only the edited file's snapshot was replaced
+    after = snapshot_paths(cache_dir)
+    assert len(after) == 4
+    assert len(set(before) - set(after)) == 1
+    assert cached_cases(spec_dir, aug_dir, cache_dir, monkeypatch) == test_cases
+
+def test_edited_augmentation_data_invalidates_snapshot(spec_dir, aug_dir, cache_dir, monkeypatch):
+    def notes():
+        return [
+            test_case.get('note')
+            for test_case in provider(spec_dir, aug_dir, cache_dir).cases()
+            if test_case['url'] == '/items' and test_case['method'] == 'GET'
+        ]
+    
+    key = HTTPCaseAugmenter.key_of_case({'url': '/items', 'method': 'GET'})
+    assert notes() == [None]
+    
+    compact_file = aug_dir / 'service.yml'
+    compact_file.write_text(yaml.safe_dump({key: {'note': 'first'}}))
+    assert notes() == ['first']
+    
+    rewrite(compact_file, yaml.safe_dump({key: {'note': 'second!'}}))
+    assert notes() == ['second!']
+    
+    (aug_dir / 'service.update.yml').write_text(yaml.safe_dump([
+        {'url': '/items', 'method': 'GET', 'note': 'third'},
+    ]))
+    assert notes() == ['third']
+    assert [
+        test_case.get('note')
+        for test_case in cached_cases(spec_dir, aug_dir, cache_dir, monkeypatch)
+        if test_case['url'] == '/items' and test_case['method'] == 'GET'
+    ] == ['third']
+
+def test_body_type_magic_keeps_separate_snapshots(spec_dir, aug_dir, cache_dir):
+    plain = list(provider(spec_dir, aug_dir, cache_dir).cases())
+    magic = list(provider(spec_dir, aug_dir, cache_dir, use_body_type_magic=True).cases())
+    assert [tc['request body'] for tc in magic if tc['url'] == '/orders'][0] == {'q': 1}
+    assert list(provider(spec_dir, aug_dir, cache_dir).cases()) == plain
+
+def snapshot(size):
+    return SNAPSHOT_HEADER + pickle.dumps('x' * size)
+
+def store_aged(cache, name, size, age):
+    cache.store(name, snapshot(size))
+    path = cache.snapshot_path(name)
+    mtime = time.time_ns() - age * 10**9
+    os.utime(path, ns=(mtime, mtime))
+    return path
+
+def test_least_recently_used_evicted(cache_dir):
+    cache = SnapshotCache(cache_dir, max_bytes=10**6)
+    oldest = store_aged(cache, 'a', 1000, 300)
+    middle = store_aged(cache, 'b', 1000, 200)
+    newest = store_aged(cache, 'c', 1000, 100)
+    
+    # Loading marks a snapshot as recently used
+    assert cache.load('a') == ['x' * 1000]
+    assert [path for path, size, mtime in cache.snapshots()] == [middle, newest, oldest]
+    
+    cache.max_bytes = 2 * len(snapshot(1000))
+    assert cache.evict() == 1
+    assert [path for path, size, mtime in cache.snapshots()] == [newest, oldest]
+
+def test_store_evicts_beyond_max_bytes_but_keeps_new_snapshot(cache_dir):
+    cache = SnapshotCache(cache_dir, max_bytes=2500)
+    first = store_aged(cache, 'a', 1000, 200)
+    second = store_aged(cache, 'b', 1000, 100)
+    cache.store('c', snapshot(1000))
+    assert [path for path, size, mtime in cache.snapshots()] == [second, cache.snapshot_path('c')]
+    assert not os.path.exists(first)
+    
+    # A snapshot larger than the limit is still kept until the next store
+    cache.store('d', snapshot(5000))
+    assert [path for path, size, mtime in cache.snapshots()] == [cache.snapshot_path('d')]
+
+def test_provider_max_bytes_bounds_cache(spec_dir, aug_dir, cache_dir):
+    list(provider(spec_dir, aug_dir, cache_dir).cases())
+    sizes = [size for path, size, mtime in SnapshotCache(cache_dir).snapshots()]
+    limit = sum(sizes) - min(sizes)
+    
+    (spec_dir / 'service' / 'ext3.yml').write_text("- {url: /more, method: GET}\n")
+    list(provider(spec_dir, aug_dir, cache_dir, snapshot_cache_max_bytes=limit).cases())
+    assert sum(size for path, size, mtime in SnapshotCache(cache_dir).snapshots()) <= limit
+
+def test_clear(spec_dir, aug_dir, cache_dir):
+    list(provider(spec_dir, aug_dir, cache_dir).cases())
+    assert SnapshotCache(cache_dir).clear() == 4
+    assert snapshot_paths(cache_dir) == []
+
+def test_unreadable_snapshot_ignored(cache_dir):
+    cache = SnapshotCache(cache_dir)
+    cache.store('a', b'not a snapshot')
+    assert cache.load('a') is None
+    assert list(cache.cases('a', lambda: [{'k': 1}])) == [{'k': 1}]
+    assert cache.load('a') == [{'k': 1}]
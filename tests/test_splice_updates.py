@@ -0,0 +1,139 @@
+# Copyright 2018 PayTrace, Inc.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Regression tests of :func:`intercom_test.augmentation.compact_file.splice_updates`
+
+Each compact file below is laid out in a way that must survive splicing --
+comments, blank lines and document markers between entries, trailing
+comments, non-ASCII text, flow-style values -- and is checked with both
+``'\\n'`` and ``'\\r\\n'`` line endings.
+"""
+
+from io import StringIO
+import pytest
+import yaml
+from intercom_test import yaml_tools
+from intercom_test.augmentation.compact_file import (
+    indexed_case_keys,
+    case_keys,
+    splice_updates,
+)
+
+# (original text, updates, expected text)
+CASES = {
+    'comment before next key': (
+        "k1:\n  a: 1\n\n# notes about k2\nk2:\n  b: 2\n",
+        {'k1': {'a': 9}},
+        "k1:\n  a: 9\n\n# notes about k2\nk2:\n  b: 2\n",
+    ),
+    'document markers': (
+        "k1:\n  a: 1\n---\nk2:\n  b: 2\n...\n---\n# c\nk3:\n  c: 3 # tail\n\n# end\n",
+        {'k1': {'a': 9}, 'k3': {'c': 4}},
+        "k1:\n  a: 9\n---\nk2:\n  b: 2\n...\n---\n# c\nk3:\n  c: 4\n\n# end\n",
+    ),
+    'addition after last entry': (
+        "k1:\n  a: 1\n# c\nk2:\n  b: 2\n# end\n",
+        {'k2': {'b': 7}, 'k0': {'z': 1}},
+        "k1:\n  a: 1\n# c\nk2:\n  b: 7\nk0:\n  z: 1\n# end\n",
+    ),
+    'flow value': (
+        "k1: {a: 1,\n  b: 2}  # t\n# c\nk2: x\n",
+        {'k1': {'a': 2}},
+        "k1:\n  a: 2\n# c\nk2: x\n",
+    ),
+    'empty value': (
+        "k1:\n\n# c1\nk2: x\n",
+        {'k1': {'a': 1}},
+        "k1:\n  a: 1\n\n# c1\nk2: x\n",
+    ),
+    'non-ASCII text': (
+        "# café ☕\nk1:\n  a: \"naïve\"   # ünïcode\n\n\nk2:\n  b: 中文\n  c: 'é'\n# fin ✓\n",
+        {'k2': {'b': 'ok'}},
+        "# café ☕\nk1:\n  a: \"naïve\"   # ünïcode\n\n\nk2:\n  b: ok\n# fin ✓\n",
+    ),
+    'untouched entries between updated ones': (
+        "k1:\n  a: 1\n\n\n# keep   me \nk2:\n  b:   [1,  2]  # spacing\n\n  c: |\n    text\n\nk3:\n  z: 0\n",
+        {'k1': {'a': 2}, 'k3': {'z': 1}},
+        "k1:\n  a: 2\n\n\n# keep   me \nk2:\n  b:   [1,  2]  # spacing\n\n  c: |\n    text\n\nk3:\n  z: 1\n",
+    ),
+}
+
+NEWLINES = {'LF': '\n', 'CRLF': '\r\n'}
+
+def write_text(file_path, text, newline):
+    with open(str(file_path), 'w', encoding='utf8', newline=newline) as outstream:
+        outstream.write(text)
+
+def read_text(file_path):
+    with open(str(file_path), encoding='utf8', newline='') as instream:
+        return instream.read()
+
+@pytest.mark.parametrize('newline', sorted(NEWLINES))
+@pytest.mark.parametrize('name', sorted(CASES))
+def test_untouched_text_kept_exactly(tmp_path, name, newline):
+    original, updates, expected = CASES[name]
+    newline = NEWLINES[newline]
+    file_path = tmp_path / 'compact.yml'
+    write_text(file_path, original, newline)
+    
+    assert splice_updates(str(file_path), updates)
+    assert read_text(file_path) == expected.replace('\n', newline)
+
+@pytest.mark.parametrize('newline', sorted(NEWLINES))
+def test_index_matches_spliced_file(tmp_path, newline):
+    original, updates, _ = CASES['untouched entries between updated ones']
+    file_path = tmp_path / 'compact.yml'
+    write_text(file_path, original, NEWLINES[newline])
+    
+    assert splice_updates(str(file_path), dict(updates, k4={'new': 'é'}))
+    assert sorted(indexed_case_keys(str(file_path))) == sorted(case_keys(str(file_path)))
+
+def test_flow_style_file_not_spliced(tmp_path):
+    file_path = tmp_path / 'compact.yml'
+    original = "{k1: {a: 1}, k2: {b: 2}}\n"
+    write_text(file_path, original, '\n')
+    
+    assert not splice_updates(str(file_path), {'k1': {'a': 2}})
+    assert read_text(file_path) == original
+
+KEEP_CHOMPED = "k1:\n  a: 1\n\n# c\nk2:\n  b: 2\nk3:\n  c: 3\n"
+
+def mapping_content_events(text):
+    return list(yaml_tools.parse(StringIO(text)))[2:-2]
+
+def test_keep_chomped_scalar_mid_file(tmp_path, yaml_implementation):
+    file_path = tmp_path / 'compact.yml'
+    write_text(file_path, KEEP_CHOMPED, '\n')
+    update = mapping_content_events("a: |+\n  text\n\nz: 1\n")
+    
+    assert splice_updates(str(file_path), {'k1': update})
+    text = read_text(file_path)
+    assert '...' not in text
+    assert text.endswith("\n\n# c\nk2:\n  b: 2\nk3:\n  c: 3\n")
+    assert yaml.safe_load(text) == {
+        'k1': {'a': 'text\n\n', 'z': 1},
+        'k2': {'b': 2},
+        'k3': {'c': 3},
+    }
+
+def test_keep_chomped_scalar_ending_entry_not_spliced(tmp_path, yaml_implementation):
+    # The blank lines after the entry would become part of the scalar
+    file_path = tmp_path / 'compact.yml'
+    write_text(file_path, KEEP_CHOMPED, '\n')
+    
+    update = mapping_content_events("z: 1\na: |+\n  text\n\n")
+    
+    assert not splice_updates(str(file_path), {'k1': update})
+    assert read_text(file_path) == KEEP_CHOMPED
@@ -0,0 +1,148 @@
+# Copyright 2018 PayTrace, Inc.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests of :mod:`intercom_test.augmentation.sqlite_store`"""
+
+import os.path
+import pytest
+import yaml
+from intercom_test.augmentation import sqlite_store
+from intercom_test.exceptions import MultipleAugmentationEntriesError
+from intercom_test.framework import HTTPCaseAugmenter
+
+CASE_A = {'url': '/a', 'method': 'GET'}
+CASE_B = {'url': '/b', 'method': 'POST', 'request body': {'x': 1}}
+CASE_C = {'url': '/c', 'method': 'GET'}
+
+def key(test_case):
+    return HTTPCaseAugmenter.key_of_case(test_case)
+
+def write_yaml(file_path, value):
+    with open(file_path, 'w') as outstream:
+        yaml.safe_dump(value, outstream, default_flow_style=False)
+
+def read_yaml(file_path):
+    with open(file_path) as instream:
+        return yaml.safe_load(instream)
+
+@pytest.fixture
+def compact_dir(tmp_path):
+    compact_dir = tmp_path / 'compact'
+    compact_dir.mkdir()
+    write_yaml(compact_dir / 'one.yml', {
+        key(CASE_A): {'response status': 200, 'note': 'é'},
+        key(CASE_B): {'response status': 201},
+    })
+    write_yaml(compact_dir / 'two.yml', {
+        key(CASE_C): {'response status': 404},
+    })
+    return compact_dir
+
+def test_import_update_export_round_trip(tmp_path, compact_dir):
+    aug_dir = tmp_path / 'augmentation'
+    aug_dir.mkdir()
+    db_path = str(aug_dir / HTTPCaseAugmenter.COMPACT_DB_FILE_NAME)
+    assert sqlite_store.import_compact_files(db_path, [
+        str(compact_dir / 'one.yml'),
+        str(compact_dir / 'two.yml'),
+    ]) == 3
+    
+    write_yaml(aug_dir / 'one.update.yml', [
+        dict(CASE_B, **{'response status': 202}),
+        dict(CASE_A, **{'response status': 200, 'note': 'é', 'extra': True}),
+    ])
+    write_yaml(aug_dir / 'three.update.yml', [
+        dict(CASE_A, url='/new', **{'response status': 204}),
+    ])
+    augmenter = HTTPCaseAugmenter(str(aug_dir), compact_storage='sqlite')
+    assert augmenter.augmented_test_case(dict(CASE_C))['response status'] == 404
+    augmenter.update_compact_files()
+    
+    out_dir = tmp_path / 'out'
+    out_dir.mkdir()
+    written = sqlite_store.export_compact_files(db_path, str(out_dir))
+    assert sorted(os.path.basename(p) for p in written) == ['one.yml', 'three.yml', 'two.yml']
+    assert read_yaml(out_dir / 'one.yml') == {
+        key(CASE_A): {'response status': 200, 'note': 'é', 'extra': True},
+        key(CASE_B): {'response status': 202},
+    }
+    assert read_yaml(out_dir / 'two.yml') == read_yaml(compact_dir / 'two.yml')
+    assert read_yaml(out_dir / 'three.yml') == {
+        key(dict(CASE_A, url='/new')): {'response status': 204},
+    }
+    assert os.path.exists(str(out_dir / 'one.yml') + '.idx')
+    
+    # The exported files serve as compact files for a YAML-backed augmenter
+    for update_file in ('one.update.yml', 'three.update.yml'):
+        os.remove(str(aug_dir / update_file))
+    os.remove(db_path)
+    for file_path in written:
+        os.replace(file_path, str(aug_dir / os.path.basename(file_path)))
+    augmenter = HTTPCaseAugmenter(str(aug_dir))
+    assert augmenter.augmented_test_case(dict(CASE_B))['response status'] == 202
+
+def test_import_rejects_repeated_case_key(tmp_path):
+    file_path = tmp_path / 'dup.yml'
+    file_path.write_text(
+        "{0}:\n  response status: 200\n{0}:\n  response status: 500\n".format(key(CASE_A))
+    )
+    db_path = str(tmp_path / 'store.sqlite3')
+    with pytest.raises(MultipleAugmentationEntriesError):
+        sqlite_store.import_compact_files(db_path, [str(file_path)])
+    store = sqlite_store.Store(db_path)
+    try:
+        assert store.entries() == []
+    finally:
+        store.close()
+
+def test_put_entries_rejects_duplicates_unchanged(tmp_path):
+    store = sqlite_store.Store(str(tmp_path / 'store.sqlite3'))
+    try:
+        store.put_entries('one.yml', [('k1', 'a: 1\n')])
+        with pytest.raises(MultipleAugmentationEntriesError):
+            store.put_entries('one.yml', [('k2', 'b: 1\n'), ('k2', 'b: 2\n')])
+        with pytest.raises(MultipleAugmentationEntriesError):
+            store.put_entries('one.yml', [('k2', 'b: 1\n'), ('k2', 'b: 2\n')], replace_source=True)
+        assert store.entries() == [('k1', 'one.yml')]
+        assert store.data('k1', 'one.yml') == 'a: 1\n'
+    finally:
+        store.close()
+
+def test_put_entries_rejects_cross_source_conflict(tmp_path):
+    store = sqlite_store.Store(str(tmp_path / 'store.sqlite3'))
+    try:
+        store.put_entries('one.yml', [('k1', 'a: 1\n')])
+        with pytest.raises(MultipleAugmentationEntriesError) as excinfo:
+            store.put_entries('two.yml', [('k2', 'b: 1\n'), ('k1', 'a: 2\n')])
+        assert 'k1' in str(excinfo.value)
+        assert store.entries() == [('k1', 'one.yml')]
+        
+        # Moving the entry by replacing its source is not a conflict
+        store.put_entries('one.yml', [], replace_source=True)
+        store.put_entries('two.yml', [('k1', 'a: 2\n')])
+        assert store.entries() == [('k1', 'two.yml')]
+    finally:
+        store.close()
+
+def test_import_rejects_cross_source_conflict(tmp_path, compact_dir):
+    aug_dir = tmp_path / 'augmentation'
+    aug_dir.mkdir()
+    db_path = str(aug_dir / HTTPCaseAugmenter.COMPACT_DB_FILE_NAME)
+    sqlite_store.import_compact_files(db_path, [str(compact_dir / 'one.yml')])
+    write_yaml(compact_dir / 'other.yml', {key(CASE_A): {'response status': 500}})
+    with pytest.raises(MultipleAugmentationEntriesError):
+        sqlite_store.import_compact_files(db_path, [str(compact_dir / 'other.yml')])
+    augmenter = HTTPCaseAugmenter(str(aug_dir), compact_storage='sqlite')
+    assert augmenter.augmented_test_case(dict(CASE_A))['response status'] == 200
@@ -0,0 +1,163 @@
+# Copyright 2018 PayTrace, Inc.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests of :mod:`intercom_test.stub_server`"""
+
+import http.client
+import json
+import socket
+import threading
+import pytest
+from intercom_test.stub_server import CaseResponder, StubServer, response_parts
+
+CASES = [
+    {
+        'url': '/items', 'method': 'POST',
+        'request body': {'name': 'widget'},
+        'response status': 201,
+        'response body': {'id': 1},
+    },
+    {
+        'url': '/items', 'method': 'GET',
+        'response status': 200,
+        'response headers': {'content-length': '999', 'Transfer-Encoding': 'chunked', 'content-type': 'text/csv', 'X-Case': 'list'},
+        'response body': 'id\n1\n',
+    },
+    {
+        'url': '/items/1', 'method': 'DELETE',
+        'response status': 204,
+        'response body': {'ignored': True},
+    },
+]
+
+@pytest.fixture
+def server():
+    server = StubServer(('127.0.0.1', 0), CaseResponder(CASES))
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+def connect(server):
+    return http.client.HTTPConnection(*server.server_address, timeout=5)
+
+def raw_exchange(server, request):
+    """Send raw *request* bytes and get everything sent back before the server closes"""
+    with socket.create_connection(server.server_address, timeout=5) as sock:
+        sock.sendall(request)
+        response = b''
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                return response
+            response += data
+
+def test_case_headers_do_not_override_framing():
+    status, headers, payload = response_parts(CASES[1])
+    assert headers == {'content-type': 'text/csv', 'X-Case': 'list'}
+    assert payload == b'id\n1\n'
+
+def test_single_content_length(server):
+    conn = connect(server)
+    conn.request('GET', '/items')
+    response = conn.getresponse()
+    assert response.status == 200
+    assert response.read() == b'id\n1\n'
+    header_names = [name.lower() for name, _ in response.getheaders()]
+    assert header_names.count('content-length') == 1
+    assert header_names.count('content-type') == 1
+    assert 'transfer-encoding' not in header_names
+    assert response.getheader('Content-Length') == '5'
+
+def test_chunked_body_keeps_connection_usable(server):
+    conn = connect(server)
+    body = json.dumps({'name': 'widget'}).encode('utf-8')
+    conn.request('POST', '/items', body=iter([body[:5], body[5:]]), encode_chunked=True)
+    response = conn.getresponse()
+    assert response.status == 201
+    assert json.loads(response.read()) == {'id': 1}
+    
+    # The next request on the connection is read from where the body ended
+    conn.request('GET', '/items')
+    response = conn.getresponse()
+    assert response.status == 200
+    assert response.read() == b'id\n1\n'
+    assert server.request_counts == {'matched': 2}
+
+def test_chunk_extensions_and_trailers(server):
+    response = raw_exchange(server, (
+        b'POST /items HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n'
+        b'a;ext=1\r\n{"name": "\r\n8\r\nwidget"}\r\n0\r\nX-Trailer: t\r\n\r\n'
+        b'DELETE /items/1 HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n'
+    ))
+    assert response.startswith(b'HTTP/1.1 201 ')
+    assert response.count(b'HTTP/1.1 ') == 2
+    assert b'{"id": 1}HTTP/1.1 204 ' in response
+
+@pytest.mark.parametrize('chunked_body', [
+    b'zz\r\nabc\r\n0\r\n\r\n',
+    b'-3\r\nabc\r\n0\r\n\r\n',
+    b'5\r\nabc\r\n0\r\n\r\n',
+])
+def test_malformed_chunked_body_closes_connection(server, chunked_body):
+    response = raw_exchange(server, (
+        b'POST /items HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n'
+        + chunked_body
+        + b'GET /items HTTP/1.1\r\nHost: x\r\n\r\n'
+    ))
+    assert response.startswith(b'HTTP/1.1 400 ')
+    assert b'Connection: close' in response
+    assert response.count(b'HTTP/1.1 ') == 1
+
+def test_unsupported_transfer_coding(server):
+    response = raw_exchange(server, (
+        b'POST /items HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: gzip, chunked\r\n\r\n'
+        b'0\r\n\r\n'
+    ))
+    assert response.startswith(b'HTTP/1.1 501 ')
+    assert server.request_counts == {'unmatched': 1}
+
+def test_invalid_content_length(server):
+    response = raw_exchange(server, (
+        b'POST /items HTTP/1.1\r\nHost: x\r\nContent-Length: -1\r\n\r\n'
+    ))
+    assert response.startswith(b'HTTP/1.1 400 ')
+
+def test_no_body_for_204(server):
+    conn = connect(server)
+    conn.request('DELETE', '/items/1')
+    response = conn.getresponse()
+    assert response.status == 204
+    assert response.getheader('Content-Length') is None
+    assert response.read() == b''
+
+def test_head_answered_from_get(server):
+    conn = connect(server)
+    conn.request('HEAD', '/items')
+    response = conn.getresponse()
+    assert response.status == 200
+    assert response.getheader('Content-Length') == '5'
+    assert response.read() == b''
+
+def test_unmatched_request(server):
+    conn = connect(server)
+    conn.request('POST', '/items', body=b'{"name": "other"}')
+    response = conn.getresponse()
+    assert response.status == 404
+    assert json.loads(response.read())['url'] == '/items'
@@ -0,0 +1,145 @@
+# Copyright 2018 PayTrace, Inc.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Differential tests of :mod:`intercom_test.yaml_tools` against PyYAML
+
+The events and values :mod:`~intercom_test.yaml_tools` produces directly
+must be those PyYAML produces by way of YAML text or composed nodes, with
+both the libyaml and pure-Python implementations.
+"""
+
+from io import StringIO
+import pytest
+import yaml
+from intercom_test import yaml_tools
+
+SHARED_LIST = [1, 'two']
+SHARED_MAPPING = {'k': 'v'}
+
+DUMPED_VALUES = {
+    'plain strings': ['text', 'two words', 'é', 'x' * 200],
+    'strings needing quotes': [
+        '', ' leading', 'trailing ', 'a: b', 'a #b', '#x', '- x', '? x',
+        '*x', '&x', '!x', '%x', '@x', '`x', '|', '>', "'quoted'", '"quoted"',
+        'tab\there', '\x07', '{x}', '[x]', 'x,', '---', '...',
+    ],
+    'strings resolving to other types': [
+        '123', '-1', '0x1F', '0o17', '1_000', '1.5', '1e3', '.inf', '.NaN',
+        'yes', 'No', 'on', 'OFF', 'true', 'null', '~', '2001-12-14', '<<', '=',
+    ],
+    'multi-line strings': [
+        'a\nb', 'a\n', 'a\n\n', '\na', ' a\nb', 'a \nb', 'a\n\nb\n', 'a\r\nb',
+    ],
+    'other scalars': [
+        None, True, False, 0, -12, 3.5, float('inf'), 1e100, b'bytes',
+    ],
+    'non-string keys': {
+        1: 'int', 2.5: 'float', None: 'null', True: 'bool', 'str': 'str',
+        (1, 2): 'tuple', 'a\nb': 'multi-line', 'k' * 200: 'long',
+    },
+    'nested collections': {
+        'map': {'a': {'b': {'c': [1, [2, [3]]]}}},
+        'seq': [[1, 2], {'a': 1}, [{'b': [2]}]],
+    },
+    'empty collections': {'map': {}, 'seq': [], 'in seq': [{}, [], ''], 'key': {'': {}}},
+    'aliases': {
+        'list': SHARED_LIST, 'list again': SHARED_LIST,
+        'mapping': SHARED_MAPPING, 'in seq': [SHARED_MAPPING, SHARED_LIST],
+    },
+    'block scalar styles': {'text': 'line\n' * 3, 'kept': 'line\n\n'},
+}
+
+def event_signature(event):
+    return (
+        type(event).__name__,
+        getattr(event, 'anchor', None),
+        getattr(event, 'tag', None),
+        getattr(event, 'implicit', None),
+        getattr(event, 'value', None),
+        getattr(event, 'style', None),
+        getattr(event, 'flow_style', None),
+    )
+
+def parsed_content_events(text):
+    return list(yaml_tools.parse(StringIO(text)))[2:-2]
+
+def emitted(content_events):
+    return yaml_tools.emit([
+        yaml.StreamStartEvent(),
+        yaml.DocumentStartEvent(explicit=False),
+        *content_events,
+        yaml.DocumentEndEvent(explicit=False),
+        yaml.StreamEndEvent(),
+    ])
+
+@pytest.mark.parametrize('value', list(DUMPED_VALUES.values()), ids=list(DUMPED_VALUES))
+def test_content_events_match_parsed_dump(yaml_implementation, value):
+    events = list(yaml_tools.content_events(value))
+    text = yaml_tools.dump(value)
+    
+    assert list(map(event_signature, events)) == list(map(event_signature, parsed_content_events(text)))
+    assert emitted(events) == text
+
+LOADED_TEXTS = {
+    'tags': "[!!str 123, !!int '5', !!float 1, !!str yes, !!null '', !!binary aGk=, ! 12]\n",
+    'tagged collections': "set: !!set {a, b}\nomap: !!omap [a: 1, b: 2]\nmap: !!map {a: 1}\nseq: !!seq [1]\n",
+    'merge keys': "base: &base {a: 1, b: 2}\nmerged:\n  <<: *base\n  b: 3\nlist:\n  <<: [*base, {c: 4}]\n",
+    'ints': "[0, -12, +12, 0x1F, 0o17, 017, 0b101, 1_000, 190:20:30]\n",
+    'floats': "[1.5, -1.5, 1.0e+3, 6.8523015e+5, .inf, -.Inf, .NaN, 190:20:30.15, 1e3]\n",
+    'bools': "[yes, No, on, OFF, true, False, y, n]\n",
+    'nulls': "{a: ~, b: null, c: , d: Null, ~: e}\n",
+    'timestamps': "[2001-12-14, 2001-12-14t21:59:43.10-05:00]\n",
+    'strings': "- plain\n- 'single'\n- \"double\\n\"\n- |\n  block\n- >\n  folded\n",
+    'duplicate keys': "a: 1\nb: 2\na: 3\n",
+    'non-string keys': "{1: a, 2.5: b, true: c, null: d, 2001-12-14: e}\n",
+    'anchors and aliases': "a: &x [1, 2]\nb: *x\nc: &y {k: v}\nd: [*y, &z s, *z]\n",
+    'nested': "a:\n  b:\n    - c: [1, {d: []}]\n    - {}\n",
+    'value key': "{=: 1}\n",
+}
+
+def composed_and_constructed(text, *, safe_loading=True):
+    loader = yaml_tools.loader_class(safe_loading=safe_loading)(text)
+    try:
+        return loader.construct_document(loader.get_single_node())
+    finally:
+        loader.dispose()
+
+@pytest.mark.parametrize('safe_loading', [True, False], ids=['safe', 'unsafe'])
+@pytest.mark.parametrize('text', list(LOADED_TEXTS.values()), ids=list(LOADED_TEXTS))
+def test_value_from_event_stream_matches_constructed_nodes(yaml_implementation, text, safe_loading):
+    value = yaml_tools.value_from_event_stream(
+        parsed_content_events(text),
+        safe_loading=safe_loading,
+    )
+    expected = composed_and_constructed(text, safe_loading=safe_loading)
+    
+    # repr() compares NaNs and the types of keys and items
+    assert repr(value) == repr(expected)
+
+def test_value_from_event_stream_keeps_aliased_identity(yaml_implementation):
+    value = yaml_tools.value_from_event_stream(
+        parsed_content_events(LOADED_TEXTS['anchors and aliases'])
+    )
+    assert value['a'] is value['b']
+    assert value['d'][0] is value['c']
+
+def test_value_from_event_stream_unsafe_tags(yaml_implementation):
+    text = "[!!python/tuple [1, 2], !!python/complex 1+2j]\n"
+    assert yaml_tools.value_from_event_stream(
+        parsed_content_events(text),
+        safe_loading=False,
+    ) == composed_and_constructed(text, safe_loading=False) == [(1, 2), 1+2j]
+    with pytest.raises(yaml.constructor.ConstructorError):
+        yaml_tools.value_from_event_stream(parsed_content_events(text))